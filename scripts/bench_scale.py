@@ -0,0 +1,294 @@
+"""
+Usage: Benchmark the backends, the database builds and the web app on
+synthetic archives of increasing size.
+
+    python scripts/bench_scale.py --sizes 10000,100000
+    python scripts/bench_scale.py --sizes 1000000 --keep /scratch/hn1m
+
+Each archive is generated with hyper-model generate's generator, loaded with
+populate and populate-search (timed as subprocesses, like a real build), then
+AllForums and DBForums operations and key web routes (through the Flask test
+client, in a subprocess configured to use the archive) are timed on the
+largest forum, the message with the most replies and the deepest message.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import functools
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any, Callable
+
+import click
+import sqlalchemy
+from rich import print
+from rich.table import Table
+
+from hypernewsviewer.model.structure import AllForums, DBForums
+from hypernewsviewer.model.synthetic import ArchiveShape, generate
+
+
+def best_of(repeat: int, func: Callable[[], Any]) -> float:
+    """
+    Median time of repeat calls (iterators are consumed).
+    """
+    times = []
+    for _ in range(repeat):
+        timer = time.perf_counter()
+        result = func()
+        if hasattr(result, "__next__"):
+            for _ in result:
+                pass
+        times.append(time.perf_counter() - timer)
+    return statistics.median(times)
+
+
+def find_samples(db: Path) -> dict[str, str]:
+    """
+    The largest forum, the message with the most replies, and the deepest
+    message, as responses paths.
+    """
+    with contextlib.closing(sqlite3.connect(str(db))) as con:
+        (forum,) = con.execute(
+            "SELECT substr(up_url, 6, length(up_url) - 10) FROM msgs WHERE up_url NOT LIKE '/get/%/%' "
+            "GROUP BY up_url ORDER BY count(*) DESC LIMIT 1"
+        ).fetchone()
+        (busy,) = con.execute(
+            "SELECT substr(up_url, 6, length(up_url) - 10) FROM msgs WHERE up_url LIKE '/get/%/%' "
+            "GROUP BY up_url ORDER BY count(*) DESC LIMIT 1"
+        ).fetchone()
+        (deep,) = con.execute(
+            "SELECT substr(responses, 2) FROM msgs "
+            "ORDER BY length(responses) - length(replace(responses, '/', '')) DESC LIMIT 1"
+        ).fetchone()
+        (user,) = con.execute(
+            "SELECT from_ FROM msgs GROUP BY from_ ORDER BY count(*) DESC LIMIT 1"
+        ).fetchone()
+    return {"forum": forum, "busy": busy, "deep": deep, "user": user}
+
+
+def run_timed(*args: str) -> float:
+    timer = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", "hypernewsviewer.model", *args],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - timer
+
+
+def bench_backends(
+    root: Path, db: Path, samples: dict[str, str], repeat: int
+) -> dict[str, dict[str, float]]:
+    forum = samples["forum"]
+    busy_forum, busy = samples["busy"].split("/", 1)
+    deep_forum, deep = samples["deep"].split("/", 1)
+    top = busy.split("/")[0]
+    operations: dict[str, Callable[[AllForums], Any]] = {
+        "get_forum": lambda f: f.get_forum(forum),
+        "get_msg (deep)": lambda f: f.get_msg(deep_forum, deep),
+        "get_html (deep)": lambda f: f.get_html(deep_forum, deep),
+        "get_num_msgs (forum)": lambda f: f.get_num_msgs(forum, ""),
+        "get_msgs_page (forum)": lambda f: f.get_msgs_page(forum, "", limit=100),
+        "get_msg_paths (busy)": lambda f: f.get_msg_paths(busy_forum, busy),
+        "get_subtree (thread)": lambda f: f.get_subtree(busy_forum, top),
+        "get_num_msgs recursive (forum)": lambda f: f.get_num_msgs(
+            forum, "", recursive=True
+        ),
+        "get_member": lambda f: f.get_member(samples["user"]),
+    }
+    engine = sqlalchemy.create_engine(f"sqlite:///{db}")
+    backends = {
+        "AllForums": AllForums(root=root),
+        "DBForums": DBForums(root=root, engine=engine),
+    }
+    try:
+        return {
+            name: {
+                op: best_of(repeat, functools.partial(func, backend))
+                for op, func in operations.items()
+            }
+            for name, backend in backends.items()
+        }
+    finally:
+        engine.dispose()
+
+
+def bench_routes(
+    root: Path, db: Path, fts: Path, samples: dict[str, str], repeat: int
+) -> dict[str, float]:
+    env = {
+        **os.environ,
+        "HNFILES": str(root),
+        "HNDATABASE": str(db),
+        "HNFTSDATABASE": str(fts),
+        "HNSQLREPEAT": "0",
+        "HNSEARCHSLOTS": "0",
+        "HNSEARCHCACHE": "0",
+    }
+    result = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--routes",
+            json.dumps(samples),
+            "--repeat",
+            str(repeat),
+        ],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(result.stdout)  # type: ignore[no-any-return]
+
+
+def time_routes(samples: dict[str, str], repeat: int) -> None:
+    """
+    Run in a subprocess, since the app is configured when imported.
+    """
+    from hypernewsviewer.app import app  # noqa: PLC0415
+
+    top = samples["busy"].split("/")[:2]
+    urls = {
+        "get (forum)": f"/HyperNews/CMS/get/{samples['forum']}.html",
+        "get (busy)": f"/HyperNews/CMS/get/{samples['busy']}.html",
+        "get (deep)": f"/HyperNews/CMS/get/{samples['deep']}.html",
+        "thread": f"/HyperNews/CMS/thread/{'/'.join(top)}",
+        "index": "/HyperNews/CMS/index",
+        "view_members": "/HyperNews/CMS/view-members.pl",
+        "search": "/HyperNews/CMS/search?query=tracker+muon",
+        "search (forum)": f"/HyperNews/CMS/search?query=tracker&forum={samples['forum']}",
+    }
+    client = app.test_client()
+
+    def get(url: str) -> None:
+        with client.get(url) as response:
+            assert response.status_code == HTTPStatus.OK, (url, response.status_code)
+            response.get_data()
+
+    times = {
+        name: best_of(repeat, functools.partial(get, url)) for name, url in urls.items()
+    }
+    sys.stdout.write(json.dumps(times) + "\n")
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    default="10000,100000",
+    help="Comma separated numbers of messages to benchmark",
+)
+@click.option("--forums", default=20, help="Forums per archive")
+@click.option("--repeat", default=5, help="Timed runs per operation")
+@click.option(
+    "--keep",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Keep the archives and databases in this directory (reused if present)",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Also write the results as JSON, to compare runs",
+)
+@click.option("--routes", hidden=True, help="Internal: time the web routes")
+def main(
+    sizes: str,
+    forums: int,
+    repeat: int,
+    keep: Path | None,
+    output: Path | None,
+    routes: str | None,
+) -> None:
+    if routes is not None:
+        time_routes(json.loads(routes), repeat)
+        return
+
+    report: list[dict[str, Any]] = []
+    with contextlib.ExitStack() as stack:
+        base = keep or Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        for size in (int(s) for s in sizes.split(",")):
+            directory = base / str(size)
+            root, db, fts = (
+                directory / "files",
+                directory / "db.sql3",
+                directory / "fts.sql3",
+            )
+            row: dict[str, Any] = {"messages": size}
+            if not root.exists():
+                timer = time.perf_counter()
+                generate(root, ArchiveShape(messages=size, forums=forums))
+                row["generate"] = time.perf_counter() - timer
+            if not db.exists():
+                row["populate"] = run_timed(
+                    "--root", str(root), "--db", str(db), "populate"
+                )
+            if not fts.exists():
+                row["populate-search"] = run_timed(
+                    "--root",
+                    str(root),
+                    "--db",
+                    str(db),
+                    "populate-search",
+                    "--fts",
+                    str(fts),
+                )
+            samples = find_samples(db)
+            row["backends"] = bench_backends(root, db, samples, repeat)
+            row["routes"] = bench_routes(root, db, fts, samples, repeat)
+            report.append(row)
+            print(f"Finished [bold]{size}[/bold] messages")
+
+    builds = Table(title="Builds (messages per second)")
+    for name in ("Messages", "generate", "populate", "populate-search"):
+        builds.add_column(name, justify="right")
+    for row in report:
+        builds.add_row(
+            str(row["messages"]),
+            *(
+                f"{row['messages'] / row[step]:,.0f}" if step in row else "-"
+                for step in ("generate", "populate", "populate-search")
+            ),
+        )
+    print(builds)
+
+    backends = Table(title="Backend operations (ms, median)")
+    backends.add_column("Operation")
+    for row in report:
+        for name in row["backends"]:
+            backends.add_column(f"{name} {row['messages']:,}", justify="right")
+    for op in report[0]["backends"]["AllForums"]:
+        backends.add_row(
+            op,
+            *(
+                f"{times[op] * 1000:.2f}"
+                for row in report
+                for times in row["backends"].values()
+            ),
+        )
+    print(backends)
+
+    web = Table(title="Web routes (ms, median)")
+    web.add_column("Route")
+    for row in report:
+        web.add_column(f"{row['messages']:,}", justify="right")
+    for route in report[0]["routes"]:
+        web.add_row(route, *(f"{row['routes'][route] * 1000:.1f}" for row in report))
+    print(web)
+
+    if output is not None:
+        output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,289 @@
+"""
+Usage: Benchmark full text search over a synthetic corpus (or existing search
+databases), replaying a query corpus through the same search path as the
+search page, for several variants of the search database schema.
+
+    python scripts/bench_search.py --messages 200000
+    python scripts/bench_search.py --variant ordered --variant sharded
+    python scripts/bench_search.py --fts hnvfullfts.sql3 --queries my_queries.tsv
+
+The query corpus (default: scripts/bench_queries.tsv) has one query per line:
+a category, the query, and optional space separated key=value options (start,
+stop, forum, author, page), separated by tabs.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import itertools
+import json
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Iterator, Sequence
+
+import click
+import sqlalchemy
+from rich import print
+from rich.table import Table
+
+from hypernewsviewer.model.fts import (
+    FTSRow,
+    add_trigram,
+    create_fts,
+    fill_fts,
+    finish_fts,
+)
+from hypernewsviewer.search import run_search
+
+DIR = Path(__file__).parent.resolve()
+
+# The most common words, followed by a long tail of rarer ones
+COMMON_WORDS = [
+    "tracker",
+    "muon",
+    "trigger",
+    "pixel",
+    "alignment",
+    "jet",
+    "calorimeter",
+    "release",
+    "crab",
+    "dataset",
+    "luminosity",
+    "vertex",
+    "electron",
+    "photon",
+    "geometry",
+    "simulation",
+    "reconstruction",
+    "hlt",
+    "dqm",
+    "analysis",
+]
+RARE_WORDS = 20_000
+WORDS_PER_MESSAGE = 60
+
+FIRST_DATE = datetime(2005, 1, 1)
+YEARS = 17
+
+
+def make_rows(messages: int) -> list[FTSRow]:
+    """
+    Messages with Zipf distributed words, in date order.
+    """
+    rng = random.Random(42)
+    vocabulary = COMMON_WORDS + [f"term{i}" for i in range(RARE_WORDS)]
+    cum_weights = list(
+        itertools.accumulate(1 / n for n in range(1, len(vocabulary) + 1))
+    )
+    step = timedelta(days=YEARS * 365) / messages
+    rows = []
+    for i in range(messages):
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=WORDS_PER_MESSAGE)
+        release = f"CMSSW_{rng.randrange(4, 14)}_{rng.randrange(6)}_{rng.randrange(10)}"
+        rows.append(
+            (
+                f"/forum{rng.randrange(50)}/{i}",
+                FIRST_DATE + step * i,
+                " ".join(words[:6]).capitalize(),
+                f"user{rng.randrange(2000)}",
+                f"{' '.join(words)} using {release}",
+            )
+        )
+    return rows
+
+
+def build_unordered(path: Path, rows: Sequence[FTSRow]) -> list[Path]:
+    """
+    The schema before date ordering, forum columns and prefix indexes.
+    """
+    with contextlib.closing(sqlite3.connect(str(path))) as db:
+        db.execute(
+            "CREATE VIRTUAL TABLE fulltext USING FTS5(responses UNINDEXED, date UNINDEXED, title, from_, text);"
+        )
+        shuffled = list(rows)
+        random.Random(0).shuffle(shuffled)
+        db.executemany("INSERT INTO fulltext VALUES (?, ?, ?, ?, ?)", shuffled)
+        db.execute("CREATE INDEX date_index ON fulltext_content(c1);")
+        db.execute("INSERT INTO fulltext(fulltext) VALUES('optimize');")
+        db.commit()
+    return [path]
+
+
+def build_ordered(
+    path: Path, rows: Sequence[FTSRow], *, trigram: bool = False
+) -> list[Path]:
+    """
+    The schema made by populate-search.
+    """
+    with contextlib.closing(sqlite3.connect(str(path))) as db:
+        create_fts(db)
+        fill_fts(db, rows)
+        finish_fts(db)
+        if trigram:
+            add_trigram(db, text=True)
+    return [path]
+
+
+def build_sharded(path: Path, rows: Sequence[FTSRow]) -> list[Path]:
+    """
+    One database per year, like populate-search --shard-by-year.
+    """
+    path.mkdir()
+    return [
+        build_ordered(path / f"fulltext-{year}.sql3", list(year_rows))[0]
+        for year, year_rows in itertools.groupby(rows, lambda row: row[1].year)
+    ]
+
+
+VARIANTS: dict[str, Callable[[Path, Sequence[FTSRow]], list[Path]]] = {
+    "unordered": build_unordered,
+    "ordered": build_ordered,
+    "sharded": build_sharded,
+    "trigram": lambda path, rows: build_ordered(path, rows, trigram=True),
+}
+
+
+def read_queries(path: Path) -> list[tuple[str, str, dict[str, Any]]]:
+    queries = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if not line.strip() or line.startswith("#"):
+            continue
+        category, query, *rest = line.split("\t")
+        options: dict[str, Any] = dict(
+            item.split("=", 1) for item in " ".join(rest).split()
+        )
+        if "page" in options:
+            options["page"] = int(options["page"])
+        queries.append((category, query, options))
+    return queries
+
+
+def run_queries(
+    paths: Sequence[Path],
+    queries: Sequence[tuple[str, str, dict[str, Any]]],
+    repeat: int,
+    count: bool,
+) -> dict[str, list[float]]:
+    """
+    Time each query (after a warm up run), returning the times by category.
+    """
+    engines = [
+        sqlalchemy.create_engine(f"sqlite:///file:{p}?mode=ro&uri=true") for p in paths
+    ]
+    times: dict[str, list[float]] = {}
+    try:
+        for category, query, options in queries:
+            for n in range(repeat + 1):
+                timer = time.perf_counter()
+                run_search(engines, query, count=count, seconds=600, **options)
+                if n:
+                    times.setdefault(category, []).append(time.perf_counter() - timer)
+    finally:
+        for engine in engines:
+            engine.dispose()
+    return times
+
+
+def percentiles(times: list[float]) -> dict[str, float]:
+    if len(times) == 1:
+        return {"p50": times[0], "p95": times[0], "p99": times[0]}
+    cuts = statistics.quantiles(times, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+def iter_report(
+    results: dict[str, dict[str, list[float]]],
+) -> Iterator[tuple[str, str, int, dict[str, float]]]:
+    for variant, by_category in results.items():
+        for category, times in by_category.items():
+            yield variant, category, len(times), percentiles(times)
+        everything = list(itertools.chain.from_iterable(by_category.values()))
+        yield variant, "all", len(everything), percentiles(everything)
+
+
+@click.command()
+@click.option("--messages", default=100_000, help="Number of messages to generate")
+@click.option(
+    "--variant",
+    "variants",
+    type=click.Choice(list(VARIANTS)),
+    multiple=True,
+    help="Schema variants to compare (default: all)",
+)
+@click.option(
+    "--fts",
+    type=click.Path(exists=True, path_type=Path),
+    help="Benchmark an existing search database (or directory of shards) instead",
+)
+@click.option(
+    "--queries",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=DIR / "bench_queries.tsv",
+    help="Query corpus",
+)
+@click.option("--repeat", default=5, help="Timed runs per query")
+@click.option(
+    "--count/--no-count",
+    default=True,
+    help="Count the hits and facets of each search (like HNSEARCHCOUNT)",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Also write the results as JSON, to compare runs",
+)
+def main(
+    messages: int,
+    variants: tuple[str, ...],
+    fts: Path | None,
+    queries: Path,
+    repeat: int,
+    count: bool,
+    output: Path | None,
+) -> None:
+    query_corpus = read_queries(queries)
+    results: dict[str, dict[str, list[float]]] = {}
+
+    if fts is not None:
+        paths = sorted(fts.glob("*.sql3")) if fts.is_dir() else [fts]
+        results[fts.name] = run_queries(paths, query_corpus, repeat, count)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            rows = make_rows(messages)
+            for variant in variants or VARIANTS:
+                timer = time.perf_counter()
+                paths = VARIANTS[variant](Path(tmp) / variant, rows)
+                size = sum(p.stat().st_size for p in paths)
+                print(
+                    f"Built [bold]{variant}[/bold] in {time.perf_counter() - timer:.1f}s, {size / 1024**2:.1f} MB"
+                )
+                results[variant] = run_queries(paths, query_corpus, repeat, count)
+
+    table = Table(title=f"Search latency (ms), {repeat} runs per query")
+    for name in ("Variant", "Category", "Runs", "p50", "p95", "p99"):
+        table.add_column(
+            name, justify="left" if name in {"Variant", "Category"} else "right"
+        )
+    report = []
+    for variant, category, runs, cuts in iter_report(results):
+        table.add_row(
+            variant,
+            category,
+            str(runs),
+            *(f"{cuts[p] * 1000:.1f}" for p in ("p50", "p95", "p99")),
+        )
+        report.append({"variant": variant, "category": category, "runs": runs, **cuts})
+    print(table)
+
+    if output is not None:
+        output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,355 @@
+"""
+Usage: Load test the web app with a weighted mix of requests, and report the
+throughput and tail latency for several concurrency settings.
+
+    python scripts/loadtest.py --processes 1,3 --threads 1,4
+    python scripts/loadtest.py --in-process --concurrency 8
+
+The archive is read from HNFILES, HNDATABASE and HNFTSDATABASE (or the
+options), and the database is needed to pick the messages, forums and members
+to request. By default the app is served by gunicorn with config.py, once per
+combination of GUNICORN_PROCESSES and GUNICORN_THREADS; with --in-process,
+requests go straight to the WSGI callable in this process instead (so it
+measures the app, not the server). The request mix (default:
+scripts/loadtest_mix.tsv) has a weight, a category and a URL per line.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import itertools
+import os
+import random
+import re
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http import HTTPStatus
+from pathlib import Path
+from typing import Callable, Iterator, Tuple
+
+import click
+from rich import print
+from rich.table import Table
+
+DIR = Path(__file__).parent.resolve()
+ROOT = DIR.parent
+
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+# Seconds to wait for gunicorn to start serving
+STARTUP_TIMEOUT = 60
+
+# (category, seconds, ok)
+Sample = Tuple[str, float, bool]
+
+
+def read_mix(path: Path) -> list[tuple[int, str, str]]:
+    mix = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if not line.strip() or line.startswith("#"):
+            continue
+        weight, category, url = line.split("\t")
+        mix.append((int(weight), category, url))
+    return mix
+
+
+def read_values(root: Path, db: Path, limit: int = 2000) -> dict[str, list[str]]:
+    """
+    Values for the URL placeholders, picked at random from the archive.
+    """
+    with contextlib.closing(sqlite3.connect(f"file:{db}?mode=ro", uri=True)) as con:
+
+        def column(query: str) -> list[str]:
+            return [row[0] for row in con.execute(query, (limit,))]
+
+        msgs = column("SELECT substr(responses, 2) FROM msgs ORDER BY random() LIMIT ?")
+        titles = column("SELECT title FROM msgs ORDER BY random() LIMIT ?")
+        names = column("SELECT name FROM people ORDER BY random() LIMIT ?")
+        forums = column("SELECT substr(responses, 2) FROM forums LIMIT ?")
+
+    aux = root / "AUX"
+    attachments = (
+        [
+            p.relative_to(aux).as_posix()
+            for p in itertools.islice(aux.rglob("*"), limit * 10)
+            if p.is_file()
+        ]
+        if aux.is_dir()
+        else []
+    )
+    return {
+        "msg": msgs,
+        "thread": [m for m in msgs if m.count("/") == 1],
+        "forum": forums,
+        "name": [w for n in names for w in n.split()[-1:]],
+        "word": [w for t in titles for w in re.findall(r"\w{4,}", t)],
+        "attachment": attachments,
+    }
+
+
+def make_urls(
+    mix: list[tuple[int, str, str]], values: dict[str, list[str]], seed: int
+) -> Iterator[tuple[str, str]]:
+    """
+    An endless stream of (category, URL), skipping the URLs with placeholders
+    that have no values in this archive.
+    """
+    usable = []
+    for weight, category, url in mix:
+        if all(values.get(name) for name in PLACEHOLDER.findall(url)):
+            usable.append((weight, category, url))
+        else:
+            print(f"[yellow]Skipping {url}, nothing to fill it in with")
+    rng = random.Random(seed)
+    weights = [weight for weight, _, _ in usable]
+    while True:
+        ((_, category, url),) = rng.choices(usable, weights=weights)
+        yield category, PLACEHOLDER.sub(lambda m: rng.choice(values[m[1]]), url)
+
+
+def run_load(
+    fetch: Callable[[str], bool],
+    urls: Iterator[tuple[str, str]],
+    *,
+    concurrency: int,
+    duration: float,
+    warmup: float,
+) -> tuple[list[Sample], float]:
+    """
+    Request URLs from concurrency threads for warmup + duration seconds,
+    returning the samples after the warm up and the time they took.
+    """
+    lock = threading.Lock()
+    samples: list[Sample] = []
+    start = time.perf_counter()
+    measure_from = start + warmup
+    stop = measure_from + duration
+
+    def worker() -> None:
+        while True:
+            with lock:
+                category, url = next(urls)
+            timer = time.perf_counter()
+            if timer >= stop:
+                return
+            ok = fetch(url)
+            done = time.perf_counter()
+            if timer >= measure_from:
+                with lock:
+                    samples.append((category, done - timer, ok))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - measure_from
+
+
+def http_fetcher(base: str) -> Callable[[str], bool]:
+    def fetch(url: str) -> bool:
+        try:
+            with urllib.request.urlopen(base + url, timeout=60) as response:
+                response.read()
+                return bool(response.status < HTTPStatus.BAD_REQUEST)
+        except (urllib.error.URLError, OSError):
+            return False
+
+    return fetch
+
+
+def wsgi_fetcher() -> Callable[[str], bool]:
+    # The app reads its settings when imported
+    from werkzeug.test import Client  # noqa: PLC0415
+
+    from hypernewsviewer.app import app  # noqa: PLC0415
+
+    clients = threading.local()
+
+    def fetch(url: str) -> bool:
+        if not hasattr(clients, "client"):
+            clients.client = Client(app)
+        response = clients.client.get(url)
+        response.get_data()
+        response.close()
+        return bool(response.status_code < HTTPStatus.BAD_REQUEST)
+
+    return fetch
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+@contextlib.contextmanager
+def gunicorn(processes: int, threads: int, env: dict[str, str]) -> Iterator[str]:
+    """
+    Serve the app with gunicorn and config.py, yielding the base URL.
+    """
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--config",
+            str(ROOT / "config.py"),
+            "--bind",
+            f"127.0.0.1:{port}",
+            "wsgi:application",
+        ],
+        cwd=ROOT,
+        env={
+            **env,
+            "GUNICORN_PROCESSES": str(processes),
+            "GUNICORN_THREADS": str(threads),
+        },
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while not http_fetcher(base)("/HyperNews/CMS/top.pl"):
+            if server.poll() is not None or time.monotonic() > deadline:
+                msg = f"gunicorn did not start (exit code {server.poll()})"
+                raise click.ClickException(msg)
+            time.sleep(0.2)
+        yield base
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def percentile(times: list[float], p: int) -> float:
+    if len(times) == 1:
+        return times[0]
+    return statistics.quantiles(times, n=100, method="inclusive")[p - 1]
+
+
+@click.command()
+@click.option(
+    "--root",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default=os.environ.get("HNFILES"),
+    required=True,
+    help="Archive root (default: HNFILES)",
+)
+@click.option(
+    "--db",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=os.environ.get("HNDATABASE"),
+    required=True,
+    help="Database (default: HNDATABASE)",
+)
+@click.option(
+    "--fts",
+    type=click.Path(exists=True, path_type=Path),
+    default=os.environ.get("HNFTSDATABASE"),
+    help="Search database (default: HNFTSDATABASE)",
+)
+@click.option(
+    "--mix",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=DIR / "loadtest_mix.tsv",
+    help="Request mix",
+)
+@click.option("--processes", default="1,3", help="GUNICORN_PROCESSES values to try")
+@click.option("--threads", default="1,4", help="GUNICORN_THREADS values to try")
+@click.option(
+    "--in-process",
+    is_flag=True,
+    help="Call the WSGI app in this process, instead of running gunicorn",
+)
+@click.option("--concurrency", default=16, help="Concurrent clients")
+@click.option("--duration", default=20.0, help="Seconds to measure each setting")
+@click.option("--warmup", default=3.0, help="Seconds of load before measuring")
+@click.option("--seed", default=0, help="Random seed for the request mix")
+def main(
+    root: Path,
+    db: Path,
+    fts: Path | None,
+    mix: Path,
+    processes: str,
+    threads: str,
+    in_process: bool,
+    concurrency: int,
+    duration: float,
+    warmup: float,
+    seed: int,
+) -> None:
+    env = {
+        **os.environ,
+        "HNFILES": str(root.resolve()),
+        "HNDATABASE": str(db.resolve()),
+    }
+    if fts is not None:
+        env["HNFTSDATABASE"] = str(fts.resolve())
+    # Repeated query warnings for every page would drown out the results
+    env.setdefault("HNSQLREPEAT", "0")
+    values = read_values(root, db)
+    requests = read_mix(mix)
+
+    results: dict[str, tuple[list[Sample], float]] = {}
+    if in_process:
+        os.environ.update(env)
+        fetch = wsgi_fetcher()
+        urls = make_urls(requests, values, seed)
+        results["in-process"] = run_load(
+            fetch, urls, concurrency=concurrency, duration=duration, warmup=warmup
+        )
+    else:
+        settings = itertools.product(
+            (int(p) for p in processes.split(",")), (int(t) for t in threads.split(","))
+        )
+        for n_processes, n_threads in settings:
+            name = f"{n_processes} processes x {n_threads} threads"
+            print(f"Load testing [bold]{name}[/bold]")
+            with gunicorn(n_processes, n_threads, env) as base:
+                urls = make_urls(requests, values, seed)
+                results[name] = run_load(
+                    http_fetcher(base),
+                    urls,
+                    concurrency=concurrency,
+                    duration=duration,
+                    warmup=warmup,
+                )
+
+    table = Table(title=f"Load test, {concurrency} clients (latency in ms)")
+    for column in ("Server", "Category", "Requests", "Errors", "Req/s"):
+        table.add_column(
+            column, justify="left" if column in {"Server", "Category"} else "right"
+        )
+    for column in ("p50", "p95", "p99", "max"):
+        table.add_column(column, justify="right")
+    for name, (samples, elapsed) in results.items():
+        categories = sorted({category for category, _, _ in samples})
+        for category in ["all", *categories]:
+            chosen = [s for s in samples if category in {"all", s[0]}]
+            if not chosen:
+                continue
+            times = [seconds for _, seconds, _ in chosen]
+            table.add_row(
+                name if category == "all" else "",
+                category,
+                str(len(chosen)),
+                str(sum(not ok for _, _, ok in chosen)),
+                f"{len(chosen) / elapsed:.1f}",
+                *(f"{percentile(times, p) * 1000:.1f}" for p in (50, 95, 99)),
+                f"{max(times) * 1000:.1f}",
+            )
+        table.add_section()
+    print(table)
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Generator
+
+# Slots are flock()ed files, not available on Windows
+LOCKING = sys.platform != "win32"
+if LOCKING:
+    import fcntl
+
+__all__ = ["SlotLimiter"]
+
+# Seconds between attempts to get a slot while waiting
+POLL_INTERVAL = 0.02
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SlotLimiter:
+    """
+    Limit concurrent work over all the worker processes on a node, using lock
+    files in a shared directory. Work holds one of the run slots; if they are
+    all taken, a request holds one of the queue slots while it waits (up to
+    wait seconds) for a run slot. If the queue is full too, or the wait runs
+    out, the request is rejected. Locks are released by the OS if a worker
+    dies. On Windows, nothing is limited.
+
+    A slot holder writes its process id into the slot file, and empties it
+    before letting go, so the slots in use can be counted by reading the
+    files, without taking (and so competing for) the locks.
+    """
+
+    def __init__(
+        self, directory: Path, *, name: str, slots: int, queue: int, wait: float
+    ) -> None:
+        self.directory = directory
+        self.name = name
+        self.slots = slots
+        self.queue = queue
+        self.wait = wait
+        self.admitted = 0
+        self.rejected = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self._lock = threading.Lock()
+        if self.enabled:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return LOCKING and self.slots > 0
+
+    def _path(self, kind: str, i: int) -> Path:
+        return self.directory / f"{self.name}-{kind}-{i}.lock"
+
+    def _try_lock(self, kind: str, count: int) -> int | None:
+        """
+        Lock one of the slot files of a kind, returning its descriptor.
+        """
+        for i in random.sample(range(count), count):
+            fd = self._try_lock_one(self._path(kind, i))
+            if fd is not None:
+                os.ftruncate(fd, 0)
+                os.write(fd, f"{os.getpid()}\n".encode())
+                return fd
+        return None
+
+    @staticmethod
+    def _unlock(fd: int) -> None:
+        os.ftruncate(fd, 0)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _count_held(self, kind: str, count: int) -> int:
+        """
+        Count the slot files of a kind naming a running process (a worker
+        that died leaves its id behind, but not its lock).
+        """
+        held = 0
+        for i in range(count):
+            try:
+                pid = int(self._path(kind, i).read_text(encoding="ascii") or 0)
+            except (OSError, ValueError):
+                continue
+            if pid and _is_running(pid):
+                held += 1
+        return held
+
+    @staticmethod
+    def _try_lock_one(path: Path) -> int | None:
+        """
+        Each attempt opens the file again, since flock locks are shared by all
+        the users of a descriptor (like other threads).
+        """
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def running(self) -> int:
+        """
+        Number of run slots in use on the node.
+        """
+        return self._count_held("run", self.slots) if self.enabled else 0
+
+    def waiting(self) -> int:
+        """
+        Number of requests waiting for a run slot on the node (the queue depth).
+        """
+        return self._count_held("queue", self.queue) if self.enabled else 0
+
+    @contextlib.contextmanager
+    def acquire(self) -> Generator[bool, None, None]:
+        """
+        Hold a run slot for the duration of the block. Yields False (without
+        a slot) if the request was rejected.
+        """
+        if not self.enabled:
+            yield True
+            return
+
+        run = self._try_lock("run", self.slots)
+        if run is None:
+            run = self._wait_for_slot()
+        with self._lock:
+            if run is None:
+                self.rejected += 1
+            else:
+                self.admitted += 1
+        if run is None:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            self._unlock(run)
+
+    def _wait_for_slot(self) -> int | None:
+        waiter = self._try_lock("queue", self.queue) if self.queue > 0 else None
+        if waiter is None:
+            return None
+
+        timer = time.perf_counter()
+        deadline = timer + self.wait
+        run = None
+        try:
+            while run is None and time.perf_counter() < deadline:
+                time.sleep(POLL_INTERVAL)
+                run = self._try_lock("run", self.slots)
+        finally:
+            self._unlock(waiter)
+        with self._lock:
+            self.waited += 1
+            self.wait_seconds += time.perf_counter() - timer
+        return run
+
+    def stats(self) -> dict[str, float]:
+        """
+        Node-wide slot use, and this process's counters.
+        """
+        with self._lock:
+            counters = {
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "waited": self.waited,
+                "wait_seconds": self.wait_seconds,
+            }
+        return {
+            "slots": self.slots,
+            "running": self.running(),
+            "queue": self.queue,
+            "waiting": self.waiting(),
+            **counters,
+        }
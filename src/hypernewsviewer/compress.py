@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import functools
+import gzip
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Callable, Iterable, Iterator
+
+try:
+    import brotli  # type: ignore[import-not-found]
+except ModuleNotFoundError:
+    brotli = None
+
+__all__ = ["ENCODINGS", "CompressedCache", "compress", "compress_stream"]
+
+# Preferred first; brotli is only used if it happens to be installed
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+# Bytes of a streamed body gathered before the compressed data is flushed
+STREAM_FLUSH_SIZE = 16 * 1024
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=5)  # type: ignore[no-any-return]
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    msg = f"Unsupported encoding {encoding}"
+    raise ValueError(msg)
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """
+    Compress a streamed body as it is produced. Small chunks (like those of a
+    streamed template) are gathered up to STREAM_FLUSH_SIZE, then flushed, so
+    the client can decode each part of the page as it arrives.
+    """
+    process: Callable[[bytes], bytes]
+    flush: Callable[[], bytes]
+    finish: Callable[[], bytes]
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=5)
+        process, flush, finish = (
+            compressor.process,
+            compressor.flush,
+            compressor.finish,
+        )
+    elif encoding == "gzip":
+        # wbits 31 writes a gzip header (with no mtime, like compress)
+        zcompressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        process, finish = zcompressor.compress, zcompressor.flush
+        flush = functools.partial(zcompressor.flush, zlib.Z_SYNC_FLUSH)
+    else:
+        msg = f"Unsupported encoding {encoding}"
+        raise ValueError(msg)
+
+    pending = 0
+    for chunk in chunks:
+        data = process(chunk)
+        pending += len(chunk)
+        if pending >= STREAM_FLUSH_SIZE:
+            data += flush()
+            pending = 0
+        if data:
+            yield data
+    yield finish()
+
+
+class CompressedCache:
+    """
+    A size-bounded LRU cache of compressed response bodies, keyed on a hash of
+    the uncompressed body. Hashing is much cheaper than compressing, so a hot
+    page is only compressed once per encoding.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[bytes, str], bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, data: bytes, encoding: str) -> bytes:
+        key = (hashlib.blake2b(data, digest_size=16).digest(), encoding)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        compressed = compress(data, encoding)
+        if len(compressed) > self.max_bytes:
+            return compressed
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = compressed
+                self.size += len(compressed)
+            while self.size > self.max_bytes:
+                _, dropped = self._entries.popitem(last=False)
+                self.size -= len(dropped)
+        return compressed
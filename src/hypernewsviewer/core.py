@@ -1,12 +1,21 @@
 from __future__ import annotations
 
+import contextlib
+import hashlib
+import json
+import logging
 import math
+import mimetypes
 import os
+import re
+import tempfile
+import threading
 import time
 import warnings
-from itertools import accumulate, groupby
+from http import HTTPStatus
+from itertools import accumulate, chain, groupby, islice, repeat, tee
 from pathlib import Path
-from typing import Any
+from typing import Any, ContextManager, Iterable, Iterator, TypeVar, cast
 
 import attrs
 import sqlalchemy
@@ -14,17 +23,37 @@ from flask import (
     Flask,
     abort,
     g,
+    jsonify,
     redirect,
-    render_template,
     request,
     send_from_directory,
     url_for,
 )
+from flask import render_template as flask_render_template
+from flask import stream_template as flask_stream_template
 from werkzeug.wrappers import Response
 
 from hypernewsviewer.model.messages import URCMain, URCMessage
 
+from .admission import SlotLimiter
+from .compress import ENCODINGS, CompressedCache, compress_stream
+from .metrics import LATENCY_BUCKETS, Gauge, Metrics
+from .model.cache import FileCache
+from .model.pack import Pack
 from .model.structure import AllForums, DBForums, connect_forums
+from .search import (
+    DATE_MAX,
+    DATE_MIN,
+    SearchCache,
+    parse_cursor,
+    run_search,
+    snapshot_id,
+    suggest_terms,
+)
+from .sqlstats import start_tracking
+from .timing import RequestTimer, TimedForums
+
+T = TypeVar("T")
 
 app = Flask("hypernewsviewer")
 total_msgs: int | None = None
@@ -33,33 +62,179 @@ DIR = Path().resolve()
 HNFILES = os.environ.get("HNFILES", str(DIR.parent.joinpath("hnfiles")))
 HNDATABASE = os.environ.get("HNDATABASE", None)
 
-if HNFTSDATABASE := os.environ.get("HNFTSDATABASE", None):
-    db_file = Path(HNFTSDATABASE).resolve()
-    db_uri = f"sqlite:///file:{db_file}?mode=ro&uri=true"
+HNFTSDATABASE = os.environ.get("HNFTSDATABASE", None)
+
+
+# Number of replies shown per page on a forum or message
+HNPAGESIZE = int(os.environ.get("HNPAGESIZE", "100"))
 
+# Listings with at least this many entries are streamed to the client
+HNSTREAMTHRESHOLD = int(os.environ.get("HNSTREAMTHRESHOLD", "50"))
+
+# Message and member files read ahead in parallel without a database (0 for
+# none); only worth it on network mounts, it slows down local disks
+HNREADAHEAD = int(os.environ.get("HNREADAHEAD", "0"))
+
+# Parsed message, forum and member files, bodies and directory listings kept
+# per worker (0 for none), up to a total size of bodies (0 for no limit),
+# rechecked against the file at most every TTL seconds
+HNFILECACHE = int(os.environ.get("HNFILECACHE", "20000"))
+HNFILECACHEBYTES = int(os.environ.get("HNFILECACHEBYTES", str(64 * 1024 * 1024)))
+HNFILECACHETTL = float(os.environ.get("HNFILECACHETTL", "1"))
+
+file_cache = (
+    FileCache(max_entries=HNFILECACHE, max_bytes=HNFILECACHEBYTES, ttl=HNFILECACHETTL)
+    if HNFILECACHE
+    else None
+)
 
 DATA_ROOT = Path(HNFILES).resolve()
 DB_ROOT = Path(HNDATABASE).resolve() if HNDATABASE else None
 
-FULLTEXT = sqlalchemy.table(
-    "fulltext",
-    sqlalchemy.column("responses"),
-    sqlalchemy.column("title"),
-    sqlalchemy.column("date"),
-    sqlalchemy.column("from_"),
-    sqlalchemy.column("rank"),
+# A pack of the archive (see hyper-model pack), served instead of HNFILES and
+# HNDATABASE; opened once per worker, the OS shares the pages between them
+HNPACK = os.environ.get("HNPACK", None)
+data_pack = Pack(Path(HNPACK).resolve()) if HNPACK else None
+
+# Time (seconds) and SQLite VM step (0 for unlimited) budget for a search
+HNSEARCHTIMEOUT = float(os.environ.get("HNSEARCHTIMEOUT", "5"))
+HNSEARCHSTEPS = int(os.environ.get("HNSEARCHSTEPS", "0"))
+
+# Count all the search hits, by forum and author (0 to not count them)
+HNSEARCHCOUNT = os.environ.get("HNSEARCHCOUNT", "1") != "0"
+
+# Recent search result pages, bounded in entries and bytes; if a directory is
+# given (ideally node-local), the cache is shared between workers through it
+HNSEARCHCACHE = int(os.environ.get("HNSEARCHCACHE", "1000"))
+HNSEARCHCACHEBYTES = int(os.environ.get("HNSEARCHCACHEBYTES", str(16 * 1024 * 1024)))
+HNSEARCHCACHEDIR = os.environ.get("HNSEARCHCACHEDIR", None)
+
+search_cache = SearchCache(
+    max_entries=HNSEARCHCACHE,
+    max_bytes=HNSEARCHCACHEBYTES,
+    shared=Path(HNSEARCHCACHEDIR).joinpath("searchcache.sql3")
+    if HNSEARCHCACHEDIR
+    else None,
+)
+
+# Searches run at once on a node (over all workers, 0 for unlimited), and how
+# many more may wait (for up to HNSEARCHWAIT seconds) before being turned away.
+# A waiting search holds a request handler (a worker, or a thread of one), so
+# searches may take all the workers but one, and only wait on spare threads;
+# with the default sync workers, a search gets a slot at once or is turned away
+GUNICORN_PROCESSES = int(os.environ.get("GUNICORN_PROCESSES", "3"))
+GUNICORN_THREADS = int(os.environ.get("GUNICORN_THREADS", "1"))
+SEARCH_HANDLERS = GUNICORN_PROCESSES * GUNICORN_THREADS - 1
+HNSEARCHSLOTS = int(
+    os.environ.get("HNSEARCHSLOTS", str(max(GUNICORN_PROCESSES - 1, 1)))
 )
-FTS_QUERY = sqlalchemy.select(
-    FULLTEXT.c.responses,
-    FULLTEXT.c.title,
-    FULLTEXT.c.date,
-    FULLTEXT.c.from_,
-    sqlalchemy.text("snippet(fulltext, 4, '<mark>', '</mark>', ' ... ', 64)"),
+if HNSEARCHSLOTS < 0:
+    msg = f"HNSEARCHSLOTS must be 0 (no limit) or more, not {HNSEARCHSLOTS}"
+    raise ValueError(msg)
+_search_queue = int(os.environ.get("HNSEARCHQUEUE", "4"))
+if _search_queue < 0:
+    msg = f"HNSEARCHQUEUE must be 0 (no queue) or more, not {_search_queue}"
+    raise ValueError(msg)
+HNSEARCHQUEUE = min(_search_queue, max(SEARCH_HANDLERS - HNSEARCHSLOTS, 0))
+if "HNSEARCHQUEUE" in os.environ and _search_queue > HNSEARCHQUEUE:
+    msg = (
+        f"HNSEARCHQUEUE={_search_queue} cut down to {HNSEARCHQUEUE}: only"
+        f" {SEARCH_HANDLERS} request handlers can be spared for searches, and"
+        f" {HNSEARCHSLOTS} of them run in slots (see GUNICORN_THREADS)"
+    )
+    warnings.warn(msg, stacklevel=1)
+HNSEARCHWAIT = float(os.environ.get("HNSEARCHWAIT", "2"))
+HNSEARCHSLOTDIR = os.environ.get(
+    "HNSEARCHSLOTDIR", str(Path(tempfile.gettempdir()).joinpath("hypernewsviewer"))
+)
+SEARCH_RETRY_AFTER = 5
+
+search_limiter = SlotLimiter(
+    Path(HNSEARCHSLOTDIR),
+    name="search",
+    slots=HNSEARCHSLOTS,
+    queue=HNSEARCHQUEUE,
+    wait=HNSEARCHWAIT,
 )
 
 
 BASE_PATH = "/HyperNews/CMS"
 
+ICONS_DIR = Path(__file__).parent.joinpath("static/Icons")
+ICON_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def _file_digest(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()[:12]
+
+
+# Content hashes of the icons, used to fingerprint the icon URLs
+ICON_DIGESTS = {p.name: _file_digest(p) for p in ICONS_DIR.iterdir() if p.is_file()}
+
+# Compressed copies of recently served pages, in bytes
+HNCOMPRESSCACHE = int(os.environ.get("HNCOMPRESSCACHE", str(32 * 1024 * 1024)))
+COMPRESS_MIN_SIZE = 500
+COMPRESS_MIMETYPES = {"text/html", "text/css", "text/plain", "application/json"}
+
+compressed_cache = CompressedCache(max_bytes=HNCOMPRESSCACHE)
+
+# Time the phases of each request, for the Server-Timing header and the
+# hypernewsviewer.timing log (at INFO level)
+HNTIMING = os.environ.get("HNTIMING", "1") != "0"
+
+log_timing = logging.getLogger("hypernewsviewer.timing")
+
+# SQL statements a request may run (0 for no limit), and how many runs of the
+# same statement are taken for a query in a loop; errors when testing or
+# debugging, otherwise logged
+HNSQLBUDGET = int(os.environ.get("HNSQLBUDGET", "200"))
+HNSQLREPEAT = int(os.environ.get("HNSQLREPEAT", "20"))
+
+# Node-local directory the workers share their metrics through, so that
+# /metrics reports all of them (otherwise only the scraped worker)
+HNMETRICSDIR = os.environ.get("HNMETRICSDIR", None)
+
+metrics = Metrics(Path(HNMETRICSDIR) if HNMETRICSDIR else None)
+metrics.histogram(
+    "hypernewsviewer_request_duration_seconds",
+    "Time to serve a request, by route",
+    LATENCY_BUCKETS,
+)
+metrics.counter("hypernewsviewer_sql_statements_total", "SQL statements run")
+metrics.counter("hypernewsviewer_sql_seconds_total", "Time spent running SQL")
+metrics.counter("hypernewsviewer_cache_hits_total", "Cache hits, by cache")
+metrics.counter("hypernewsviewer_cache_misses_total", "Cache misses, by cache")
+metrics.counter("hypernewsviewer_searches_total", "Searches run (not cached)")
+metrics.counter("hypernewsviewer_search_timeouts_total", "Searches that timed out")
+metrics.counter(
+    "hypernewsviewer_search_admissions_total", "Search slot requests, by outcome"
+)
+
+
+def collect_totals(registry: Metrics) -> None:
+    for cache_name, cache in (
+        ("compressed", compressed_cache),
+        ("search", search_cache),
+        ("files", file_cache),
+    ):
+        if cache is None:
+            continue
+        registry.set_total(
+            "hypernewsviewer_cache_hits_total", cache.hits, cache=cache_name
+        )
+        registry.set_total(
+            "hypernewsviewer_cache_misses_total", cache.misses, cache=cache_name
+        )
+    for outcome in ("admitted", "rejected"):
+        registry.set_total(
+            "hypernewsviewer_search_admissions_total",
+            getattr(search_limiter, outcome),
+            outcome=outcome,
+        )
+
+
+metrics.collectors.append(collect_totals)
+
 
 @app.template_filter("absolute_url")
 def absolute_url(s: str) -> str:
@@ -70,22 +245,83 @@ def absolute_url(s: str) -> str:
     return f"{request.url_root}{BASE_PATH.strip('/')}/{s.lstrip('/')}"
 
 
+def timed(name: str) -> ContextManager[None]:
+    """
+    Time a phase of the current request (if timing is on).
+    """
+    timer: RequestTimer | None = g.get("timer")
+    return contextlib.nullcontext() if timer is None else timer.measure(name)
+
+
+def render_template(template: str, **context: Any) -> str:
+    with timed("render"):
+        return flask_render_template(template, **context)
+
+
+def stream_template(template: str, **context: Any) -> Iterator[str]:
+    stream = flask_stream_template(template, **context)
+    timer: RequestTimer | None = g.get("timer")
+    return stream if timer is None else timer.measure_iter("render", stream)
+
+
 def get_forums() -> AllForums | DBForums:
     forums = getattr(g, "_forums_ctx", None)
     if forums is None:
-        # pylint: disable-next=protected-access
-        g._forums = connect_forums(DATA_ROOT, DB_ROOT)
-        # pylint: disable-next=protected-access,unnecessary-dunder-call
-        forums = g._forums_ctx = g._forums.__enter__()
+        with timed("connect"):
+            # pylint: disable-next=protected-access
+            g._forums = connect_forums(
+                DATA_ROOT,
+                DB_ROOT,
+                readahead=HNREADAHEAD,
+                cache=file_cache,
+                pack=data_pack,
+            )
+            # pylint: disable-next=protected-access,unnecessary-dunder-call
+            forums = g._forums_ctx = g._forums.__enter__()
+        if "timer" in g:
+            forums = g._forums_ctx = cast(
+                "AllForums | DBForums", TimedForums(forums, g.timer)
+            )
     return forums
 
 
-def get_search_engine() -> sqlalchemy.engine.Engine:
-    if getattr(g, "_search_engine", None) is None:
-        # pylint: disable-next=protected-access
-        g._search_engine = sqlalchemy.create_engine(db_uri, future=True)
-    # pylint: disable-next=protected-access
-    return g._search_engine
+def get_db_files() -> list[Path]:
+    """
+    The full text search databases: a single one, or a directory of shards
+    (see populate-search), listed again each time so a new year is found.
+    """
+    assert HNFTSDATABASE is not None
+    db_path = Path(HNFTSDATABASE).resolve()
+    return sorted(db_path.glob("*.sql3")) if db_path.is_dir() else [db_path]
+
+
+# The search engines of this worker, by the snapshot of the files they opened
+search_engines: dict[str, tuple[sqlalchemy.engine.Engine, ...]] = {}
+search_engines_lock = threading.Lock()
+
+
+def get_search_engines() -> tuple[str, tuple[sqlalchemy.engine.Engine, ...]]:
+    """
+    The snapshot id of the search databases, and engines for them. The
+    databases are read-only, so the engines are shared by all requests, until
+    a file is replaced (like by hyper-model patch) or a shard is added: pooled
+    connections keep the old file open, so the old engines are disposed of,
+    and their connections closed once the searches using them are done.
+    """
+    db_files = get_db_files()
+    snapshot = "+".join(snapshot_id(db_file) for db_file in db_files)
+    with search_engines_lock:
+        engines = search_engines.get(snapshot)
+        if engines is None:
+            for old_engines in search_engines.values():
+                for engine in old_engines:
+                    engine.dispose()
+            search_engines.clear()
+            engines = search_engines[snapshot] = tuple(
+                sqlalchemy.create_engine(f"sqlite:///file:{db_file}?mode=ro&uri=true")
+                for db_file in db_files
+            )
+    return snapshot, engines
 
 
 @app.teardown_appcontext
@@ -95,6 +331,119 @@ def close_connection(_exception: BaseException | None) -> None:
         forums.__exit__(None, None, None)
 
 
+@app.before_request
+def start_timer() -> None:
+    g.start = time.perf_counter()
+    if HNTIMING:
+        g.timer = RequestTimer()
+    g.sql_stats = start_tracking()
+
+
+# Registered first, so it runs after the other after_request functions
+@app.after_request
+def record_metrics(response: Response) -> Response:
+    start, route = g.start, request.endpoint or "unknown"
+
+    def observe() -> None:
+        # Streamed responses are only done once closed
+        metrics.observe(
+            "hypernewsviewer_request_duration_seconds",
+            time.perf_counter() - start,
+            route=route,
+        )
+        metrics.flush()
+
+    response.call_on_close(observe)
+    return response
+
+
+# Registered before check_sql and compress_response, so it runs after them
+@app.after_request
+def add_server_timing(response: Response) -> Response:
+    timer: RequestTimer | None = g.get("timer")
+    if timer is None:
+        return response
+
+    response.headers["Server-Timing"] = timer.header()
+    method, path = request.method, request.path
+
+    def log_record() -> None:
+        # Streamed responses are only done rendering once closed
+        if log_timing.isEnabledFor(logging.INFO):
+            record = {
+                "method": method,
+                "path": path,
+                "status": response.status_code,
+                **timer.record(),
+            }
+            log_timing.info(json.dumps(record))
+
+    response.call_on_close(log_record)
+    return response
+
+
+@app.after_request
+def check_sql(response: Response) -> Response:
+    stats = g.sql_stats
+    timer: RequestTimer | None = g.get("timer")
+    where = f"{request.method} {request.path}"
+
+    def check() -> None:
+        if timer is not None and stats.count:
+            timer.calls["sql"] = stats.count
+            timer.seconds["sql"] = stats.seconds
+        if stats.count:
+            metrics.inc("hypernewsviewer_sql_statements_total", stats.count)
+            metrics.inc("hypernewsviewer_sql_seconds_total", stats.seconds)
+        stats.check(
+            where,
+            budget=HNSQLBUDGET,
+            repeat=HNSQLREPEAT,
+            strict=app.testing or app.debug,
+        )
+
+    # Streamed responses run their queries while rendering, until closed
+    if response.is_streamed:
+        response.call_on_close(check)
+    else:
+        check()
+    return response
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    if (
+        response.direct_passthrough
+        or response.status_code != HTTPStatus.OK
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESS_MIMETYPES
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+
+    # Streamed pages are compressed as they are rendered, and not cached
+    if response.is_streamed:
+        body = response.response
+        chunks = (c.encode() if isinstance(c, str) else c for c in body)
+        response.response = compress_stream(chunks, encoding)
+        response.call_on_close(getattr(body, "close", lambda: None))
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    with timed("compress"):
+        response.set_data(compressed_cache.get(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
 @app.route(f"{BASE_PATH}/")
 def reroute_base_path() -> Response:
     return redirect(url_for("home_page"))
@@ -120,9 +469,25 @@ def favicon() -> Response:
     return send_from_directory("static", "favicon.ico")
 
 
+@app.template_global()
+def icon_url(path: str) -> str:
+    """
+    URL for an icon, fingerprinted with the content hash so it can be cached
+    forever.
+    """
+    return url_for("icons", path=path, v=ICON_DIGESTS.get(path))
+
+
 @app.route(f"{BASE_PATH}/Icons/<path:path>")
 def icons(path: str) -> Response:
-    return send_from_directory("static", f"Icons/{path}")
+    version = request.args.get("v")
+    if version is None or version != ICON_DIGESTS.get(path):
+        return send_from_directory("static", f"Icons/{path}")
+
+    response = send_from_directory("static", f"Icons/{path}", max_age=ICON_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 
 def get_msg_or_none(parts: list[str]) -> URCMessage | URCMain | None:
@@ -135,9 +500,47 @@ def get_msg_or_none(parts: list[str]) -> URCMessage | URCMain | None:
         return None
 
 
+def render_listing(template: str, count: int, **context: Any) -> str | Response:
+    """
+    Render a template listing count entries. Large listings are streamed, so
+    lazy listings are rendered as they are read, and the first bytes are sent
+    before the whole page is built.
+    """
+    if count < HNSTREAMTHRESHOLD:
+        return render_template(template, **context)
+    return Response(stream_template(template, **context), mimetype="text/html")
+
+
+def peek(items: Iterable[T], count: int) -> tuple[int, Iterator[T]]:
+    """
+    Read up to count items ahead, to tell if a lazy listing is large without
+    counting all of it. Returns the number read, and all the items.
+    """
+    iterator = iter(items)
+    head = list(islice(iterator, count))
+    return len(head), chain(head, iterator)
+
+
+def get_breadcrumbs(parts: list[str]) -> list[dict[str, str]]:
+    trail = accumulate(parts, lambda a, b: f"{a}/{b}")
+    return [
+        {"name": part, "url": url_for("get", responses=spath)}
+        for part, spath in zip(parts, trail)
+    ]
+
+
 @app.route(f"{BASE_PATH}/get/AUX/<path:path>")
 def attachments(path: str) -> Response:
-    return send_from_directory(f"{DATA_ROOT}/AUX", path)
+    if data_pack is None:
+        return send_from_directory(f"{DATA_ROOT}/AUX", path)
+    try:
+        data = data_pack.read(f"AUX/{path}")
+    except FileNotFoundError:
+        abort(404)
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    response = Response(data, mimetype=mimetype)
+    response.add_etag()
+    return response.make_conditional(request)
 
 
 @app.route(f"{BASE_PATH}/get/<path:responses>")
@@ -164,11 +567,7 @@ def get(responses: str) -> str | Response:
         if direction == "nextResponse":
             return redirect(url_for("get", responses="/".join(next_response)))
 
-    trail = accumulate(parts, lambda a, b: f"{a}/{b}")
-    breadcrumbs = [
-        {"name": part, "url": url_for("get", responses=spath)}
-        for part, spath in zip(parts, trail)
-    ]
+    breadcrumbs = get_breadcrumbs(parts)
 
     msg = get_msg_or_none(parts)
     if msg is None:
@@ -179,31 +578,87 @@ def get(responses: str) -> str | Response:
 
     body = forums.get_html(forum, path)
 
-    replies: list[dict[str, Any]] = []
-    for m in forums.get_msgs(forum, path):
-        local_forum, *local_others = m.responses.lstrip("/").split("/")
-        msgs = forums.get_msg_paths(local_forum, "/".join(local_others))
-        entries = len(list(msgs))
-        url = url_for("get", responses=m.responses)
-        replies.append({"msg": m, "url": url, "entries": entries})
+    # Replies are listed newest first, one page at a time
+    before = request.args.get("before", default=None, type=int)
+    num_replies = forums.get_num_msgs(forum, path)
+    page_msgs = forums.get_msgs_page(forum, path, before=before, limit=HNPAGESIZE + 1)
+    older = page_msgs[HNPAGESIZE - 1].num if len(page_msgs) > HNPAGESIZE else None
 
-    return render_template(
+    page_msgs = page_msgs[:HNPAGESIZE]
+    num_entries = forums.get_num_replies(page_msgs)
+
+    def get_replies(msgs: Iterable[URCMessage]) -> Iterator[dict[str, Any]]:
+        for m in msgs:
+            url = url_for("get", responses=m.responses)
+            yield {"msg": m, "url": url, "entries": num_entries[m.responses]}
+
+    return render_listing(
         "msg.html",
+        len(page_msgs),
         urc=msg,
         forum=forums.get_forum(forum),
         body=body or "",
         breadcrumbs=breadcrumbs,
-        replies=replies,
+        replies=get_replies(page_msgs),
+        num_replies=num_replies,
+        newer=before is not None,
+        older=older,
         has_next_in_thread=has_next_in_thread,
         has_next_response=has_next_response,
     )
 
 
+@app.route(f"{BASE_PATH}/thread/<path:responses>")
+def thread(responses: str) -> str | Response:
+    responses = responses.strip("/")
+    parts = responses.split("/")
+    forum, *others = parts
+    path = "/".join(others)
+    forums = get_forums()
+
+    msg = get_msg_or_none(parts)
+    if msg is None or not path:
+        abort(404)
+
+    flat = bool(request.args.get("flat", default=""))
+    depth = f"/{responses}/".count("/")
+
+    # The full subtree is fetched in one pass, bodies only in flat mode
+    num_msgs, msgs = peek(forums.get_subtree(forum, path), HNSTREAMTHRESHOLD)
+    bodies: Iterable[str | None] = repeat(None)
+    if flat:
+        msgs, body_msgs = tee(msgs)
+        paths = (m.responses.split("/", 2)[2] for m in body_msgs)
+        bodies = forums.get_htmls(forum, paths)
+    items = (
+        {
+            "msg": m,
+            "url": url_for("get", responses=m.responses.lstrip("/")),
+            "depth": m.responses.count("/") - depth,
+            "body": body,
+        }
+        for m, body in zip(msgs, bodies)
+    )
+
+    return render_listing(
+        "thread.html",
+        num_msgs,
+        urc=msg,
+        body=forums.get_html(forum, path) if flat else None,
+        breadcrumbs=get_breadcrumbs(parts),
+        items=items,
+        flat=flat,
+    )
+
+
 @app.route(f"{BASE_PATH}/view-member.pl")
 def view_member() -> str:
     (answer,) = request.args
     forums = get_forums()
-    member = forums.get_member(answer)
+    try:
+        member = forums.get_member(answer)
+    except (FileNotFoundError, sqlalchemy.exc.NoResultFound):
+        abort(404)
 
     member_dict = {k: v for k, v in attrs.asdict(member).items() if k != "password"}
 
@@ -272,32 +727,99 @@ def cindex() -> str:
 
 
 @app.route(f"{BASE_PATH}/search")
-def search() -> str:
+def search() -> str | tuple[str, int, dict[str, str]]:
     if HNFTSDATABASE is None:
         return render_template(
-            "search.html", results=[], info_msg="No database configured"
+            "search.html", results=[], info_msg="No database configured", facets={}
         )
 
-    search_engine = get_search_engine()
-
-    start = request.args.get("start", "2000-01-01")
-    stop = request.args.get("stop", "2022-12-31")
-    page = int(request.args.get("page", "1"))
+    snapshot, engines = get_search_engines()
+
+    start = request.args.get("start", DATE_MIN)
+    stop = request.args.get("stop", DATE_MAX)
+    # Bad page numbers are ignored, but a bad cursor cannot be
+    page = max(request.args.get("page", default=1, type=int), 1)
+    after = request.args.get("after", None)
+    if after is not None:
+        try:
+            parse_cursor(after)
+        except ValueError:
+            abort(400)
+    forum = request.args.get("forum", "") or None
+    author = request.args.get("author", "") or None
     query = request.args.get("query", "") or request.args.get("q", "")
+    next_cursor = None
+    facets: dict[str, dict[str, int]] = {}
     if query:
-        timer = time.perf_counter()
-        q = FTS_QUERY.where(sqlalchemy.text("fulltext=:query"))
-        needs_range = start > "2000-01-01" or stop < "2022-12-31"
-
-        if needs_range:
-            q = q.where(FULLTEXT.c.date.between(start, stop))
-        q = q.order_by(FULLTEXT.c.rank).limit(50).offset((page - 1) * 50)
-
-        with search_engine.connect() as con:
-            results_iter = con.execute(q, {"query": query})
-            results = list(results_iter)
-        total_time = time.perf_counter() - timer
-        info_msg = f"Displaying results for: {query!r} (max 50 per page, page {page}) (took {total_time:.3f}s)"
+        # The database is read-only, so results only change if it is replaced
+        cache_key = search_cache.make_key(
+            snapshot,
+            query,
+            start=start,
+            stop=stop,
+            forum=forum,
+            author=author,
+            page=page,
+            after=after,
+            count=HNSEARCHCOUNT,
+        )
+        found = search_cache.get(cache_key)
+        if found is None:
+            # Cached pages are cheap, only running a search needs a slot
+            with search_limiter.acquire() as admitted:
+                if not admitted:
+                    app.logger.warning("Too many searches, turned away %r", query)
+                    busy_msg = f"Too many searches are running right now, please try again in {SEARCH_RETRY_AFTER} seconds"
+                    body = render_template(
+                        "search.html",
+                        results=[],
+                        info_msg=busy_msg,
+                        query=query,
+                        page=page,
+                        start=start,
+                        stop=stop,
+                        forum=forum,
+                        author=author,
+                        facets=facets,
+                    )
+                    return (
+                        body,
+                        HTTPStatus.SERVICE_UNAVAILABLE,
+                        {"Retry-After": str(SEARCH_RETRY_AFTER)},
+                    )
+                with timed("search"):
+                    found = run_search(
+                        engines,
+                        query,
+                        start=start,
+                        stop=stop,
+                        forum=forum,
+                        author=author,
+                        page=page,
+                        after=after,
+                        count=HNSEARCHCOUNT,
+                        seconds=HNSEARCHTIMEOUT,
+                        steps=HNSEARCHSTEPS,
+                    )
+            metrics.inc("hypernewsviewer_searches_total")
+            if found.timed_out:
+                metrics.inc("hypernewsviewer_search_timeouts_total")
+            # Stopped searches are not cached, a retry might do better
+            if not found.timed_out:
+                search_cache.put(cache_key, found)
+        results = found.rows
+        next_cursor = found.next_cursor
+        facets = {"forum": found.forums, "author": found.authors}
+        if found.timed_out:
+            # Matches are ranked before any is returned, so there are only
+            # results if the search was stopped after ranking them
+            shown = f", showing the first {len(results)} results" if results else ""
+            info_msg = f"Search for {query!r} was stopped after {found.elapsed:.3f}s{shown}; please refine your query"
+        else:
+            hits = "" if found.hits is None else f"{found.hits} hits, "
+            kind = "substring matches" if found.substring else "results"
+            took = "cached" if found.cached else f"took {found.elapsed:.3f}s"
+            info_msg = f"Displaying {kind} for: {query!r} ({hits}max 50 per page, page {page}) ({took})"
 
     else:
         info_msg = """
@@ -316,4 +838,81 @@ def search() -> str:
         page=page,
         start=start,
         stop=stop,
+        forum=forum,
+        author=author,
+        facets=facets,
+        next_cursor=next_cursor,
+    )
+
+
+@app.route(f"{BASE_PATH}/search/stats")
+def search_stats() -> Response:
+    """
+    Search admission and cache statistics, as JSON.
+    """
+    return jsonify(
+        limiter=search_limiter.stats(),
+        cache={
+            "hits": search_cache.hits,
+            "misses": search_cache.misses,
+            "hit_rate": search_cache.hit_rate,
+        },
+    )
+
+
+# Fields suggested while typing a search, and their full text search columns
+SUGGEST_COLUMNS = {"title": "title", "author": "from_"}
+SUGGEST_MAX_AGE = 60 * 60
+
+
+@app.route(f"{BASE_PATH}/search/suggest")
+def search_suggest() -> Response:
+    """
+    Completions for the last (partial) word of q, as JSON.
+    """
+    words = re.findall(r"\w+", request.args.get("q", ""))
+    suggestions: dict[str, list[str]] = {field: [] for field in SUGGEST_COLUMNS}
+    if HNFTSDATABASE is not None and words:
+        _, engines = get_search_engines()
+        for field, column in SUGGEST_COLUMNS.items():
+            suggestions[field] = suggest_terms(engines, words[-1], column=column)
+
+    response = jsonify(suggestions)
+    response.cache_control.public = True
+    response.cache_control.max_age = SUGGEST_MAX_AGE
+    return response
+
+
+@app.route("/metrics")
+def metrics_page() -> Response:
+    """
+    Metrics of all workers, in the Prometheus text format.
+    """
+    gauges: list[Gauge] = [
+        (
+            "hypernewsviewer_search_slots_running",
+            "Searches running on this node",
+            {},
+            search_limiter.running(),
+        ),
+        (
+            "hypernewsviewer_search_slots_waiting",
+            "Searches waiting for a slot on this node",
+            {},
+            search_limiter.waiting(),
+        ),
+    ]
+    databases = [DB_ROOT, *(get_db_files() if HNFTSDATABASE else [])]
+    gauges += [
+        (
+            "hypernewsviewer_database_bytes",
+            "Size of the SQLite databases",
+            {"database": db.name},
+            db.stat().st_size,
+        )
+        for db in databases
+        if db is not None and db.is_file()
+    ]
+    return Response(
+        metrics.render(gauges), mimetype="text/plain; version=0.0.4; charset=utf-8"
     )
@@ -1,14 +1,21 @@
 from __future__ import annotations
 
-from flask import url_for
+import base64
+import os
 
-from ..core import app
+from ..core import ICONS_DIR, app, icon_url
 from ..model.enums import UpRelType
 
+# Set to inline the message icons as data URIs instead of linking to them
+INLINE_ICONS = bool(os.environ.get("HNINLINEICONS", ""))
+
 
 @app.template_filter()  # type: ignore[misc]
 def urc_icon(icon: UpRelType) -> str:
-    return url_for("icons", path=_compute_icon(icon))
+    if icon in ICON_DATA_URIS:
+        return ICON_DATA_URIS[icon]
+    # The names and digests are computed once, the URL depends on the request
+    return icon_url(ICON_NAMES[icon])
 
 
 def _compute_icon(icon: UpRelType) -> str:
@@ -41,3 +48,20 @@ def _compute_icon(icon: UpRelType) -> str:
         return "sad.gif"
 
     return "hnsmall.gif"
+
+
+def _data_uri(name: str) -> str:
+    data = base64.b64encode(ICONS_DIR.joinpath(name).read_bytes()).decode("ascii")
+    return f"data:image/gif;base64,{data}"
+
+
+ICON_NAMES = {icon: _compute_icon(icon) for icon in UpRelType}
+ICON_DATA_URIS = (
+    {
+        icon: _data_uri(name)
+        for icon, name in ICON_NAMES.items()
+        if ICONS_DIR.joinpath(name).is_file()
+    }
+    if INLINE_ICONS
+    else {}
+)
@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import math
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+# Folding exited workers' values is guarded by flock(), not on Windows
+if sys.platform != "win32":
+    import fcntl
+
+__all__ = ["LATENCY_BUCKETS", "Gauge", "Metrics"]
+
+log = logging.getLogger("hypernewsviewer.metrics")
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+# Bucket counts (not cumulative, the last is +Inf), then sum
+Histogram = List[float]
+Snapshot = Dict[str, Any]
+# Name, help, labels and value of a node-wide value
+Gauge = Tuple[str, str, Dict[str, str], float]
+
+
+def _format_labels(labels: Labels, **extra: str) -> str:
+    items = [*labels, *extra.items()]
+    if not items:
+        return ""
+    escaped = (
+        (k, v.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for k, v in items
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _add_snapshot(
+    counters: dict[tuple[str, Labels], float],
+    histograms: dict[tuple[str, Labels], Histogram],
+    snapshot: Snapshot,
+) -> None:
+    for name, labels, value in snapshot["counters"]:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, values in snapshot["histograms"]:
+        key = (name, tuple(map(tuple, labels)))
+        total = histograms.setdefault(key, [0] * len(values))
+        for i, value in enumerate(values):
+            total[i] += value
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metrics:
+    """
+    Counters and histograms for this process, in Prometheus text format.
+
+    With a (node-local) directory, each worker writes its values to its own
+    file there after each request, and a scrape of any worker adds up the
+    files of all the workers. The files of exited workers are folded into
+    one, so totals do not drop when workers are replaced (like the
+    multiprocess mode of prometheus_client). Values kept elsewhere (like
+    cache hit counts) are copied in by collectors before each write.
+    """
+
+    def __init__(self, directory: Path | None = None) -> None:
+        self.directory = directory
+        self.help: dict[str, tuple[str, str]] = {}
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.histograms: dict[tuple[str, Labels], Histogram] = {}
+        self.buckets: dict[str, tuple[float, ...]] = {}
+        self.collectors: list[Callable[[Metrics], None]] = []
+        self._lock = threading.Lock()
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def counter(self, name: str, description: str) -> None:
+        self.help[name] = ("counter", description)
+
+    def histogram(
+        self, name: str, description: str, buckets: tuple[float, ...]
+    ) -> None:
+        self.help[name] = ("histogram", description)
+        self.buckets[name] = buckets
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_total(self, name: str, value: float, **labels: str) -> None:
+        """
+        Set a counter from a total kept elsewhere in this process.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        buckets = self.buckets[name]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.setdefault(key, [0] * (len(buckets) + 2))
+            index = next(
+                (i for i, bound in enumerate(buckets) if value <= bound), len(buckets)
+            )
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def snapshot(self) -> Snapshot:
+        for collector in self.collectors:
+            collector(self)
+        with self._lock:
+            return {
+                "counters": [[n, list(ls), v] for (n, ls), v in self.counters.items()],
+                "histograms": [
+                    [n, list(ls), list(h)] for (n, ls), h in self.histograms.items()
+                ],
+            }
+
+    @property
+    def _path(self) -> Path:
+        assert self.directory is not None
+        return self.directory / f"metrics-{os.getpid()}.json"
+
+    def flush(self) -> None:
+        """
+        Write this worker's values for the other workers to read.
+        """
+        if self.directory is None:
+            return
+        tmp_path = self._path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps(self.snapshot()), encoding="utf-8")
+        tmp_path.replace(self._path)
+
+    @staticmethod
+    def _read(path: Path) -> Snapshot | None:
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))  # type: ignore[no-any-return]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as err:
+            log.warning("Skipping metrics file %s: %s", path, err)
+            return None
+
+    def _fold_exited(self, paths: list[Path]) -> None:
+        """
+        Add the values of exited workers to exited.json, and remove their
+        files. Locked, so workers scraped at once do not fold a file twice.
+        """
+        assert self.directory is not None
+        exited = self.directory / "exited.json"
+        lock_path = self.directory / "exited.lock"
+        with lock_path.open("a", encoding="utf-8") as lock:
+            if sys.platform != "win32":
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            counters: dict[tuple[str, Labels], float] = {}
+            histograms: dict[tuple[str, Labels], Histogram] = {}
+            for path in [exited, *paths]:
+                # Missing if already folded by another worker
+                snapshot = self._read(path)
+                if snapshot is not None:
+                    _add_snapshot(counters, histograms, snapshot)
+            total = {
+                "counters": [[n, list(ls), v] for (n, ls), v in counters.items()],
+                "histograms": [[n, list(ls), h] for (n, ls), h in histograms.items()],
+            }
+            tmp_path = exited.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(total), encoding="utf-8")
+            tmp_path.replace(exited)
+            for path in paths:
+                with contextlib.suppress(FileNotFoundError):
+                    path.unlink()
+
+    def _snapshots(self) -> Iterator[Snapshot]:
+        yield self.snapshot()
+        if self.directory is None:
+            return
+        exited = []
+        for path in self.directory.glob("metrics-*.json"):
+            pid = int(path.stem.split("-")[1])
+            if pid == os.getpid():
+                continue
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                exited.append(path)
+                continue
+            except PermissionError:
+                pass
+            snapshot = self._read(path)
+            if snapshot is not None:
+                yield snapshot
+        if exited:
+            self._fold_exited(exited)
+        snapshot = self._read(self.directory / "exited.json")
+        if snapshot is not None:
+            yield snapshot
+
+    def render(self, gauges: list[Gauge]) -> str:
+        """
+        All workers' values, and node-wide gauges, in the Prometheus text
+        exposition format.
+        """
+        counters: dict[tuple[str, Labels], float] = {}
+        histograms: dict[tuple[str, Labels], Histogram] = {}
+        for snapshot in self._snapshots():
+            _add_snapshot(counters, histograms, snapshot)
+
+        lines: list[str] = []
+        for name, (kind, description) in sorted(self.help.items()):
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            if kind == "counter":
+                lines += (
+                    f"{name}{_format_labels(labels)} {_format_value(value)}"
+                    for (n, labels), value in sorted(counters.items())
+                    if n == name
+                )
+                continue
+            bounds = [*self.buckets[name], math.inf]
+            for (n, labels), values in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0.0
+                for bound, count in zip(bounds, values):
+                    cumulative += count
+                    le = _format_value(bound)
+                    lines.append(
+                        f"{name}_bucket{_format_labels(labels, le=le)} {_format_value(cumulative)}"
+                    )
+                lines += [
+                    f"{name}_sum{_format_labels(labels)} {_format_value(values[-1])}",
+                    f"{name}_count{_format_labels(labels)} {_format_value(cumulative)}",
+                ]
+
+        for name, description, gauge_labels, value in gauges:
+            if f"# TYPE {name} gauge" not in lines:
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+            labels = tuple(gauge_labels.items())
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
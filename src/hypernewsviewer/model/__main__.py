@@ -2,13 +2,16 @@
 from __future__ import annotations
 
 import contextlib
+import cProfile
 import functools
 import logging
 import os
+import pstats
 import sqlite3
 import time
+from datetime import datetime
 from pathlib import Path
-from typing import Callable, Generator, Iterable, TypeVar
+from typing import Any, Callable, Generator, Iterable, TypeVar, cast
 
 import click
 import rich.console
@@ -21,14 +24,19 @@ from rich import print
 from rich.progress import Progress, Task
 from rich.table import Table
 from rich.tree import Tree
-from sqlalchemy import select
+from sqlalchemy import Select, select
 from sqlalchemy.orm import Session
 
 from .._compat.typing import Concatenate, ParamSpec
+from .changes import apply_changes, diff_databases
 from .cliutils import get_html_panel, walk_tree
+from .fts import FTSRow, add_trigram, create_fts, fill_fts, finish_fts
 from .messages import URCMain, URCMessage
 from .orm import mapper_registry
+from .pack import pack_names, write_pack
+from .profiling import summary_tables
 from .structure import AllForums, DBForums, connect_forums
+from .synthetic import ArchiveShape, generate
 
 # pylint: disable=redefined-outer-name
 
@@ -106,12 +114,31 @@ def convert_context(
     type=click.Path(file_okay=True, path_type=Path),  # type: ignore[type-var]
     help="Path to the database",
 )
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Profile the command, writing the profile to this file and printing a summary",
+)
 @click.pass_context
-def main(ctx: click.Context, root: Path, db: Path | None) -> None:
+def main(ctx: click.Context, root: Path, db: Path | None, profile: Path | None) -> None:
     ctx.ensure_object(dict)
     ctx.obj["db"] = db.resolve() if db else None
     ctx.obj["root"] = root.resolve()
 
+    if profile is not None:
+        profiler = cProfile.Profile()
+
+        def finish_profile() -> None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+            for table in summary_tables(pstats.Stats(profiler)):
+                print(table)
+            print(f"Profile written to {profile} (open with snakeviz or pstats)")
+
+        ctx.call_on_close(finish_profile)
+        profiler.enable()
+
 
 @main.command("list", help="Show a table of messages.")
 @convert_context
@@ -265,6 +292,53 @@ def populate(db_forums: AllForums | DBForums) -> None:
                 inner_progress.remove_task(task_id)
 
 
+def build_fts(
+    db_forums: DBForums,
+    session: Session,
+    path: Path,
+    selection: Select[Any],
+    description: str,
+    trigram: str | None,
+) -> None:
+    """
+    Build a full text search database from the selected messages. It is built
+    next to path and moved into place when done, so a running server only
+    ever sees a complete database.
+    """
+    total = session.execute(
+        select(sqlalchemy.func.count()).select_from(selection.subquery())
+    ).scalar_one()
+    result = session.execute(
+        selection.order_by(URCMessage.date, URCMessage.responses)  # type: ignore[arg-type]
+    )
+
+    def fts_rows() -> Generator[FTSRow, None, None]:
+        for responses, date, title, from_ in track(  # type: ignore[misc]
+            result,
+            total=int(total),
+            description=description,
+        ):
+            html_text = Path(f"{db_forums.root}{responses}-body.html").read_text(
+                encoding="Latin-1"
+            )
+            soup = BeautifulSoup(html_text, "html.parser")
+            yield responses, date, title, from_, soup.get_text()
+
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+    with contextlib.closing(sqlite3.connect(str(tmp_path))) as db_out:
+        create_fts(db_out)
+        fill_fts(db_out, fts_rows())
+        db_out.commit()
+
+        db_out.set_trace_callback(log_sql.info)
+        finish_fts(db_out)
+        if trigram is not None:
+            add_trigram(db_out, text=trigram == "all")
+    tmp_path.replace(path)
+
+
 @main.command(help="Populate a database with full text search")
 @convert_context
 @click.option(
@@ -273,44 +347,201 @@ def populate(db_forums: AllForums | DBForums) -> None:
     if "HNFTSDATABASE" in os.environ
     else None,
     type=click.Path(file_okay=True, exists=False, path_type=Path),  # type: ignore[type-var]
-    help="Path to make the fts database",
+    help="Path to make the fts database (a directory if sharding by year)",
+)
+@click.option(
+    "--shard-by-year",
+    is_flag=True,
+    help="Make one database per year, which are searched in parallel",
+)
+@click.option(
+    "--year",
+    "years",
+    type=int,
+    multiple=True,
+    help="Only (re)build the shards for these years (can be repeated)",
 )
-def populate_search(db_forums: AllForums | DBForums, fts: Path) -> None:
+@click.option(
+    "--trigram",
+    type=click.Choice(["title", "all"]),
+    default=None,
+    help="Add a trigram index for substring searches, of the titles and bodies, or of the titles only (for title: queries)",
+)
+def populate_search(
+    db_forums: AllForums | DBForums,
+    fts: Path,
+    shard_by_year: bool,
+    years: tuple[int, ...],
+    trigram: str | None,
+) -> None:
     assert isinstance(db_forums, DBForums), "Must pass --db or HNDATABASE"
-    with contextlib.closing(sqlite3.connect(str(fts))) as db_out, Session(
-        db_forums.engine
-    ) as session:
-        db_out.execute(
-            "CREATE VIRTUAL TABLE fulltext USING FTS5(responses UNINDEXED, date UNINDEXED, title, from_, text);"
-        )
-
-        total = session.execute(
-            select(sqlalchemy.func.count(URCMessage.responses))
-        ).scalar_one()
-        selection = select(
-            URCMessage.responses, URCMessage.date, URCMessage.title, URCMessage.from_
-        )
-        result = session.execute(selection)
-        for responses, date, title, from_ in track(
-            result,
-            total=int(total),
-            description="Full text search",
-        ):
-            html_text = Path(f"{db_forums.root}{responses}-body.html").read_text(
-                encoding="Latin-1"
+    selection = select(
+        URCMessage.responses, URCMessage.date, URCMessage.title, URCMessage.from_
+    )
+    with Session(db_forums.engine) as session:
+        if not shard_by_year:
+            build_fts(db_forums, session, fts, selection, "Full text search", trigram)
+            return
+
+        fts.mkdir(parents=True, exist_ok=True)
+        if not years:
+            # None for both if there are no messages
+            first, last = cast(
+                "tuple[datetime | None, datetime | None]",
+                session.execute(
+                    select(
+                        sqlalchemy.func.min(URCMessage.date),
+                        sqlalchemy.func.max(URCMessage.date),
+                    )
+                ).one(),
             )
-            soup = BeautifulSoup(html_text, "html.parser")
-            text = soup.get_text()
-            db_out.execute(
-                "INSERT INTO fulltext VALUES (?, ?, ?, ?, ?)",
-                (responses, date, title, from_, text),
+            if first is None or last is None:
+                print("No messages to index")
+                return
+            years = tuple(range(first.year, last.year + 1))
+
+        for year in years:
+            year_selection = selection.where(
+                URCMessage.date >= datetime(year, 1, 1),
+                URCMessage.date < datetime(year + 1, 1, 1),
+            )
+            build_fts(
+                db_forums,
+                session,
+                fts / f"fulltext-{year}.sql3",
+                year_selection,
+                f"Full text search {year}",
+                trigram,
             )
-        db_out.commit()
 
-        db_out.set_trace_callback(log_sql.info)
-        db_out.execute("CREATE INDEX date_index ON fulltext_content(c1);")
-        db_out.execute("INSERT INTO fulltext(fulltext) VALUES('optimize');")
-        db_out.commit()
+
+@main.command("generate", help="Write a synthetic archive to --root, for testing.")
+@click.option("--messages", default=10_000, help="Number of messages")
+@click.option("--forums", default=20, help="Number of forums")
+@click.option("--members", default=2_000, help="Number of members")
+@click.option(
+    "--forum-skew", default=1.0, help="Zipf exponent of the forum sizes (0 for even)"
+)
+@click.option(
+    "--thread-alpha",
+    default=1.2,
+    help="Pareto shape of the thread sizes (smaller for more large threads)",
+)
+@click.option(
+    "--depth-bias",
+    default=0.5,
+    help="Chance a reply continues the latest branch, making deeper threads",
+)
+@click.option("--seed", default=42, help="Random seed")
+@click.pass_context
+def generate_fn(
+    ctx: click.Context,
+    messages: int,
+    forums: int,
+    members: int,
+    forum_skew: float,
+    thread_alpha: float,
+    depth_bias: float,
+    seed: int,
+) -> None:
+    root: Path = ctx.obj["root"]
+    if root.exists() and any(root.iterdir()):
+        msg = f"{root} is not empty"
+        raise click.ClickException(msg)
+    shape = ArchiveShape(
+        messages=messages,
+        forums=forums,
+        members=members,
+        forum_skew=forum_skew,
+        thread_alpha=thread_alpha,
+        depth_bias=depth_bias,
+        seed=seed,
+    )
+    with timer(f"Time to write {shape.messages} messages"):
+        generate(root, shape)
+
+
+@main.command(
+    "pack",
+    help="Pack --root (messages, bodies, attachments, members) into one file, to copy and serve (HNPACK).",
+)
+@click.argument(
+    "output",
+    type=click.Path(dir_okay=False, path_type=Path),
+)
+@click.option("--level", default=6, help="zlib compression level (0 to store)")
+@click.pass_context
+def pack_fn(ctx: click.Context, output: Path, level: int) -> None:
+    root: Path = ctx.obj["root"]
+    names = pack_names(root)
+    size = write_pack(root, track(names, len(names), "Packing"), output, level=level)
+    packed = output.stat().st_size
+    print(
+        f"Packed {len(names)} files ({size / 1e6:.1f} MB) into {output} ({packed / 1e6:.1f} MB)"
+    )
+
+
+@main.command(
+    "diff",
+    help="Write the row changes from OLD to NEW (two builds of a database or search database) to a change set.",
+)
+@click.argument(
+    "old",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+)
+@click.argument(
+    "new",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--output",
+    "-o",
+    required=True,
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="The change set to write",
+)
+def diff_fn(old: Path, new: Path, output: Path) -> None:
+    with timer("Time to diff"):
+        try:
+            summary = diff_databases(old, new, output)
+        except ValueError as err:
+            raise click.ClickException(str(err)) from err
+
+    table = Table(title=f"Changes from {old.name} to {new.name}")
+    table.add_column("Table")
+    table.add_column("Inserted or changed", justify="right")
+    table.add_column("Deleted", justify="right")
+    for name, (upserted, deleted) in summary.items():
+        table.add_row(name, str(upserted), str(deleted))
+    print(table)
+    print(f"Change set: {output} ({output.stat().st_size / 1e6:.1f} MB)")
+
+
+@main.command(
+    "patch",
+    help="Apply a change set (from diff) to DATABASE, replacing it in one step.",
+)
+@click.argument(
+    "changes",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+)
+@click.argument(
+    "database",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Write the patched database here, instead of replacing DATABASE",
+)
+def patch_fn(changes: Path, database: Path, output: Path | None) -> None:
+    with timer("Time to patch"):
+        try:
+            apply_changes(changes, database, output)
+        except ValueError as err:
+            raise click.ClickException(str(err)) from err
 
 
 if __name__ == "__main__":
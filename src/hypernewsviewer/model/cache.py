@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Tuple, TypeVar
+
+__all__ = ["FileCache"]
+
+T = TypeVar("T")
+
+# st_mtime_ns, st_size, st_ino: changes when a file is rewritten, or when an
+# entry is added to or removed from a directory
+Stamp = Tuple[int, int, int]
+
+
+def _size(value: Any) -> int:
+    """
+    Bytes counted against the cache size: the length of text (like message
+    bodies), which can be large. Parsed records and listings are small, and
+    only bounded by the number of entries.
+    """
+    return len(value) if isinstance(value, (str, bytes)) else 0
+
+
+class FileCache:
+    """
+    A per-process LRU cache of values loaded from files or directories (parsed
+    messages, message bodies, directory listings), bounded in entries, and in
+    bytes of text if max_bytes is given; a text larger than that is not kept.
+    An entry is only reused while the path's mtime, size and inode are
+    unchanged; the path is checked again at most every ttl seconds (0 checks
+    on every use).
+    """
+
+    def __init__(self, *, max_entries: int, max_bytes: int = 0, ttl: float = 0) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, Path], tuple[Stamp, float, Any, int]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(
+        self,
+        kind: str,
+        path: Path,
+        load: Callable[[Path], T],
+        *,
+        source: Path | None = None,
+    ) -> T:
+        """
+        Return load(path), cached under kind (several values can be loaded
+        from one path). If given, the entry is checked against source (like
+        the pack holding path) instead of path itself.
+        """
+        key = (kind, path)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]  # type: ignore[no-any-return]
+
+        # Stat before loading, so a change during the load is seen next time
+        try:
+            st = (source or path).stat()
+        except OSError:
+            return load(path)
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+
+        with self._lock:
+            if entry is not None and entry[0] == stamp:
+                self._entries[key] = (stamp, now, entry[2], entry[3])
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]  # type: ignore[no-any-return]
+            self.misses += 1
+
+        value = load(path)
+        size = _size(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[3]
+            if self.max_bytes and size > self.max_bytes:
+                return value
+            self._entries[key] = (stamp, now, value, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes and self.size > self.max_bytes
+            ):
+                _, dropped = self._entries.popitem(last=False)
+                self.size -= dropped[3]
+        return value
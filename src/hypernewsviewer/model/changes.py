@@ -0,0 +1,249 @@
+"""
+Row level change sets between two builds of a database, metadata or search
+(hyper-model diff and patch), so a deployed copy can be brought up to date
+without copying the whole file.
+
+A change set is itself a SQLite file, with the rows to insert or replace and
+the keys to delete for each table, found by walking both builds in key order.
+The full text rows are compared by rowid, which stays put for existing
+messages as long as new messages are newer (a build inserts them in date
+order); they are applied through the FTS5 table, so its index (and the trigram
+index, if any) is updated too.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import shutil
+import sqlite3
+from pathlib import Path
+from typing import Any, Iterator, Tuple
+
+__all__ = ["TABLES", "apply_changes", "diff_databases"]
+
+FORMAT = "1"
+
+# Compared if present (the schemas of the builds must match)
+TABLES = ("msgs", "forums", "people", "fulltext", "fts_meta", "fts_suggest")
+
+# Rows collected before writing them out
+BATCH = 1000
+
+Row = Tuple[Any, ...]
+
+
+def _uri(path: Path, mode: str) -> str:
+    return f"{path.resolve().as_uri()}?mode={mode}"
+
+
+def _schema(db: sqlite3.Connection, prefix: str = "") -> list[list[str]]:
+    rows = db.execute(
+        f"SELECT type, name, sql FROM {prefix}sqlite_master WHERE name NOT LIKE 'sqlite_%' ORDER BY name"
+    )
+    return [list(row) for row in rows]
+
+
+def _stored_table(table: str) -> str:
+    # FTS5 keeps the columns in a content table, keyed on the rowid (id)
+    return f"{table}_content" if table == "fulltext" else table
+
+
+def _key_columns(db: sqlite3.Connection, table: str) -> list[str]:
+    info = db.execute(f"PRAGMA table_info({table})").fetchall()
+    # cid, name, type, notnull, default, position in the primary key
+    return [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5]]
+
+
+def _columns(db: sqlite3.Connection, table: str) -> list[str]:
+    return [row[1] for row in db.execute(f"PRAGMA table_info({table})")]
+
+
+def _counts(db: sqlite3.Connection, tables: list[str]) -> dict[str, int]:
+    return {
+        table: db.execute(f"SELECT count(*) FROM {_stored_table(table)}").fetchone()[0]
+        for table in tables
+    }
+
+
+def _diff_rows(
+    old_rows: Iterator[Row], new_rows: Iterator[Row], width: int
+) -> Iterator[tuple[bool, Row]]:
+    """
+    Merge two row streams sorted on their first width columns (the key),
+    yielding (True, row) for new and changed rows, and (False, key) for keys
+    that are gone.
+    """
+    old = next(old_rows, None)
+    new = next(new_rows, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[:width] < new[:width]):
+            assert old is not None
+            yield False, old[:width]
+            old = next(old_rows, None)
+        elif old is None or new[:width] < old[:width]:
+            yield True, new
+            new = next(new_rows, None)
+        else:
+            if old != new:
+                yield True, new
+            old = next(old_rows, None)
+            new = next(new_rows, None)
+
+
+def diff_databases(old: Path, new: Path, output: Path) -> dict[str, tuple[int, int]]:
+    """
+    Write the changes from old to new into output (replaced if present).
+    Returns the number of rows upserted and deleted per table.
+    """
+    tmp = output.with_name(f"{output.name}.tmp")
+    tmp.unlink(missing_ok=True)
+    summary = {}
+    with contextlib.closing(
+        sqlite3.connect(_uri(old, "ro"), uri=True)
+    ) as old_db, contextlib.closing(
+        sqlite3.connect(_uri(new, "ro"), uri=True)
+    ) as new_db, contextlib.closing(
+        sqlite3.connect(_uri(tmp, "rwc"), uri=True)
+    ) as changes:
+        schema = _schema(new_db)
+        if _schema(old_db) != schema:
+            msg = f"The schemas of {old} and {new} differ, copy {new} instead"
+            raise ValueError(msg)
+        tables = [t for t in TABLES if any(row[1] == t for row in schema)]
+
+        changes.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        changes.executemany(
+            "INSERT INTO meta VALUES (?, ?)",
+            [
+                ("format", FORMAT),
+                ("schema", json.dumps(schema)),
+                ("old_counts", json.dumps(_counts(old_db, tables))),
+                ("new_counts", json.dumps(_counts(new_db, tables))),
+            ],
+        )
+        changes.execute("ATTACH DATABASE ? AS new", (_uri(new, "ro"),))
+
+        for table in tables:
+            stored = _stored_table(table)
+            keys = _key_columns(new_db, stored) or ["rowid"]
+            columns = ", ".join(_columns(new_db, stored))
+            order = ", ".join(keys)
+            changes.execute(
+                f"CREATE TABLE upsert_{table} AS SELECT {columns} FROM new.{stored} WHERE 0"
+            )
+            changes.execute(
+                f"CREATE TABLE delete_{table} AS SELECT {order} FROM new.{stored} WHERE 0"
+            )
+            # Keys first, so rows compare on their key first
+            query = f"SELECT {order}, {columns} FROM {stored} ORDER BY {order}"
+            upserts: list[Row] = []
+            deletes: list[Row] = []
+            upserted = deleted = 0
+            for upsert, row in _diff_rows(
+                old_db.execute(query), new_db.execute(query), len(keys)
+            ):
+                if upsert:
+                    upserts.append(row[len(keys) :])
+                    upserted += 1
+                else:
+                    deletes.append(row)
+                    deleted += 1
+                if len(upserts) + len(deletes) >= BATCH:
+                    _write_rows(changes, table, upserts, deletes)
+            _write_rows(changes, table, upserts, deletes)
+            summary[table] = (upserted, deleted)
+
+        changes.commit()
+        changes.execute("DETACH DATABASE new")
+        changes.execute("VACUUM")
+    tmp.replace(output)
+    return summary
+
+
+def _write_rows(
+    changes: sqlite3.Connection, table: str, upserts: list[Row], deletes: list[Row]
+) -> None:
+    for kind, rows in (("upsert", upserts), ("delete", deletes)):
+        if rows:
+            marks = ", ".join("?" * len(rows[0]))
+            changes.executemany(f"INSERT INTO {kind}_{table} VALUES ({marks})", rows)
+            rows.clear()
+
+
+def _apply_table(db: sqlite3.Connection, table: str) -> None:
+    columns = _columns(db, table)
+    names = ", ".join(columns)
+    keys = ", ".join(_key_columns(db, table) or ["rowid"])
+    db.execute(
+        f"DELETE FROM main.{table} WHERE ({keys}) IN (SELECT {keys} FROM changes.delete_{table})"
+    )
+    db.execute(
+        f"INSERT OR REPLACE INTO main.{table} ({names}) SELECT {names} FROM changes.upsert_{table}"
+    )
+
+
+def _apply_fulltext(db: sqlite3.Connection) -> None:
+    # The content table columns (id, c0, c1, ...) are the FTS5 columns in order
+    columns = _columns(db, "fulltext")
+    content = ", ".join(f"c{i}" for i in range(len(columns)))
+    changed = "SELECT id FROM changes.delete_fulltext UNION ALL SELECT id FROM changes.upsert_fulltext"
+    trigram = _columns(db, "fulltext_trigram")
+    trigram_names = ", ".join(trigram)
+
+    # The trigram index has external content, so the old values are removed
+    # from it before they change
+    if trigram:
+        db.execute(
+            f"INSERT INTO fulltext_trigram(fulltext_trigram, rowid, {trigram_names}) "
+            f"SELECT 'delete', id, {trigram_names} FROM fulltext_docs WHERE id IN ({changed})"
+        )
+    db.execute(f"DELETE FROM fulltext WHERE rowid IN ({changed})")
+    db.execute(
+        f"INSERT INTO fulltext(rowid, {', '.join(columns)}) "
+        f"SELECT id, {content} FROM changes.upsert_fulltext"
+    )
+    if trigram:
+        db.execute(
+            f"INSERT INTO fulltext_trigram(rowid, {trigram_names}) "
+            f"SELECT id, {trigram_names} FROM fulltext_docs WHERE id IN (SELECT id FROM changes.upsert_fulltext)"
+        )
+
+
+def apply_changes(changes: Path, database: Path, output: Path | None = None) -> None:
+    """
+    Apply a change set to a copy of database, then move the copy over output
+    (database by default) in one step, so readers see either build. The
+    database must be the old build the change set was made from.
+    """
+    output = output or database
+    tmp = output.with_name(f".{output.name}.patching")
+    try:
+        shutil.copyfile(database, tmp)
+        with contextlib.closing(sqlite3.connect(_uri(tmp, "rw"), uri=True)) as db:
+            db.execute("ATTACH DATABASE ? AS changes", (_uri(changes, "ro"),))
+            meta = dict(db.execute("SELECT key, value FROM changes.meta"))
+            if meta.get("format") != FORMAT:
+                msg = f"{changes} is not a change set this version can apply"
+                raise ValueError(msg)
+            tables = list(json.loads(meta["old_counts"]))
+            if json.loads(meta["schema"]) != _schema(db, "main.") or json.loads(
+                meta["old_counts"]
+            ) != _counts(db, tables):
+                msg = f"{database} is not the build {changes} was made from"
+                raise ValueError(msg)
+
+            for table in tables:
+                if table == "fulltext":
+                    _apply_fulltext(db)
+                else:
+                    _apply_table(db, table)
+
+            if json.loads(meta["new_counts"]) != _counts(db, tables):
+                msg = f"Applying {changes} did not give the expected rows"
+                raise ValueError(msg)
+            db.commit()
+            db.execute("DETACH DATABASE changes")
+        tmp.replace(output)
+    finally:
+        tmp.unlink(missing_ok=True)
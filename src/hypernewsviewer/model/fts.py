@@ -0,0 +1,84 @@
+"""
+Building the full text search database. Messages are inserted in date order
+with explicit rowids, so a date range is a rowid range, which FTS5 can use to
+skip messages before ranking them. Likewise, the forum is an indexed column,
+so a search can be limited to a forum. The fts_meta table records these,
+search falls back to filtering afterwards for older databases.
+
+Prefix indexes make short prefix queries (like tr*) fast, and the terms of
+the titles and authors are copied, with their document counts, into the
+fts_suggest table for type-ahead suggestions.
+
+An optional trigram index of the titles (and bodies) allows substring
+searches, for identifiers like CMSSW_12_4_0 that the default tokenizer splits.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+from datetime import datetime
+from typing import Iterable, Tuple
+
+__all__ = ["FTSRow", "add_trigram", "create_fts", "fill_fts", "finish_fts"]
+
+# responses, date, title, from_, text
+FTSRow = Tuple[str, datetime, str, str, str]
+
+
+def create_fts(db: sqlite3.Connection) -> None:
+    db.execute(
+        "CREATE VIRTUAL TABLE fulltext USING FTS5(responses UNINDEXED, date UNINDEXED, title, from_, text, forum, prefix='2 3');"
+    )
+    db.execute("CREATE TABLE fts_meta (key TEXT PRIMARY KEY, value TEXT);")
+    db.execute("INSERT INTO fts_meta VALUES ('forum_column', '1');")
+
+
+def fill_fts(db: sqlite3.Connection, rows: Iterable[FTSRow]) -> None:
+    """
+    Insert rows, which must be sorted by date.
+    """
+    db.executemany(
+        "INSERT INTO fulltext(rowid, responses, date, title, from_, text, forum) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((rowid, *row, row[0].split("/")[1]) for rowid, row in enumerate(rows, 1)),
+    )
+
+
+def finish_fts(db: sqlite3.Connection) -> None:
+    # c1 is the date column; rowids follow the dates, so this index maps a
+    # date range to a rowid range
+    db.execute("CREATE INDEX date_index ON fulltext_content(c1);")
+    db.execute("INSERT INTO fulltext(fulltext) VALUES('optimize');")
+    db.execute("INSERT INTO fts_meta VALUES ('date_ordered', '1');")
+    db.execute("CREATE VIRTUAL TABLE fulltext_vocab USING fts5vocab(fulltext, col);")
+    db.execute(
+        "CREATE TABLE fts_suggest (col TEXT, term TEXT, doc INTEGER, PRIMARY KEY (col, term)) WITHOUT ROWID;"
+    )
+    db.execute(
+        "INSERT INTO fts_suggest SELECT col, term, doc FROM fulltext_vocab WHERE col IN ('title', 'from_');"
+    )
+    # Lets searches skip shards outside the date range
+    db.execute(
+        "INSERT INTO fts_meta SELECT 'first_date', min(c1) FROM fulltext_content;"
+    )
+    db.execute(
+        "INSERT INTO fts_meta SELECT 'last_date', max(c1) FROM fulltext_content;"
+    )
+    db.commit()
+
+
+def add_trigram(db: sqlite3.Connection, *, text: bool) -> None:
+    """
+    Add a trigram index of the titles, and the bodies if text is set. The
+    index reads the messages from fulltext_content, so they are not stored
+    twice.
+    """
+    columns = "title, text" if text else "title"
+    db.execute(
+        "CREATE VIEW fulltext_docs AS SELECT id, c2 AS title, c4 AS text FROM fulltext_content;"
+    )
+    db.execute(
+        f"CREATE VIRTUAL TABLE fulltext_trigram USING FTS5({columns}, content='fulltext_docs', content_rowid='id', tokenize='trigram');"
+    )
+    db.execute("INSERT INTO fulltext_trigram(fulltext_trigram) VALUES('rebuild');")
+    db.execute("INSERT INTO fts_meta VALUES ('trigram', ?);", (columns,))
+    db.commit()
@@ -19,15 +19,20 @@ class InfoBase:
 
     @classmethod
     def from_path(cls, path: "os.PathLike[str]") -> Self:
-        btxt = Path(path).read_bytes().translate(None, b"\x0d\x1c\x1d\x1e\x1f")
+        return cls.from_bytes(Path(path).read_bytes(), source=os.fspath(path))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, *, source: str = "<bytes>") -> Self:
+        "Parse the raw contents of a file, source is used in error messages"
+        btxt = data.translate(None, b"\x0d\x1c\x1d\x1e\x1f")
         try:
             txt = btxt.decode("Latin-1")
             return cls.from_file(txt)
         except KeyError as err:
-            msg = f"{err} missing in {path} for {cls.__name__}"
+            msg = f"{err} missing in {source} for {cls.__name__}"
             raise KeyError(msg) from err
         except Exception as err:
-            msg = f"{err} in {path} for {cls.__name__}"
+            msg = f"{err} in {source} for {cls.__name__}"
             raise RuntimeError(msg) from err
 
     @classmethod
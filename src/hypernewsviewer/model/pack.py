@@ -0,0 +1,252 @@
+"""
+A single file holding a whole archive (hyper-model pack), to copy and serve it
+as one large file instead of millions of small ones.
+
+Layout (little endian): the magic, the data of each file (zlib compressed, or
+stored if that is not smaller), the file names, a table of fixed-size records
+sorted by name, and a trailer locating the names and the table. The table is
+searched in place through a memory map, so opening a pack takes the same time
+whatever its size. A symbolic link (like a member alias) is stored as an alias
+record, whose data is the name of the file it points to.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from .._compat.typing import Self
+
+__all__ = ["Pack", "pack_names", "write_pack"]
+
+MAGIC = b"HNPACK2\0"
+# Packs from before alias records, still read
+MAGICS = (b"HNPACK1\0", MAGIC)
+
+# name offset, data offset, stored size, size, name length, method
+RECORD = struct.Struct("<QQQQIB3x")
+
+# names offset, records offset, number of records, magic
+TRAILER = struct.Struct("<QQQ8s")
+
+STORED = 0
+ZLIB = 1
+ALIAS = 2
+
+
+def _encode(name: str) -> bytes:
+    return name.encode("utf-8", "surrogateescape")
+
+
+def _decode(name: bytes) -> str:
+    return name.decode("utf-8", "surrogateescape")
+
+
+def _prefix(directory: str) -> bytes:
+    directory = directory.strip("/")
+    return _encode(f"{directory}/") if directory else b""
+
+
+def _alias_target(root: Path, path: Path) -> str | None:
+    """
+    The name of the file a symbolic link under root points to, if it is under
+    root too.
+    """
+    try:
+        return path.resolve().relative_to(root.resolve()).as_posix()
+    except (OSError, ValueError):
+        return None
+
+
+def pack_names(root: Path) -> list[str]:
+    """
+    The files to pack: all the regular files under root, and symbolic links
+    to them (like member aliases, stored as aliases), as relative POSIX paths
+    in the order they are stored. Databases, and links to directories or
+    outside of root, are left out.
+    """
+    names = []
+    links = []
+    for directory, dirnames, filenames in os.walk(root):
+        here = Path(directory)
+        dirnames[:] = [d for d in dirnames if not here.joinpath(d).is_symlink()]
+        base = here.relative_to(root)
+        for filename in filenames:
+            if filename.endswith(".sql3"):
+                continue
+            name = base.joinpath(filename).as_posix()
+            if here.joinpath(filename).is_symlink():
+                links.append(name)
+            elif here.joinpath(filename).is_file():
+                names.append(name)
+    files = set(names)
+    names += (n for n in links if _alias_target(root, root / n) in files)
+    return sorted(names, key=_encode)
+
+
+def write_pack(
+    root: Path, names: Iterable[str], output: Path, *, level: int = 6
+) -> int:
+    """
+    Pack the named files (sorted, see pack_names) under root into output,
+    replacing it at the end. Returns the total size of the files (not
+    counting aliases).
+    """
+    records = []
+    name_blob = bytearray()
+    total = 0
+    tmp = output.with_name(f"{output.name}.tmp")
+    with tmp.open("wb") as f:
+        f.write(MAGIC)
+        for name in names:
+            path = root.joinpath(name)
+            target = _alias_target(root, path) if path.is_symlink() else None
+            if target is not None:
+                method, data = ALIAS, _encode(target)
+                stored = data
+            else:
+                data = path.read_bytes()
+                compressed = zlib.compress(data, level)
+                method = ZLIB if len(compressed) < len(data) else STORED
+                stored = compressed if method == ZLIB else data
+                total += len(data)
+            encoded = _encode(name)
+            records.append(
+                RECORD.pack(
+                    len(name_blob),
+                    f.tell(),
+                    len(stored),
+                    len(data),
+                    len(encoded),
+                    method,
+                )
+            )
+            name_blob += encoded
+            f.write(stored)
+
+        names_offset = f.tell()
+        f.write(name_blob)
+        records_offset = f.tell()
+        f.writelines(records)
+        f.write(TRAILER.pack(names_offset, records_offset, len(records), MAGIC))
+    tmp.replace(output)
+    return total
+
+
+class Pack:
+    """
+    A read-only, memory mapped pack. Names are relative POSIX paths, like
+    ``forum0/1.html,urc``; reads are safe from several threads.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        with self.path.open("rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < len(MAGIC) + TRAILER.size or self._map[:8] not in MAGICS:
+            msg = f"{self.path} is not a hyper-model pack"
+            raise ValueError(msg)
+        self._names_offset, self._records_offset, self._count, magic = (
+            TRAILER.unpack_from(self._map, len(self._map) - TRAILER.size)
+        )
+        if magic not in MAGICS:
+            msg = f"{self.path} is truncated"
+            raise ValueError(msg)
+
+    def __len__(self) -> int:
+        return self._count  # type: ignore[no-any-return]
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and self._find(_encode(name)) is not None
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._map.close()
+
+    def _record(self, index: int) -> tuple[int, int, int, int, int, int]:
+        return RECORD.unpack_from(self._map, self._records_offset + index * RECORD.size)
+
+    def _name(self, index: int) -> bytes:
+        name_offset, _, _, _, name_length, _ = self._record(index)
+        start = self._names_offset + name_offset
+        return self._map[start : start + name_length]
+
+    def _bisect(self, name: bytes) -> int:
+        # The first record with a name not below name
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(middle) < name:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _find(self, name: bytes) -> int | None:
+        index = self._bisect(name)
+        if index < self._count and self._name(index) == name:
+            return index
+        return None
+
+    def read(self, name: str) -> bytes:
+        """
+        The contents of a file, or of the file an alias points to.
+        """
+        index = self._find(_encode(name))
+        if index is None:
+            msg = f"{name} not found in {self.path}"
+            raise FileNotFoundError(msg)
+        _, offset, stored, size, _, method = self._record(index)
+        data = self._map[offset : offset + stored]
+        if method == ALIAS:
+            # Aliases always point to a file
+            return self.read(_decode(data))
+        return zlib.decompress(data, bufsize=size) if method == ZLIB else data
+
+    def is_alias(self, name: str) -> bool:
+        index = self._find(_encode(name))
+        return index is not None and self._record(index)[5] == ALIAS
+
+    def listdir(self, directory: str) -> list[str]:
+        """
+        The names of the files (and aliases) directly in directory (not
+        subdirectories), sorted.
+        """
+        prefix = _prefix(directory)
+        names = []
+        index = self._bisect(prefix)
+        while index < self._count:
+            name = self._name(index)
+            if not name.startswith(prefix):
+                break
+            rest = name[len(prefix) :]
+            subdirectory, slash, _ = rest.partition(b"/")
+            if slash:
+                # "0" sorts right after "/", so this skips the subdirectory
+                index = self._bisect(prefix + subdirectory + b"0")
+                continue
+            names.append(_decode(rest))
+            index += 1
+        return names
+
+    def walk(self, directory: str) -> Iterator[str]:
+        """
+        The names of all the files below directory, relative to it.
+        """
+        prefix = _prefix(directory)
+        index = self._bisect(prefix)
+        while index < self._count:
+            name = self._name(index)
+            if not name.startswith(prefix):
+                return
+            yield _decode(name[len(prefix) :])
+            index += 1
@@ -0,0 +1,88 @@
+"""
+Summaries of cProfile runs of the CLI, with the time split into the phases of
+a build (parsing, date conversion, SQL, HTML extraction, filesystem).
+"""
+
+from __future__ import annotations
+
+import pstats
+import re
+from collections import Counter
+from typing import Tuple
+
+from rich.table import Table
+
+__all__ = ["CATEGORIES", "categorize", "summary_tables"]
+
+# Function key used by pstats: (filename, line number, function name)
+FunctionKey = Tuple[str, int, str]
+
+# Checked in order against "filename:function"; the first match wins
+CATEGORIES = [
+    ("date conversion", re.compile(r"dateutil|_strptime|convert_datetime|tz\.py")),
+    ("HTML extraction", re.compile(r"bs4|html[/.]parser|markupsafe")),
+    ("SQL", re.compile(r"sqlalchemy|sqlite3|[/\\]fts\.py:")),
+    ("parse", re.compile(r"cattr|converter\.py|messages\.py|inflection|enum")),
+    (
+        "filesystem",
+        re.compile(
+            r"pathlib|glob|posix|[/\\]os\.py|io\.open|_io\.|scandir|listdir|stat\b"
+        ),
+    ),
+    ("progress display", re.compile(r"[/\\]rich[/\\]")),
+]
+
+
+def categorize(key: FunctionKey) -> str:
+    filename, _, function = key
+    name = f"{filename}:{function}"
+    return next(
+        (category for category, pattern in CATEGORIES if pattern.search(name)),
+        "other",
+    )
+
+
+def _name(key: FunctionKey) -> str:
+    filename, line, function = key
+    if filename == "~":
+        return function
+    short = "/".join(filename.replace("\\", "/").split("/")[-2:])
+    return f"{function} ({short}:{line})"
+
+
+def summary_tables(stats: pstats.Stats, top: int = 20) -> tuple[Table, Table]:
+    """
+    Time (own time, so the categories add up) per category, and the functions
+    with the most own time.
+    """
+    # pstats.Stats keeps the raw results here: key -> (calls, ..., own, cumulative, callers)
+    raw = stats.stats  # type: ignore[attr-defined]
+    own: Counter[str] = Counter()
+    for key, (_, _, tottime, _, _) in raw.items():
+        own[categorize(key)] += tottime
+    total = sum(own.values()) or 1.0
+
+    categories = Table(title="Profile by category")
+    categories.add_column("Category")
+    categories.add_column("Seconds", justify="right")
+    categories.add_column("%", justify="right")
+    for category, seconds in own.most_common():
+        categories.add_row(category, f"{seconds:.2f}", f"{seconds / total:.0%}")
+
+    functions = Table(title=f"Top {top} functions by own time")
+    functions.add_column("Function")
+    functions.add_column("Category")
+    functions.add_column("Calls", justify="right")
+    functions.add_column("Own (s)", justify="right")
+    functions.add_column("Cumulative (s)", justify="right")
+    ranked = sorted(raw.items(), key=lambda item: item[1][2], reverse=True)
+    for key, (_, calls, tottime, cumtime, _) in ranked[:top]:
+        functions.add_row(
+            _name(key),
+            categorize(key),
+            str(calls),
+            f"{tottime:.2f}",
+            f"{cumtime:.2f}",
+        )
+
+    return categories, functions
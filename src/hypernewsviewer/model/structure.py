@@ -1,32 +1,118 @@
 from __future__ import annotations
 
+import collections
 import contextlib
+import functools
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Callable, Generator, Iterator, TypeVar
+from typing import Any, Callable, Generator, Iterable, Iterator, TypeVar
 
 import attrs
 import sqlalchemy
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from .messages import Member, URCMain, URCMessage
+from .cache import FileCache
+from .messages import InfoBase, Member, URCMain, URCMessage
+from .pack import Pack
 
-__all__ = ["AllForums", "DBForums", "connect_forums"]
+__all__ = ["AllForums", "DBForums", "PackedForums", "connect_forums"]
 
 log = logging.getLogger("hypernewsviewer.sql")
 
 T = TypeVar("T")
+InfoT = TypeVar("InfoT", bound=InfoBase)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_executor(width: int) -> ThreadPoolExecutor:
+    # Shared by all the AllForums (one per request) with the same width
+    return ThreadPoolExecutor(max_workers=width, thread_name_prefix="readahead")
+
+
+def _read_all(
+    paths: Iterable[Path], read: Callable[[Path], T], readahead: int
+) -> Iterator[T]:
+    """
+    Read each path, in order. With readahead, up to that many reads are run
+    ahead in a thread pool, which hides the latency of network filesystems.
+    """
+    if readahead <= 0:
+        yield from map(read, paths)
+        return
+
+    executor = _get_executor(readahead)
+    pending: collections.deque[Future[T]] = collections.deque()
+    path_iter = iter(paths)
+    try:
+        for path in path_iter:
+            pending.append(executor.submit(read, path))
+            if len(pending) >= readahead:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for path in path_iter:
+                pending.append(executor.submit(read, path))
+                break
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _list_msgs(directory: Path) -> list[Path]:
+    return sorted(directory.glob("*?.html,urc"), key=lambda x: int(x.stem))
+
+
+def _is_member(name: str) -> bool:
+    return not name.startswith(".") and not name.endswith((".sql3", "~"))
+
+
+def _is_urc(name: str) -> bool:
+    return name.endswith(".html,urc") and name != ".html,urc"
+
+
+def _list_members(directory: Path) -> list[Path]:
+    return [
+        p
+        for p in directory.iterdir()
+        if p.is_file() and not p.is_symlink() and _is_member(p.name)
+    ]
+
+
+def _list_forums(directory: Path) -> list[Path]:
+    return list(directory.glob("*?.html,urc"))
+
+
+def _read_text(path: Path) -> str | None:
+    return path.read_text(encoding="Latin-1") if path.exists() else None
 
 
 @attrs.define(kw_only=True)
 class AllForums:
     root: Path = attrs.field(converter=Path)
+    # Number of files read ahead in parallel when listing (0 to read serially)
+    readahead: int = 0
+    # Parsed files and directory listings, reused while unchanged
+    cache: FileCache | None = None
+
+    def _load(self, kind: str, path: Path, load: Callable[[Path], T]) -> T:
+        return load(path) if self.cache is None else self.cache.get(kind, path, load)
+
+    def _read_info(self, kind: str, path: Path, cls: type[InfoT]) -> InfoT:
+        return self._load(kind, path, cls.from_path)
+
+    def _reader(self, kind: str, cls: type[InfoT]) -> Callable[[Path], InfoT]:
+        return functools.partial(self._read_info, kind, cls=cls)
+
+    def _read_text(self, path: Path) -> str | None:
+        return self._load("text", path, _read_text)
 
     def get_msg(self, forum: str, path: str) -> URCMessage:
         assert path, "Must supply a path, use get_forum() instead for empty path"
         abspath = self.root / forum / path
-        return URCMessage.from_path(abspath.with_suffix(".html,urc"))
+        return self._read_info("message", abspath.with_suffix(".html,urc"), URCMessage)
 
     def get_msgs(
         self, forum: str, path: str, *, recursive: bool = False
@@ -35,10 +121,18 @@ class AllForums:
         This allows an empty path, unlike get_msg, since it returns the inner msgs.
         """
 
+        msg_paths = self._iter_msg_paths(forum, path, recursive=recursive)
+        read = self._reader("message", URCMessage)
+        yield from _read_all(msg_paths, read, self.readahead)
+
+    def _iter_msg_paths(
+        self, forum: str, path: str, *, recursive: bool
+    ) -> Iterator[Path]:
+        # Lazy and depth first, so reads can run ahead across a whole thread
         for msg_path in self.get_msg_paths(forum, path):
-            yield URCMessage.from_path(msg_path.with_suffix(".html,urc"))
+            yield msg_path
             if recursive:
-                yield from self.get_msgs(
+                yield from self._iter_msg_paths(
                     forum,
                     f"{path}/{msg_path.stem}" if path else msg_path.stem,
                     recursive=True,
@@ -46,67 +140,105 @@ class AllForums:
 
     def get_msg_paths(self, forum: str, path: str) -> list[Path]:
         abspath = self.root / forum / path
-        return sorted(abspath.glob("*?.html,urc"), key=lambda x: int(x.stem))
+        return list(self._load("messages", abspath, _list_msgs))
+
+    def get_msgs_page(
+        self, forum: str, path: str, *, before: int | None = None, limit: int
+    ) -> list[URCMessage]:
+        """
+        Returns up to limit inner msgs, newest first, starting below the
+        message number ``before`` (from the newest if not given).
+        """
+
+        msg_paths = self.get_msg_paths(forum, path)
+        if before is not None:
+            msg_paths = [p for p in msg_paths if int(p.stem) < before]
+        read = self._reader("message", URCMessage)
+        return list(_read_all(reversed(msg_paths[-limit:]), read, self.readahead))
 
     def get_num_msgs(self, forum: str, path: str, *, recursive: bool = False) -> int:
+        if not recursive:
+            return len(self.get_msg_paths(forum, path))
         abspath = self.root / forum / path
-        return len(list(abspath.glob("**/*?.html,urc" if recursive else "*?.html,urc")))
+        return len(list(abspath.glob("**/*?.html,urc")))
 
-    def get_html(self, forum: str, path: str) -> str | None:
+    def get_num_replies(self, msgs: Iterable[URCMessage]) -> dict[str, int]:
+        """
+        The number of direct replies to each of msgs, by their responses.
+        """
+        counts = {}
+        for msg in msgs:
+            forum, _, path = msg.responses.strip("/").partition("/")
+            counts[msg.responses] = len(self.get_msg_paths(forum, path))
+        return counts
+
+    def _html_path(self, forum: str, path: str) -> Path:
         if path:
             abspath = self.root / forum / path
-            msg = abspath.parent.joinpath(f"{Path(path).stem}-body.html")
-        else:
-            msg = self.root.joinpath(f"{forum}.note")
-        return msg.read_text(encoding="Latin-1") if msg.exists() else None
+            return abspath.parent.joinpath(f"{Path(path).stem}-body.html")
+        return self.root.joinpath(f"{forum}.note")
+
+    def get_html(self, forum: str, path: str) -> str | None:
+        return self._read_text(self._html_path(forum, path))
+
+    def get_htmls(self, forum: str, paths: Iterable[str]) -> Iterator[str | None]:
+        """
+        The body of each message in paths, in order, like get_html.
+        """
+        abspaths = (self._html_path(forum, path) for path in paths)
+        yield from _read_all(abspaths, self._read_text, self.readahead)
 
     def get_member(self, user_id: str) -> Member:
-        return Member.from_path(self.root / "hnpeople" / user_id)
+        return self._read_info("member", self.root / "hnpeople" / user_id, Member)
 
     def get_members_paths(self) -> Iterator[Path]:
-        return (
-            p
-            for p in self.root.joinpath("hnpeople").iterdir()
-            if p.is_file()
-            and not p.is_symlink()
-            and not p.stem.startswith(".")
-            and p.suffix != ".sql3"
-            and not p.name.endswith("~")
-        )
+        return iter(self._load("members", self.root / "hnpeople", _list_members))
 
     def get_member_iter(self) -> Iterator[Member]:
-        for path in sorted(self.get_members_paths()):
-            yield Member.from_path(path)
+        paths = sorted(self.get_members_paths())
+        read = self._reader("member", Member)
+        yield from _read_all(paths, read, self.readahead)
 
     def get_num_members(self) -> int:
         return len(list(self.get_members_paths()))
 
     def get_categories(self) -> dict[int, str]:
         path = self.root / "CATEGORIES"
-        pairs = (
-            a.split(" ", 1)
-            for a in path.read_text(encoding="Latin-1").strip().splitlines()
-        )
+        text = self._read_text(path)
+        if text is None:
+            msg = f"No categories file: {path}"
+            raise FileNotFoundError(msg)
+        pairs = (a.split(" ", 1) for a in text.strip().splitlines())
         return {int(a): b for a, b in pairs}
 
     def get_forum(self, forum: str) -> URCMain:
         abspath = self.root / forum
-        return URCMain.from_path(abspath.with_suffix(".html,urc"))
+        return self._read_info("forum", abspath.with_suffix(".html,urc"), URCMain)
 
     def get_forums_iter(self) -> Iterator[URCMain | None]:
-        for path in sorted(self.root.glob("*?.html,urc")):
-            try:
-                yield URCMain.from_path(path)
-            except (TypeError, ValueError) as e:
-                print(f"Failed to parse: {path}:", e)  # noqa: T201
-                yield None
+        paths = sorted(self.get_forum_paths())
+        yield from _read_all(paths, self._read_forum, self.readahead)
+
+    def _read_forum(self, path: Path) -> URCMain | None:
+        try:
+            return self._read_info("forum", path, URCMain)
+        except (TypeError, ValueError) as e:
+            print(f"Failed to parse: {path}:", e)  # noqa: T201
+            return None
 
     def get_forum_paths(self) -> Iterator[Path]:
-        return self.root.glob("*?.html,urc")
+        return iter(self._load("forums", self.root, _list_forums))
 
     def get_num_forums(self) -> int:
         return len(list(self.get_forum_paths()))
 
+    def get_subtree(self, forum: str, path: str) -> Iterator[URCMessage]:
+        """
+        All msgs below a forum or message, depth first, in numeric order.
+        """
+
+        return self.get_msgs(forum, path, recursive=True)
+
     def walk_tree(
         self, forum: str, path: str, func: Callable[[Path, T], T], start: T
     ) -> Iterator[T]:
@@ -139,8 +271,12 @@ class DBForums(AllForums):
     @staticmethod
     def _get_msg_listing(forum: str, path: str, recursive: bool) -> Any:
         if recursive:
-            return URCMessage.responses.like(  # type: ignore[attr-defined]
-                f"/{forum}/" + (f"{path}/%" if path else "%")
+            # Range on the materialized path, so the primary key index is used
+            # ("0" sorts right after "/")
+            prefix = f"/{forum}/{path}" if path else f"/{forum}"
+            return sqlalchemy.and_(
+                URCMessage.responses > f"{prefix}/",
+                URCMessage.responses < f"{prefix}0",
             )
         return URCMessage.up_url == (
             f"/get/{forum}/{path}.html" if path else f"/get/{forum}.html"
@@ -172,6 +308,19 @@ class DBForums(AllForums):
                 key=lambda x: int(x.stem),
             )
 
+    def get_msgs_page(
+        self, forum: str, path: str, *, before: int | None = None, limit: int
+    ) -> list[URCMessage]:
+        selection = select(URCMessage).where(
+            self._get_msg_listing(forum, path, recursive=False)
+        )
+        if before is not None:
+            selection = selection.where(URCMessage.num < before)
+        selection = selection.order_by(URCMessage.num.desc()).limit(limit)  # type: ignore[attr-defined]
+
+        with Session(self.engine) as session:
+            return list(session.execute(selection).scalars())
+
     def get_num_msgs(self, forum: str, path: str, *, recursive: bool = False) -> int:
         selection = select(sqlalchemy.func.count(URCMessage.responses)).where(
             self._get_msg_listing(forum, path, recursive)
@@ -179,6 +328,21 @@ class DBForums(AllForums):
         with Session(self.engine) as session:
             return session.execute(selection).scalar()  # type: ignore[no-any-return]
 
+    def get_num_replies(self, msgs: Iterable[URCMessage]) -> dict[str, int]:
+        # One query for all of them, not one per message
+        urls = {msg.url: msg.responses for msg in msgs}
+        count = sqlalchemy.func.count(URCMessage.responses)  # type: ignore[arg-type]
+        selection = (
+            select(URCMessage.up_url, count)  # type: ignore[call-overload]
+            .where(URCMessage.up_url.in_(urls))  # type: ignore[attr-defined]
+            .group_by(URCMessage.up_url)
+        )
+        counts = dict.fromkeys(urls.values(), 0)
+        with Session(self.engine) as session:
+            for up_url, num in session.execute(selection):
+                counts[urls[up_url]] = num
+        return counts
+
     # get_html does not use the database
 
     def get_member(self, user_id: str) -> Member:
@@ -217,16 +381,122 @@ class DBForums(AllForums):
             for name in session.execute(selection).scalars():
                 yield self.root / f"{name.strip('/')}.html,urc"
 
-    # walk_tree is only used for the CLI, so not implementing it now
+    def get_subtree(self, forum: str, path: str) -> Iterator[URCMessage]:
+        # The database sorts paths as strings, so 10 would come before 2. Walk
+        # the replies (on the up_url index) keyed by zero-padded numbers; the
+        # ORDER BY makes the walk depth first, so rows stream in thread order.
+        prefix = f"/{forum}/{path}" if path else f"/{forum}"
+        columns = ", ".join(c.name for c in URCMessage.__table__.columns)  # type: ignore[attr-defined]
+        child = ", ".join(f"child.{c.name}" for c in URCMessage.__table__.columns)  # type: ignore[attr-defined]
+        statement = sqlalchemy.text(f"""
+            WITH RECURSIVE tree({columns}, sort_key) AS (
+                SELECT {columns}, printf('%010d',
+                    CAST(substr(responses, length(:prefix) + 2) AS INTEGER)) AS sort_key
+                FROM msgs WHERE up_url = '/get' || :prefix || '.html'
+                UNION ALL
+                SELECT {child}, tree.sort_key || '/' || printf('%010d',
+                    CAST(substr(child.responses, length(tree.responses) + 2)
+                    AS INTEGER))
+                FROM tree JOIN msgs AS child
+                ON child.up_url = '/get' || tree.responses || '.html'
+                ORDER BY sort_key
+            )
+            SELECT {columns} FROM tree
+        """).bindparams(prefix=prefix)
+        selection = select(URCMessage).from_statement(statement)
+
+        with Session(self.engine) as session:
+            yield from session.execute(selection).scalars()
+
+    def walk_tree(
+        self, forum: str, path: str, func: Callable[[Path, T], T], start: T
+    ) -> Iterator[T]:
+        branches = {f"/{forum}/{path}" if path else f"/{forum}": start}
+        for msg in self.get_subtree(forum, path):
+            parent, _ = msg.responses.rsplit("/", 1)
+            msg_path = (self.root / msg.responses.strip("/")).with_suffix(".html,urc")
+            branches[msg.responses] = branch = func(msg_path, branches[parent])
+            yield branch
+
+
+@attrs.define(kw_only=True)
+class PackedForums(AllForums):
+    """
+    Serves an archive from a pack (see hyper-model pack). Paths are where the
+    files were under root, which need not exist.
+    """
+
+    pack: Pack
+
+    def _load(self, kind: str, path: Path, load: Callable[[Path], T]) -> T:
+        # The pack does not change while open, so entries only depend on it
+        if self.cache is None:
+            return load(path)
+        return self.cache.get(kind, path, load, source=self.pack.path)
+
+    def _name(self, path: Path) -> str:
+        return path.relative_to(self.root).as_posix()
+
+    def _parse(self, path: Path, *, cls: type[InfoT]) -> InfoT:
+        name = self._name(path)
+        return cls.from_bytes(self.pack.read(name), source=f"{self.pack.path}:{name}")
+
+    def _read_info(self, kind: str, path: Path, cls: type[InfoT]) -> InfoT:
+        return self._load(kind, path, functools.partial(self._parse, cls=cls))
+
+    def _unpack_text(self, path: Path) -> str | None:
+        try:
+            data = self.pack.read(self._name(path))
+        except FileNotFoundError:
+            return None
+        # Newlines translated like Path.read_text
+        return data.decode("Latin-1").replace("\r\n", "\n").replace("\r", "\n")
+
+    def _read_text(self, path: Path) -> str | None:
+        return self._load("text", path, self._unpack_text)
+
+    def _list_msgs(self, directory: Path) -> list[Path]:
+        names = filter(_is_urc, self.pack.listdir(self._name(directory)))
+        return sorted((directory / n for n in names), key=lambda x: int(x.stem))
+
+    def get_msg_paths(self, forum: str, path: str) -> list[Path]:
+        directory = self.root / forum / path
+        return list(self._load("messages", directory, self._list_msgs))
+
+    def get_num_msgs(self, forum: str, path: str, *, recursive: bool = False) -> int:
+        if not recursive:
+            return len(self.get_msg_paths(forum, path))
+        names = self.pack.walk(f"{forum}/{path}")
+        return sum(_is_urc(n.rpartition("/")[2]) for n in names)
+
+    def get_members_paths(self) -> Iterator[Path]:
+        # Aliases are read through, but not listed, like the symbolic links
+        names = (
+            n
+            for n in self.pack.listdir("hnpeople")
+            if _is_member(n) and not self.pack.is_alias(f"hnpeople/{n}")
+        )
+        return (self.root / "hnpeople" / n for n in names)
+
+    def get_forum_paths(self) -> Iterator[Path]:
+        return (self.root / n for n in filter(_is_urc, self.pack.listdir("")))
 
 
 @contextlib.contextmanager
 def connect_forums(
-    root: Path, db_path: Path | None
+    root: Path,
+    db_path: Path | None,
+    *,
+    readahead: int = 0,
+    cache: FileCache | None = None,
+    pack: Pack | None = None,
 ) -> Generator[AllForums | DBForums, None, None]:
-    if db_path:
+    if pack is not None:
+        # Read from memory, nothing to read ahead
+        yield PackedForums(root=root, pack=pack, cache=cache)
+    elif db_path:
         db_str = f"sqlite:///{db_path}"
         engine = sqlalchemy.create_engine(db_str, future=True)
-        yield DBForums(root=root, engine=engine)
+        yield DBForums(root=root, engine=engine, readahead=readahead, cache=cache)
     else:
-        yield AllForums(root=root)
+        yield AllForums(root=root, readahead=readahead, cache=cache)
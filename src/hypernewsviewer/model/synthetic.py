@@ -0,0 +1,210 @@
+"""
+Generate a synthetic HyperNews archive, shaped like the real one, to test and
+benchmark at scale without the (private) archive.
+"""
+
+from __future__ import annotations
+
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator
+
+import attrs
+
+__all__ = ["ArchiveShape", "generate"]
+
+FIRST_DATE = datetime(2005, 1, 1)
+YEARS = 17
+
+CATEGORIES = ["General", "Software", "Physics", "Computing", "Detector"]
+UP_RELS = ["Default", "News", "Question", "Idea", "Note", "Agree", "Disagree"]
+
+WORDS = [
+    "tracker",
+    "muon",
+    "trigger",
+    "pixel",
+    "alignment",
+    "jet",
+    "calorimeter",
+    "release",
+    "crab",
+    "dataset",
+    "luminosity",
+    "vertex",
+    "electron",
+    "photon",
+    "geometry",
+    "simulation",
+    "reconstruction",
+    "hlt",
+    "dqm",
+    "analysis",
+    "tau",
+    "btag",
+    "met",
+    "pileup",
+    "castor",
+    "condition",
+    "payload",
+    "global",
+    "tag",
+    "workflow",
+    "skim",
+    "ntuple",
+    "validation",
+    "certification",
+    "calibration",
+    "cosmics",
+    "beamspot",
+]
+
+DATE_FORMAT = "%a, %d %b %Y %H:%M:%S GMT"
+
+
+@attrs.define(kw_only=True)
+class ArchiveShape:
+    """
+    Size and skew of a synthetic archive. Forum sizes follow a Zipf law with
+    exponent forum_skew, thread sizes a Pareto law with shape thread_alpha
+    (smaller is more skewed). A reply continues the latest branch of a thread
+    with probability depth_bias, making deep threads, otherwise it replies to
+    a random earlier message, spreading out the fan-out. A fraction
+    attachment_rate of the messages link to an attachment in AUX.
+    """
+
+    messages: int = 10_000
+    forums: int = 20
+    members: int = 2_000
+    forum_skew: float = 1.0
+    thread_alpha: float = 1.2
+    depth_bias: float = 0.5
+    body_words: int = 80
+    attachment_rate: float = 0.02
+    seed: int = 42
+
+
+@attrs.define(kw_only=True)
+class _Node:
+    path: str
+    date: datetime
+    replies: int = 0
+
+
+def _date(date: datetime) -> str:
+    return date.strftime(DATE_FORMAT)
+
+
+def _split(rng: random.Random, total: int, weights: list[float]) -> list[int]:
+    counts = [0] * len(weights)
+    for i in rng.choices(range(len(weights)), weights=weights, k=total):
+        counts[i] += 1
+    return counts
+
+
+def _thread_sizes(rng: random.Random, total: int, alpha: float) -> Iterator[int]:
+    while total > 0:
+        size = min(total, int(rng.paretovariate(alpha)))
+        total -= size
+        yield size
+
+
+def _write(path: Path, text: str) -> None:
+    path.write_text(text, encoding="Latin-1")
+
+
+def _write_forum(
+    root: Path, shape: ArchiveShape, rng: random.Random, forum: str, size: int
+) -> None:
+    _write(
+        root / f"{forum}.html,urc",
+        f"Title: {' '.join(rng.sample(WORDS, 2)).title()} Forum\n"
+        f"Date: {_date(FIRST_DATE)}\n"
+        f"Last-Message-Date: {_date(FIRST_DATE + timedelta(days=365 * YEARS))}\n"
+        f"Last-Mod: {_date(FIRST_DATE)}\n"
+        f"Responses: /{forum}\n"
+        f"Categories: {rng.randrange(len(CATEGORIES))}\n"
+        f"From: user{rng.randrange(shape.members)}\n",
+    )
+    _write(root / f"{forum}.note", f"<p>Discussion of {forum}.</p>\n")
+
+    sizes = list(_thread_sizes(rng, size, shape.thread_alpha))
+    step = timedelta(days=365 * YEARS) / max(len(sizes), 1)
+    for top, thread_size in enumerate(sizes, 1):
+        start = FIRST_DATE + step * (top - 1)
+        thread = [_Node(path=str(top), date=start)]
+        for _ in range(thread_size - 1):
+            parent = (
+                thread[-1] if rng.random() < shape.depth_bias else rng.choice(thread)
+            )
+            parent.replies += 1
+            date = parent.date + timedelta(minutes=rng.randrange(1, 3 * 24 * 60))
+            thread.append(_Node(path=f"{parent.path}/{parent.replies}", date=date))
+        for node in thread:
+            _write_msg(root, shape, rng, forum, node.path, node.date)
+
+
+def _write_msg(
+    root: Path,
+    shape: ArchiveShape,
+    rng: random.Random,
+    forum: str,
+    path: str,
+    date: datetime,
+) -> None:
+    parent, _, num = f"{forum}/{path}".rpartition("/")
+    directory = root / parent
+    directory.mkdir(exist_ok=True)
+    user = f"user{min(int(rng.paretovariate(1.0)) - 1, shape.members - 1)}"
+    words = rng.choices(WORDS, k=shape.body_words)
+    release = f"CMSSW_{rng.randrange(1, 14)}_{rng.randrange(6)}_{rng.randrange(10)}"
+    _write(
+        directory / f"{num}.html,urc",
+        f"Title: {' '.join(words[:5]).capitalize()}\n"
+        f"Date: {_date(date)}\n"
+        f"Last-Message-Date: {_date(date)}\n"
+        f"Last-Mod: {_date(date)}\n"
+        f"Responses: /{forum}/{path}\n"
+        f"Message-ID: <{forum}-{path.replace('/', '-')}@hypernews.cern.ch>\n"
+        f"Num: {num}\n"
+        f"Up-URL: https://hypernews.cern.ch/HyperNews/CMS/get/{parent}.html\n"
+        f"Up-Rel: {rng.choice(UP_RELS)}\n"
+        f"Name: User {user[4:]}\n"
+        f"From: {user}\n",
+    )
+    body = f"<p>{' '.join(words)}</p>\n<pre>cmsRun with {release}</pre>\n"
+    if rng.random() < shape.attachment_rate:
+        attachment = Path("AUX", forum, path.replace("/", "-"), f"{release}.log")
+        root.joinpath(attachment.parent).mkdir(parents=True, exist_ok=True)
+        _write(root / attachment, f"cmsRun {release}\n" * 50)
+        body += f'<a href="/HyperNews/CMS/get/{attachment.as_posix()}">log</a>\n'
+    _write(directory / f"{num}-body.html", body)
+
+
+def generate(root: Path, shape: ArchiveShape) -> None:
+    """
+    Write a synthetic archive (forums, messages with bodies, members and
+    categories) to an empty or new directory.
+    """
+    rng = random.Random(shape.seed)
+    root.mkdir(parents=True, exist_ok=True)
+    _write(
+        root / "CATEGORIES",
+        "".join(f"{i} {name}\n" for i, name in enumerate(CATEGORIES)),
+    )
+
+    people = root / "hnpeople"
+    people.mkdir(exist_ok=True)
+    for i in range(shape.members):
+        _write(
+            people / f"user{i}",
+            f"User-ID: user{i}\nName: User {i}\nEmail: user{i}@cern.ch\nStatus: Member\n",
+        )
+
+    weights = [1 / n**shape.forum_skew for n in range(1, shape.forums + 1)]
+    sizes = _split(rng, shape.messages, weights)
+    for number, size in enumerate(sizes):
+        forum = f"forum{number}"
+        (root / forum).mkdir(exist_ok=True)
+        _write_forum(root, shape, rng, forum, size)
@@ -0,0 +1,865 @@
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Generator, Sequence, cast
+
+import attrs
+import sqlalchemy
+import sqlalchemy.exc
+
+__all__ = [
+    "DATE_MAX",
+    "DATE_MIN",
+    "FTS_QUERY",
+    "FULLTEXT",
+    "HitCounts",
+    "QueryBudget",
+    "SearchCache",
+    "SearchResults",
+    "count_hits",
+    "parse_cursor",
+    "query_budget",
+    "run_search",
+    "snapshot_id",
+    "substring_query",
+    "suggest_terms",
+]
+
+log = logging.getLogger("hypernewsviewer.search")
+
+# The full range of dates in the archive, used when no range is given
+DATE_MIN = "2000-01-01"
+DATE_MAX = "2022-12-31"
+
+RESULTS_PER_PAGE = 50
+
+# Number of forums and authors shown to narrow a search
+FACETS_SHOWN = 10
+
+# Number of completions suggested for a partial word
+SUGGESTIONS = 10
+
+# Number of SQLite VM instructions between checks of the budget
+PROGRESS_STEPS = 1000
+
+FULLTEXT = sqlalchemy.table(
+    "fulltext",
+    sqlalchemy.column("responses"),
+    sqlalchemy.column("title"),
+    sqlalchemy.column("date"),
+    sqlalchemy.column("from_"),
+    sqlalchemy.column("rank"),
+    sqlalchemy.column("rowid"),
+)
+FTS_QUERY = sqlalchemy.select(
+    FULLTEXT.c.responses,
+    FULLTEXT.c.title,
+    FULLTEXT.c.date,
+    FULLTEXT.c.from_,
+    sqlalchemy.text("snippet(fulltext, 4, '<mark>', '</mark>', ' ... ', 64)"),
+)
+
+# The optional trigram index shares its rowids and content with fulltext
+TRIGRAM = sqlalchemy.table(
+    "fulltext_trigram", sqlalchemy.column("rank"), sqlalchemy.column("rowid")
+)
+CONTENT = sqlalchemy.table(
+    "fulltext_content",
+    sqlalchemy.column("id"),
+    sqlalchemy.column("c0"),
+    sqlalchemy.column("c1"),
+    sqlalchemy.column("c2"),
+    sqlalchemy.column("c3"),
+)
+TRIGRAM_CONTENT = TRIGRAM.join(CONTENT, CONTENT.c.id == TRIGRAM.c.rowid)
+
+# Quoted queries, or single words that look like identifiers, file paths, or
+# versions (like CMSSW_12_4_0), are looked for as substrings
+QUOTED_QUERY = re.compile(r'"([^"]+)"')
+IDENTIFIER_QUERY = re.compile(r"[\w./:-]*[_./-][\w./:-]*")
+COLUMN_FILTER = re.compile(r"(title|from_|text)\s*:")
+TITLE_QUERY = re.compile(r"title\s*:\s*(.+)")
+MIN_SUBSTRING = 3
+
+
+@attrs.define(frozen=True)
+class _Index:
+    """
+    A full text index, and where to find the message columns for it.
+    """
+
+    name: str
+    table: sqlalchemy.TableClause
+    content: Any
+    responses: Any
+    date: Any
+    from_: Any
+    rows: Any
+
+    @property
+    def match(self) -> sqlalchemy.TextClause:
+        return sqlalchemy.text(f"{self.name}=:query")
+
+
+FULLTEXT_INDEX = _Index(
+    name="fulltext",
+    table=FULLTEXT,
+    content=FULLTEXT,
+    responses=FULLTEXT.c.responses,
+    date=FULLTEXT.c.date,
+    from_=FULLTEXT.c.from_,
+    rows=FTS_QUERY,
+)
+TRIGRAM_INDEX = _Index(
+    name="fulltext_trigram",
+    table=TRIGRAM,
+    content=TRIGRAM_CONTENT,
+    responses=CONTENT.c.c0,
+    date=CONTENT.c.c1,
+    from_=CONTENT.c.c3,
+    rows=sqlalchemy.select(
+        CONTENT.c.c0,
+        CONTENT.c.c2,
+        CONTENT.c.c1,
+        CONTENT.c.c3,
+        sqlalchemy.text(
+            "snippet(fulltext_trigram, -1, '<mark>', '</mark>', ' ... ', 64)"
+        ),
+    ).select_from(TRIGRAM_CONTENT),
+)
+
+
+@attrs.define(kw_only=True)
+class QueryBudget:
+    deadline: float
+    max_steps: int = 0
+    steps: int = 0
+    exceeded: bool = False
+
+    def tick(self) -> int:
+        """
+        SQLite progress handler, a non-zero return interrupts the query.
+        """
+        self.steps += PROGRESS_STEPS
+        if (self.max_steps and self.steps > self.max_steps) or (
+            time.perf_counter() > self.deadline
+        ):
+            self.exceeded = True
+        return self.exceeded
+
+
+@contextlib.contextmanager
+def query_budget(
+    con: sqlalchemy.Connection, *, seconds: float, steps: int = 0
+) -> Generator[QueryBudget, None, None]:
+    """
+    Interrupt queries on this connection once the time (or, if non-zero, the
+    SQLite VM step) budget is used up. The interrupted query raises an
+    OperationalError, and the budget is marked exceeded.
+    """
+    budget = QueryBudget(deadline=time.perf_counter() + seconds, max_steps=steps)
+    dbapi_con = cast(sqlite3.Connection, con.connection.driver_connection)
+    dbapi_con.set_progress_handler(budget.tick, PROGRESS_STEPS)
+    try:
+        yield budget
+    finally:
+        dbapi_con.set_progress_handler(None, 0)
+
+
+@attrs.define(kw_only=True)
+class SearchResults:
+    rows: list[tuple[Any, ...]]
+    elapsed: float
+    timed_out: bool = False
+    next_cursor: str | None = None
+    hits: int | None = None
+    forums: dict[str, int] = attrs.Factory(dict)
+    authors: dict[str, int] = attrs.Factory(dict)
+    substring: bool = False
+    # Served from a SearchCache, elapsed is the time of the original search
+    cached: bool = False
+
+    def to_json(self) -> str:
+        return json.dumps(attrs.asdict(self))
+
+    @classmethod
+    def from_json(cls, text: str) -> SearchResults:
+        info = json.loads(text)
+        info["rows"] = [tuple(row) for row in info["rows"]]
+        return cls(**info)
+
+
+def _fts_meta(con: sqlalchemy.Connection) -> dict[str, str]:
+    """
+    Read the information populate-search stores with the database (empty for
+    older databases).
+    """
+    try:
+        rows = con.execute(sqlalchemy.text("SELECT key, value FROM fts_meta"))
+    except sqlalchemy.exc.OperationalError:
+        return {}
+    return dict(rows.all())
+
+
+def _date_rowids(con: sqlalchemy.Connection, start: str, stop: str) -> tuple[int, int]:
+    """
+    Find the range of rowids for a range of dates, using the date index.
+    """
+    first = con.execute(
+        sqlalchemy.text(
+            "SELECT id FROM fulltext_content WHERE c1 >= :start ORDER BY c1 LIMIT 1"
+        ),
+        {"start": start},
+    ).scalar_one_or_none()
+    last = con.execute(
+        sqlalchemy.text(
+            "SELECT id FROM fulltext_content WHERE c1 <= :stop ORDER BY c1 DESC LIMIT 1"
+        ),
+        {"stop": stop},
+    ).scalar_one_or_none()
+    if first is None or last is None:
+        return 1, 0
+    return first, last
+
+
+def _quote(value: str) -> str:
+    """
+    Quote a value as an FTS5 string (which matches as a phrase).
+    """
+    escaped = value.replace('"', '""')
+    return f'"{escaped}"'
+
+
+def _fts_query(
+    meta: dict[str, str], query: str, *, forum: str | None, author: str | None
+) -> str:
+    """
+    Add the forum and author filters to the query, so FTS5 applies them before
+    ranking. The forum column (in newer databases) is not searched by the query
+    itself.
+    """
+    forum_column = meta.get("forum_column") == "1"
+    if not forum_column and not author:
+        return query
+    parts = [f"{{title from_ text}} : ({query})" if forum_column else f"({query})"]
+    if forum and forum_column:
+        parts.append(f"forum : ^{_quote(forum)}")
+    if author:
+        parts.append(f"from_ : {_quote(author)}")
+    return " AND ".join(parts)
+
+
+def substring_query(query: str) -> str | None:
+    """
+    The substring to look for, if the query should be run on the trigram index.
+    """
+    query = query.strip()
+    if quoted := QUOTED_QUERY.fullmatch(query):
+        substring = quoted.group(1)
+    elif IDENTIFIER_QUERY.fullmatch(query) and not COLUMN_FILTER.match(query):
+        substring = query
+    else:
+        return None
+    return substring if len(substring) >= MIN_SUBSTRING else None
+
+
+def _choose_index(
+    meta: dict[str, str], query: str, *, forum: str | None, author: str | None
+) -> tuple[_Index, str]:
+    """
+    Pick the index to search, and the query to run on it. A substring query
+    is only run on the trigram index if it covers the columns the query
+    searches: the bodies too, or only the titles for a title: query.
+    """
+    covered = [column.strip() for column in meta.get("trigram", "").split(",")]
+    substring = substring_query(query)
+    if substring is not None and "text" in covered:
+        return TRIGRAM_INDEX, _quote(substring)
+    title = TITLE_QUERY.fullmatch(query.strip())
+    if title is not None and "title" in covered:
+        substring = substring_query(title.group(1))
+        if substring is not None:
+            return TRIGRAM_INDEX, f"title : {_quote(substring)}"
+    return FULLTEXT_INDEX, _fts_query(meta, query, forum=forum, author=author)
+
+
+def _match(
+    con: sqlalchemy.Connection,
+    meta: dict[str, str],
+    index: _Index,
+    *,
+    start: str,
+    stop: str,
+    forum: str | None,
+    author: str | None,
+) -> list[Any]:
+    where: list[Any] = [index.match]
+    if start > DATE_MIN or stop < DATE_MAX:
+        # A rowid range is applied by FTS5 before ranking, unlike a date filter
+        if meta.get("date_ordered") == "1":
+            where.append(index.table.c.rowid.between(*_date_rowids(con, start, stop)))
+        else:
+            where.append(index.date.between(start, stop))
+    # The query only matches tokens, so check for exact values too
+    if forum:
+        where.append(index.responses.startswith(f"/{forum}/", autoescape=True))
+    if author:
+        where.append(index.from_ == author)
+    return where
+
+
+@attrs.define(kw_only=True)
+class HitCounts:
+    hits: int = 0
+    forums: Counter[str] = attrs.Factory(Counter)
+    authors: Counter[str] = attrs.Factory(Counter)
+
+    def add(self, forum: str, author: str, count: int = 1) -> None:
+        self.hits += count
+        self.forums[forum] += count
+        self.authors[author] += count
+
+    def update(self, other: HitCounts) -> None:
+        self.hits += other.hits
+        self.forums.update(other.forums)
+        self.authors.update(other.authors)
+
+
+def _forum_of(responses: Any) -> Any:
+    # "/forum/1/2" -> "forum"
+    rest = sqlalchemy.func.substr(responses, 2)
+    return sqlalchemy.func.substr(rest, 1, sqlalchemy.func.instr(rest + "/", "/") - 1)
+
+
+def count_hits(
+    con: sqlalchemy.Connection,
+    query: str,
+    *,
+    start: str,
+    stop: str,
+    forum: str | None = None,
+    author: str | None = None,
+) -> HitCounts:
+    """
+    Count all the matches, by forum and author, in one pass over the match
+    set (grouped in SQLite). This does not rank the matches, so it is cheaper
+    than the search itself.
+    """
+    meta = _fts_meta(con)
+    index, fts_query = _choose_index(meta, query, forum=forum, author=author)
+    forum_col = _forum_of(index.responses)
+    q = (
+        sqlalchemy.select(forum_col, index.from_, sqlalchemy.func.count())
+        .select_from(index.content)
+        .where(
+            *_match(
+                con, meta, index, start=start, stop=stop, forum=forum, author=author
+            )
+        )
+        .group_by(forum_col, index.from_)
+    )
+    counts = HitCounts()
+    for forum_name, from_, count in con.execute(q, {"query": fts_query}):
+        counts.add(forum_name, from_, count)
+    return counts
+
+
+def _after_condition(index: _Index, shard: int, after: tuple[float, int, int]) -> Any:
+    """
+    The keyset condition for one shard; results are ordered on (rank, shard,
+    rowid) over all the shards.
+    """
+    after_rank, after_shard, after_rowid = after
+    rank, rowid = index.table.c.rank, index.table.c.rowid
+    if shard < after_shard:
+        return rank > after_rank
+    if shard > after_shard:
+        return rank >= after_rank
+    return sqlalchemy.tuple_(rank, rowid) > sqlalchemy.tuple_(after_rank, after_rowid)
+
+
+@attrs.define(kw_only=True)
+class _ShardResults:
+    ranked: list[tuple[float, int, int]] = attrs.Factory(list)
+    rows: dict[int, tuple[Any, ...]] = attrs.Factory(dict)
+    counts: HitCounts = attrs.Factory(HitCounts)
+    timed_out: bool = False
+    substring: bool = False
+
+
+def _rank_shard(
+    engine: sqlalchemy.engine.Engine,
+    shard: int,
+    query: str,
+    *,
+    start: str,
+    stop: str,
+    forum: str | None,
+    author: str | None,
+    limit: int,
+    after: tuple[float, int, int] | None,
+    count: bool,
+    seconds: float,
+    steps: int,
+) -> _ShardResults:
+    results = _ShardResults()
+    with engine.connect() as con, query_budget(
+        con, seconds=seconds, steps=steps
+    ) as budget:
+        try:
+            meta = _fts_meta(con)
+            if (
+                meta.get("last_date", stop) < start
+                or meta.get("first_date", start) > stop
+            ):
+                return results
+
+            index, fts_query = _choose_index(meta, query, forum=forum, author=author)
+            results.substring = index is TRIGRAM_INDEX
+            ranked = (
+                sqlalchemy.select(index.table.c.rank, index.table.c.rowid)
+                .select_from(index.content)
+                .where(
+                    *_match(
+                        con,
+                        meta,
+                        index,
+                        start=start,
+                        stop=stop,
+                        forum=forum,
+                        author=author,
+                    )
+                )
+                .order_by(index.table.c.rank, index.table.c.rowid)
+                .limit(limit)
+            )
+            if after is not None:
+                ranked = ranked.where(_after_condition(index, shard, after))
+            results.ranked = [
+                (rank, shard, rowid)
+                for rank, rowid in con.execute(ranked, {"query": fts_query})
+            ]
+
+            if count:
+                results.counts = count_hits(
+                    con,
+                    query,
+                    start=start,
+                    stop=stop,
+                    forum=forum,
+                    author=author,
+                )
+        except sqlalchemy.exc.OperationalError:
+            if not budget.exceeded:
+                raise
+    results.timed_out = budget.exceeded
+    return results
+
+
+def _snippet_shard(
+    engine: sqlalchemy.engine.Engine,
+    query: str,
+    rowids: list[int],
+    *,
+    forum: str | None,
+    author: str | None,
+    seconds: float,
+    steps: int,
+) -> _ShardResults:
+    results = _ShardResults()
+    with engine.connect() as con, query_budget(
+        con, seconds=seconds, steps=steps
+    ) as budget:
+        try:
+            index, fts_query = _choose_index(
+                _fts_meta(con), query, forum=forum, author=author
+            )
+            q = (
+                index.rows.add_columns(index.table.c.rowid)
+                .where(index.match)
+                .where(index.table.c.rowid.in_(rowids))
+            )
+            results.rows = {
+                row[-1]: tuple(row[:-1]) for row in con.execute(q, {"query": fts_query})
+            }
+        except sqlalchemy.exc.OperationalError:
+            if not budget.exceeded:
+                raise
+    results.timed_out = budget.exceeded
+    return results
+
+
+@functools.lru_cache(maxsize=None)
+def _get_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(thread_name_prefix="search")
+
+
+def _map(
+    function: Callable[..., _ShardResults], calls: list[dict[str, Any]]
+) -> list[_ShardResults]:
+    """
+    Run function for each set of keyword arguments, on the shared thread pool
+    if there is more than one. Each call runs in a copy of the caller's
+    context, so per-request state (like query tracking) follows it.
+    """
+    if len(calls) == 1:
+        return [function(**calls[0])]
+    executor = _get_executor()
+    futures = [
+        executor.submit(
+            contextvars.copy_context().run, functools.partial(function, **kwargs)
+        )
+        for kwargs in calls
+    ]
+    return [future.result() for future in futures]
+
+
+def parse_cursor(after: str) -> tuple[float, int, int]:
+    """
+    Read a next_cursor, as (rank, shard, rowid). Raises ValueError if it is
+    not one.
+    """
+    parts = after.split(":")
+    if len(parts) == 2:  # noqa: PLR2004
+        # Cursors from before sharding
+        parts.insert(1, "0")
+    if len(parts) != 3:  # noqa: PLR2004
+        msg = f"Invalid search cursor {after!r}"
+        raise ValueError(msg)
+    return float(parts[0]), int(parts[1]), int(parts[2])
+
+
+def run_search(
+    engines: sqlalchemy.engine.Engine | Sequence[sqlalchemy.engine.Engine],
+    query: str,
+    *,
+    start: str = DATE_MIN,
+    stop: str = DATE_MAX,
+    forum: str | None = None,
+    author: str | None = None,
+    page: int = 1,
+    after: str | None = None,
+    count: bool = False,
+    seconds: float,
+    steps: int = 0,
+) -> SearchResults:
+    """
+    Run a full text search, returning one page of results. The search database
+    can be split into shards (like one per year), which are searched in
+    parallel, skipping shards outside the date range, and merged by rank.
+
+    Pages are keyset paginated on (rank, shard, rowid); pass the previous
+    page's next_cursor as after (ValueError if it is not one). Without a
+    cursor, page is used as an offset.
+    If count, all the hits are counted, along with the most common forums and
+    authors among them. If the budget runs out, the results are marked as timed out. Matches are only returned once
+    they are all ranked, so a search stopped while ranking has no rows; one
+    stopped later (counting, or making snippets) keeps the ranked page. Quoted
+    and identifier-like queries are run as substring searches on the trigram
+    index, if there is one covering the columns searched.
+    """
+    timer = time.perf_counter()
+    if isinstance(engines, sqlalchemy.engine.Engine):
+        engines = [engines]
+
+    after_key = None
+    offset = 0
+    if after is not None:
+        after_key = parse_cursor(after)
+    else:
+        offset = (max(page, 1) - 1) * RESULTS_PER_PAGE
+
+    # Rank first, then compute the snippets just for the rows shown
+    shard_results = _map(
+        _rank_shard,
+        [
+            {
+                "engine": engine,
+                "shard": shard,
+                "query": query,
+                "start": start,
+                "stop": stop,
+                "forum": forum,
+                "author": author,
+                "limit": offset + RESULTS_PER_PAGE + 1,
+                "after": after_key,
+                "count": count,
+                "seconds": seconds,
+                "steps": steps,
+            }
+            for shard, engine in enumerate(engines)
+        ],
+    )
+
+    results = SearchResults(rows=[], elapsed=0)
+    results.timed_out = any(r.timed_out for r in shard_results)
+    results.substring = any(r.substring for r in shard_results)
+    if count and not results.timed_out:
+        counts = HitCounts()
+        for r in shard_results:
+            counts.update(r.counts)
+        results.hits = counts.hits
+        results.forums = dict(counts.forums.most_common(FACETS_SHOWN))
+        results.authors = dict(counts.authors.most_common(FACETS_SHOWN))
+
+    ranked = sorted(itertools.chain.from_iterable(r.ranked for r in shard_results))
+    page_ids = ranked[offset : offset + RESULTS_PER_PAGE + 1]
+    if len(page_ids) > RESULTS_PER_PAGE:
+        last_rank, last_shard, last_rowid = page_ids[RESULTS_PER_PAGE - 1]
+        results.next_cursor = f"{last_rank!r}:{last_shard}:{last_rowid}"
+        page_ids = page_ids[:RESULTS_PER_PAGE]
+
+    by_shard: dict[int, list[int]] = {}
+    for _, shard, rowid in page_ids:
+        by_shard.setdefault(shard, []).append(rowid)
+    remaining = max(seconds - (time.perf_counter() - timer), 0)
+    snippets = _map(
+        _snippet_shard,
+        [
+            {
+                "engine": engines[shard],
+                "query": query,
+                "rowids": rowids,
+                "forum": forum,
+                "author": author,
+                "seconds": remaining,
+                "steps": steps,
+            }
+            for shard, rowids in by_shard.items()
+        ],
+    )
+    rows = {
+        (shard, rowid): row
+        for shard, found in zip(by_shard, snippets)
+        for rowid, row in found.rows.items()
+    }
+    results.rows = [
+        rows[shard, rowid] for _, shard, rowid in page_ids if (shard, rowid) in rows
+    ]
+    results.timed_out |= any(r.timed_out for r in snippets)
+
+    results.elapsed = time.perf_counter() - timer
+    return results
+
+
+def _suggest_shard(
+    con: sqlalchemy.Connection, column: str, first: str, stop: str, limit: int
+) -> list[tuple[str, int]]:
+    params = {"column": column, "first": first, "stop": stop, "limit": limit}
+    try:
+        return [
+            (term, doc)
+            for term, doc in con.execute(
+                sqlalchemy.text(
+                    "SELECT term, doc FROM fts_suggest WHERE col = :column AND term >= :first AND term < :stop ORDER BY doc DESC, term LIMIT :limit"
+                ),
+                params,
+            )
+        ]
+    except sqlalchemy.exc.OperationalError:
+        pass
+
+    # Older databases: read the terms from the index (much slower)
+    con.execute(
+        sqlalchemy.text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS temp.fulltext_vocab USING fts5vocab(main, fulltext, col)"
+        )
+    )
+    return [
+        (term, doc)
+        for term, doc in con.execute(
+            sqlalchemy.text(
+                "SELECT term, doc FROM temp.fulltext_vocab WHERE col = :column AND term >= :first AND term < :stop ORDER BY doc DESC, term LIMIT :limit"
+            ),
+            params,
+        )
+    ]
+
+
+def suggest_terms(
+    engines: sqlalchemy.engine.Engine | Sequence[sqlalchemy.engine.Engine],
+    prefix: str,
+    *,
+    column: str,
+    limit: int = SUGGESTIONS,
+) -> list[str]:
+    """
+    Suggest completions of prefix from the terms in a column, most common
+    first. This does not run a search, so it is fast enough for type-ahead.
+    """
+    if isinstance(engines, sqlalchemy.engine.Engine):
+        engines = [engines]
+    # The index is case folded
+    prefix = prefix.lower()
+    if not prefix:
+        return []
+    stop = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    docs: Counter[str] = Counter()
+    for engine in engines:
+        with engine.connect() as con:
+            docs.update(dict(_suggest_shard(con, column, prefix, stop, limit)))
+    ranked = sorted(docs.items(), key=lambda item: (-item[1], item[0]))
+    return [term for term, _ in ranked[:limit]]
+
+
+def snapshot_id(path: os.PathLike[str]) -> str:
+    """
+    Identify a version of a database file. A rebuilt or replaced file gets a
+    new id, which invalidates anything cached for the old one.
+    """
+    st = Path(path).stat()
+    return f"{st.st_dev}-{st.st_ino}-{st.st_size}-{st.st_mtime_ns}"
+
+
+class SearchCache:
+    """
+    An LRU cache of search results, bounded in entries and (JSON) bytes. If a
+    shared path is given, results are also stored in a SQLite file there, so
+    all the workers on a node can share them.
+    """
+
+    def __init__(
+        self, *, max_entries: int, max_bytes: int, shared: Path | None = None
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[SearchResults, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        if shared is not None:
+            try:
+                shared.parent.mkdir(parents=True, exist_ok=True)
+                with contextlib.closing(self._connect_shared()) as db:
+                    db.execute("PRAGMA journal_mode=WAL")
+                    db.execute(
+                        "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, used REAL)"
+                    )
+                    db.commit()
+            except (OSError, sqlite3.Error) as err:
+                log.warning(
+                    "Shared search cache %s unavailable, caching in memory only: %s",
+                    shared,
+                    err,
+                )
+                self.shared = None
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def make_key(snapshot: str, query: str, **options: Any) -> str:
+        # FTS5 ignores extra whitespace, but operators are case sensitive
+        normalized = " ".join(query.split())
+        return json.dumps([snapshot, normalized, sorted(options.items())])
+
+    def _connect_shared(self) -> sqlite3.Connection:
+        assert self.shared is not None
+        return sqlite3.connect(str(self.shared), timeout=0.1)
+
+    def get(self, key: str) -> SearchResults | None:
+        """
+        The results stored under key, marked as cached, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return attrs.evolve(entry[0], cached=True)
+
+        text = self._get_shared(key) if self.shared is not None else None
+        if text is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        results = SearchResults.from_json(text)
+        self._put_local(key, results, len(text))
+        with self._lock:
+            self.hits += 1
+        return attrs.evolve(results, cached=True)
+
+    def put(self, key: str, results: SearchResults) -> None:
+        results = attrs.evolve(results, cached=False)
+        text = results.to_json()
+        if len(text) > self.max_bytes:
+            return
+        self._put_local(key, results, len(text))
+        if self.shared is not None:
+            self._put_shared(key, text)
+
+    def _put_local(self, key: str, results: SearchResults, size: int) -> None:
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (results, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self.size -= dropped
+
+    # The shared store is only an optimization, so failures (like a locked
+    # database) are logged and ignored
+
+    def _get_shared(self, key: str) -> str | None:
+        try:
+            with contextlib.closing(self._connect_shared()) as db:
+                row = db.execute(
+                    "SELECT value FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE cache SET used = ? WHERE key = ?", (time.time(), key)
+                    )
+                    db.commit()
+        except sqlite3.Error as err:
+            log.warning("Shared search cache unavailable: %s", err)
+            return None
+        return row[0] if row is not None else None
+
+    def _put_shared(self, key: str, text: str) -> None:
+        try:
+            with contextlib.closing(self._connect_shared()) as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                    (key, text, time.time()),
+                )
+                # Keep the most recently used entries, within the same bounds
+                # as in memory (the freed pages are reused by later entries)
+                db.execute(
+                    """
+                    DELETE FROM cache WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key,
+                                row_number() OVER recent AS n,
+                                sum(length(value)) OVER recent AS total
+                            FROM cache
+                            WINDOW recent AS (ORDER BY used DESC)
+                        )
+                        WHERE n > ? OR total > ?
+                    )
+                    """,
+                    (self.max_entries, self.max_bytes),
+                )
+                db.commit()
+        except sqlite3.Error as err:
+            log.warning("Shared search cache unavailable: %s", err)
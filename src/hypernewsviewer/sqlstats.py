@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Generator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+__all__ = ["QueryBudgetExceeded", "QueryStats", "start_tracking", "track_queries"]
+
+log = logging.getLogger("hypernewsviewer.sql")
+
+WHITESPACE = re.compile(r"\s+")
+
+_current: contextvars.ContextVar[QueryStats | None] = contextvars.ContextVar(
+    "hypernewsviewer_query_stats", default=None
+)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class QueryStats:
+    """
+    Statements run (on any engine) and time spent in them, while tracking.
+    Statements are grouped by their SQL text, which has the parameters left
+    out, so the same query run in a loop shows up as one repeated shape.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes: Counter[str] = Counter()
+        # Search shards run their queries on a thread pool
+        self._lock = threading.Lock()
+
+    def add(self, statement: str, seconds: float) -> None:
+        shape = WHITESPACE.sub(" ", statement).strip()
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            self.shapes[shape] += 1
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        """
+        Statement shapes run at least threshold times, most common first.
+        """
+        return [
+            (shape, count)
+            for shape, count in self.shapes.most_common()
+            if count >= threshold
+        ]
+
+    def check(self, where: str, *, budget: int, repeat: int, strict: bool) -> None:
+        """
+        Report statements repeated at least repeat times (likely a query in a
+        loop, 0 to allow any), and going over budget statements (0 for no
+        budget). These are errors if strict, otherwise warnings.
+        """
+        problems = [
+            f"{shape} ran {count} times in {where}"
+            for shape, count in (self.repeated(repeat) if repeat else [])
+        ]
+        if budget and self.count > budget:
+            problems.append(
+                f"{where} ran {self.count} SQL statements, over the budget of {budget}"
+            )
+        if strict and problems:
+            raise QueryBudgetExceeded("; ".join(problems))
+        for problem in problems:
+            log.warning(problem)
+
+
+def start_tracking() -> QueryStats:
+    """
+    Count the statements run in this thread (or task) from now on, until
+    tracking is started again. Used per request, since the thread is reused.
+    """
+    stats = QueryStats()
+    _current.set(stats)
+    return stats
+
+
+@contextlib.contextmanager
+def track_queries() -> Generator[QueryStats, None, None]:
+    """
+    Count the statements run in this thread (or task) within the block.
+    """
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(
+    conn: Any, _cursor: Any, _statement: str, *_args: Any
+) -> None:
+    if _current.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn: Any, _cursor: Any, statement: str, *_args: Any) -> None:
+    stats = _current.get()
+    starts = conn.info.get("query_start")
+    if stats is not None and starts:
+        stats.add(statement, time.perf_counter() - starts.pop())
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import contextlib
+import functools
+import time
+from collections import Counter
+from typing import Any, Generator, Iterator
+
+__all__ = ["RequestTimer", "TimedForums"]
+
+
+class RequestTimer:
+    """
+    Calls and time spent per phase of a request, for the Server-Timing header
+    and the timing log.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.calls: Counter[str] = Counter()
+        self.seconds: dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def measure(self, name: str, *, count: bool = True) -> Generator[None, None, None]:
+        if count:
+            self.calls[name] += 1
+        timer = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - timer
+            self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+
+    def measure_iter(self, name: str, iterator: Iterator[Any]) -> Iterator[Any]:
+        """
+        Time a lazy result (like a generator) while it is consumed.
+        """
+        while True:
+            with self.measure(name, count=False):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.start
+
+    def header(self) -> str:
+        """
+        Server-Timing header value, durations in milliseconds.
+        """
+        metrics = [
+            f'{name};dur={seconds * 1000:.2f};desc="{self.calls[name]}x"'
+            for name, seconds in self.seconds.items()
+        ]
+        metrics.append(f"total;dur={self.total * 1000:.2f}")
+        return ", ".join(metrics)
+
+    def record(self) -> dict[str, Any]:
+        """
+        Calls and milliseconds per phase, for structured logging.
+        """
+        return {
+            "total_ms": round(self.total * 1000, 2),
+            "phases": {
+                name: {"calls": self.calls[name], "ms": round(seconds * 1000, 2)}
+                for name, seconds in self.seconds.items()
+            },
+        }
+
+
+class TimedForums:
+    """
+    Proxy for AllForums or DBForums that times each method call. Iterators
+    returned are timed as they are consumed.
+    """
+
+    def __init__(self, forums: Any, timer: RequestTimer) -> None:
+        self._forums = forums
+        self._timer = timer
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._forums, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            with self._timer.measure(name):
+                result = attr(*args, **kwargs)
+            if isinstance(result, Iterator):
+                return self._timer.measure_iter(name, result)
+            return result
+
+        return timed
@@ -0,0 +1,43 @@
+# pylint: disable=redefined-outer-name
+from __future__ import annotations
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from hypernewsviewer.model.synthetic import ArchiveShape, generate
+
+SHAPE = ArchiveShape(messages=400, forums=4, members=50, body_words=20)
+
+
+@pytest.fixture(scope="session")
+def synthetic_root(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """
+    A small synthetic archive, shared by all tests (do not modify).
+    """
+    root = tmp_path_factory.mktemp("synthetic") / "files"
+    generate(root, SHAPE)
+    return root
+
+
+@pytest.fixture(scope="session")
+def synthetic_db(synthetic_root: Path) -> Path:
+    """
+    The synthetic archive, populated into a database.
+    """
+    path = synthetic_root.parent / "db.sql3"
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "hypernewsviewer.model",
+            f"--root={synthetic_root}",
+            f"--db={path}",
+            "populate",
+        ],
+        capture_output=True,
+        check=True,
+    )
+    return path
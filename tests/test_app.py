@@ -0,0 +1,381 @@
+from __future__ import annotations
+
+import contextlib
+import gzip
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+import sqlalchemy
+
+from hypernewsviewer import core
+from hypernewsviewer.admission import SlotLimiter
+from hypernewsviewer.app import app
+from hypernewsviewer.compress import STREAM_FLUSH_SIZE, CompressedCache
+from hypernewsviewer.core import ICON_DIGESTS
+from hypernewsviewer.metrics import Metrics
+from hypernewsviewer.model.enums import UpRelType
+from hypernewsviewer.model.fts import create_fts, fill_fts, finish_fts
+from hypernewsviewer.sqlstats import QueryBudgetExceeded, track_queries
+from hypernewsviewer.timing import RequestTimer, TimedForums
+
+
+@pytest.fixture
+def client():
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        yield client
+
+
+@pytest.fixture(params=["files", "db"])
+def synthetic_client(request, synthetic_root, synthetic_db, monkeypatch):
+    """
+    A client serving the synthetic archive, from the files or the database.
+    """
+    monkeypatch.setattr(core, "DATA_ROOT", synthetic_root)
+    monkeypatch.setattr(
+        core, "DB_ROOT", synthetic_db if request.param == "db" else None
+    )
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        yield client
+
+
+def make_fts(path, n):
+    with contextlib.closing(sqlite3.connect(str(path))) as db:
+        create_fts(db)
+        fill_fts(
+            db,
+            (
+                (
+                    f"/forum{i % 3}/{i}",
+                    f"2005-01-{i % 28 + 1:02}",
+                    f"Message {i}",
+                    f"user{i % 5}",
+                    f"About the tracker {i}",
+                )
+                for i in range(n)
+            ),
+        )
+        finish_fts(db)
+
+
+@pytest.fixture
+def search_client(client, tmp_path, monkeypatch):
+    """
+    A client searching a small full text database.
+    """
+    path = tmp_path / "fts.sql3"
+    make_fts(path, 120)
+    monkeypatch.setattr(core, "HNFTSDATABASE", str(path))
+    return client
+
+
+def test_icon_fingerprint(client):
+    with app.test_request_context():
+        url = app.jinja_env.filters["urc_icon"](UpRelType.News)
+    assert url == f"/HyperNews/CMS/Icons/news.gif?v={ICON_DIGESTS['news.gif']}"
+
+    with client.get(url) as response:
+        assert response.status_code == 200
+        assert response.cache_control.immutable
+        assert response.cache_control.max_age == 365 * 24 * 60 * 60
+
+    # Behind a proxy mounting the app under a prefix
+    with app.test_request_context(base_url="http://localhost/mirror"):
+        mirrored = app.jinja_env.filters["urc_icon"](UpRelType.News)
+    assert mirrored.startswith("/mirror/HyperNews/CMS/Icons/news.gif?v=")
+
+
+def test_icon_stale_fingerprint(client):
+    with client.get("/HyperNews/CMS/Icons/news.gif?v=0000") as response:
+        assert response.status_code == 200
+        assert not response.cache_control.immutable
+
+    with client.get("/HyperNews/CMS/Icons/news.gif") as response:
+        assert not response.cache_control.immutable
+
+
+def test_compression(client):
+    plain = client.get("/HyperNews/CMS/top.pl", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert "Accept-Encoding" in plain.vary
+
+    response = client.get("/HyperNews/CMS/top.pl", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data) == plain.data
+
+
+def test_server_timing(client):
+    response = client.get("/HyperNews/CMS/top.pl", headers={"Accept-Encoding": "gzip"})
+    timing = response.headers["Server-Timing"]
+    assert timing.startswith("render;dur=")
+    assert "compress;dur=" in timing
+    assert timing.split(", ")[-1].startswith("total;dur=")
+
+
+def test_timed_forums():
+    class Forums:
+        root = "hn"
+
+        def get_num_msgs(self):
+            return 3
+
+        def get_forums_iter(self):
+            yield from range(3)
+
+    timer = RequestTimer()
+    forums = TimedForums(Forums(), timer)
+    assert forums.root == "hn"
+    assert forums.get_num_msgs() == 3
+    assert forums.get_num_msgs() == 3
+    assert list(forums.get_forums_iter()) == [0, 1, 2]
+    assert timer.calls == {"get_num_msgs": 2, "get_forums_iter": 1}
+    assert set(timer.record()["phases"]) == {"get_num_msgs", "get_forums_iter"}
+
+
+def test_query_stats(caplog):
+    engine = sqlalchemy.create_engine("sqlite://")
+    with track_queries() as stats, engine.connect() as connection:
+        for i in range(3):
+            connection.execute(sqlalchemy.text("SELECT :i"), {"i": i})
+        connection.execute(sqlalchemy.text("SELECT  2"))
+    assert stats.count == 4
+    assert stats.repeated(2) == [("SELECT ?", 3)]
+
+    stats.check("test", budget=4, repeat=3, strict=False)
+    assert "SELECT ? ran 3 times in test" in caplog.text
+    with pytest.raises(QueryBudgetExceeded, match="ran 3 times"):
+        stats.check("test", budget=4, repeat=3, strict=True)
+    stats.check("test", budget=3, repeat=0, strict=False)
+    assert "over the budget of 3" in caplog.text
+    with pytest.raises(QueryBudgetExceeded):
+        stats.check("test", budget=3, repeat=0, strict=True)
+
+
+def test_get_queries(synthetic_client):
+    # A streamed forum page of replies, and a message with replies; a query
+    # per reply fails when testing, once the page is rendered
+    for url in ("get/forum0.html", "get/forum0/15.html", "thread/forum0/15"):
+        with synthetic_client.get(f"/HyperNews/CMS/{url}") as response:
+            assert response.status_code == 200
+            assert "/forum0/" in response.text
+
+
+def test_missing_member(synthetic_client):
+    response = synthetic_client.get("/HyperNews/CMS/view-member.pl?user1")
+    assert response.status_code == 200
+    response = synthetic_client.get("/HyperNews/CMS/view-member.pl?nobody")
+    assert response.status_code == 404
+
+
+def test_metrics(tmp_path):
+    metrics = Metrics(tmp_path)
+    metrics.counter("hn_total", "Things")
+    metrics.histogram("hn_seconds", "Time", (0.1, 1.0))
+    metrics.inc("hn_total", kind='a"b')
+    metrics.observe("hn_seconds", 0.5, route="get")
+    metrics.observe("hn_seconds", 5, route="get")
+    metrics.flush()
+    assert [p.name for p in tmp_path.iterdir()] == [f"metrics-{os.getpid()}.json"]
+
+    # Another (running) worker, and one that has exited
+    other = json.loads(tmp_path.joinpath(f"metrics-{os.getpid()}.json").read_text())
+    tmp_path.joinpath(f"metrics-{os.getppid()}.json").write_text(json.dumps(other))
+    tmp_path.joinpath("metrics-999999999.json").write_text(json.dumps(other))
+
+    text = metrics.render([("hn_running", "Running", {}, 2)])
+    assert "# TYPE hn_total counter" in text
+    assert 'hn_total{kind="a\\"b"} 3' in text
+    assert 'hn_seconds_bucket{route="get",le="0.1"} 0' in text
+    assert 'hn_seconds_bucket{route="get",le="1"} 3' in text
+    assert 'hn_seconds_bucket{route="get",le="+Inf"} 6' in text
+    assert 'hn_seconds_sum{route="get"} 16.5' in text
+    assert 'hn_seconds_count{route="get"} 6' in text
+    assert text.endswith("# TYPE hn_running gauge\nhn_running 2\n")
+
+    # The exited worker's values are kept, once, after its file is removed
+    assert not tmp_path.joinpath("metrics-999999999.json").exists()
+    tmp_path.joinpath("metrics-999999998.json").write_text(json.dumps(other))
+    text = metrics.render([])
+    assert 'hn_total{kind="a\\"b"} 4' in text
+    assert 'hn_seconds_count{route="get"} 8' in text
+    assert metrics.render([]) == text
+
+
+def test_metrics_page(client):
+    # Requests are recorded once the response is closed
+    client.get("/HyperNews/CMS/top.pl").close()
+    response = client.get("/metrics")
+    assert response.mimetype == "text/plain"
+    assert (
+        'hypernewsviewer_request_duration_seconds_count{route="home_page"}'
+        in response.text
+    )
+
+
+def test_compressed_cache():
+    cache = CompressedCache(max_bytes=10_000)
+    data = b"hypernews " * 1000
+    first = cache.get(data, "gzip")
+    assert cache.get(data, "gzip") is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert gzip.decompress(first) == data
+
+    for i in range(200):
+        cache.get(f"{i} {data.decode()}".encode(), "gzip")
+    assert cache.size <= cache.max_bytes
+
+
+def test_slot_limiter(tmp_path):
+    limiter = SlotLimiter(tmp_path, name="test", slots=1, queue=1, wait=0.05)
+    with limiter.acquire() as first:
+        assert first
+        assert limiter.running() == 1
+        # No slot frees up while waiting in the queue
+        with limiter.acquire() as second:
+            assert not second
+    with limiter.acquire() as third:
+        assert third
+    stats = limiter.stats()
+    assert stats["running"] == stats["waiting"] == 0
+    assert (stats["admitted"], stats["rejected"], stats["waited"]) == (2, 1, 1)
+
+    no_queue = SlotLimiter(tmp_path, name="test", slots=1, queue=0, wait=10)
+    with limiter.acquire(), no_queue.acquire() as admitted:
+        assert not admitted
+    assert no_queue.waited == 0
+
+
+def test_slot_limiter_stats(tmp_path, monkeypatch):
+    limiter = SlotLimiter(tmp_path, name="test", slots=2, queue=1, wait=0.05)
+    # A worker that died holding a slot leaves its process id behind
+    tmp_path.joinpath("test-run-1.lock").write_text("999999999\n")
+    with limiter.acquire():
+        # Counting the slots in use does not take the locks
+        monkeypatch.setattr(limiter, "_try_lock_one", None)
+        assert limiter.running() == 1
+        assert limiter.stats()["waiting"] == 0
+        monkeypatch.undo()
+    assert limiter.running() == 0
+
+
+def test_search_stats(client):
+    response = client.get("/HyperNews/CMS/search/stats")
+    assert response.json["limiter"]["running"] == 0
+    assert "hit_rate" in response.json["cache"]
+
+
+@pytest.mark.parametrize(
+    ("env", "message"),
+    [
+        ({"HNSEARCHSLOTS": "-1"}, "ValueError: HNSEARCHSLOTS must be 0"),
+        ({"HNSEARCHQUEUE": "-1"}, "ValueError: HNSEARCHQUEUE must be 0"),
+        ({"HNSEARCHQUEUE": "8"}, "HNSEARCHQUEUE=8 cut down to 0"),
+    ],
+)
+def test_search_limits_checked(env, message):
+    result = subprocess.run(
+        [sys.executable, "-c", "import hypernewsviewer.core"],
+        capture_output=True,
+        check=False,
+        text=True,
+        env={**os.environ, "GUNICORN_THREADS": "1", **env},
+    )
+    assert message in result.stderr
+
+
+def test_search_suggest(client):
+    response = client.get("/HyperNews/CMS/search/suggest?q=track")
+    assert response.json == {"title": [], "author": []}
+    assert response.cache_control.public
+
+
+def test_streamed_listings(synthetic_client, monkeypatch):
+    def get(url):
+        with synthetic_client.get(f"/HyperNews/CMS/{url}") as response:
+            assert response.status_code == 200
+            # Streamed responses have no length
+            return response.text, "Content-Length" not in response.headers
+
+    # A full page of replies is streamed with the default threshold; members
+    # are sorted in memory first, so they are not
+    assert get("get/forum0.html")[1]
+    assert not get("view-members.pl")[1]
+
+    # Threads are read ahead up to the threshold, not counted
+    monkeypatch.setattr(core, "HNSTREAMTHRESHOLD", 20)
+    text, streamed = get("thread/forum0/15")
+    assert streamed
+    assert text.count('href="/HyperNews/CMS/get/forum0/15/') == 30
+    assert not get("thread/forum0/2")[1]
+
+
+def test_streamed_compression(synthetic_client):
+    url = "/HyperNews/CMS/get/forum0.html"
+    with synthetic_client.get(url) as response:
+        plain = response.data
+    with synthetic_client.get(url, headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.is_streamed
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.vary
+        assert gzip.decompress(response.data) == plain
+    assert len(plain) > STREAM_FLUSH_SIZE
+
+
+def test_search_cursor(search_client):
+    response = search_client.get("/HyperNews/CMS/search?q=tracker")
+    assert response.status_code == 200
+    assert "120 hits" in response.text
+    response = search_client.get("/HyperNews/CMS/search?q=tracker&page=x")
+    assert response.status_code == 200
+    response = search_client.get("/HyperNews/CMS/search?q=tracker&after=bad")
+    assert response.status_code == 400
+
+
+def test_search_cached(search_client):
+    response = search_client.get("/HyperNews/CMS/search?q=tracker")
+    assert "(took " in response.text
+    response = search_client.get("/HyperNews/CMS/search?q=tracker")
+    assert "(cached)" in response.text
+
+
+def test_search_replaced(search_client, tmp_path):
+    response = search_client.get("/HyperNews/CMS/search?q=tracker")
+    assert "120 hits" in response.text
+
+    # Like hyper-model patch, or copying a new build in place
+    make_fts(tmp_path / "new.sql3", 30)
+    tmp_path.joinpath("new.sql3").replace(tmp_path / "fts.sql3")
+    response = search_client.get("/HyperNews/CMS/search?q=tracker")
+    assert "30 hits" in response.text
+
+
+def test_search_new_shard(client, tmp_path, monkeypatch):
+    shards = tmp_path / "shards"
+    shards.mkdir()
+    make_fts(shards / "fulltext-2005.sql3", 120)
+    monkeypatch.setattr(core, "HNFTSDATABASE", str(shards))
+    response = client.get("/HyperNews/CMS/search?q=tracker")
+    assert "120 hits" in response.text
+
+    # Like populate-search --shard-by-year --year for a new year
+    make_fts(shards / "fulltext-2006.sql3", 30)
+    response = client.get("/HyperNews/CMS/search?q=tracker")
+    assert "150 hits" in response.text
+
+
+def test_search_no_database(client):
+    response = client.get("/HyperNews/CMS/search?q=tracker")
+    assert response.status_code == 200
+    assert "No database configured" in response.text
+
+
+def test_search_facets(search_client):
+    response = search_client.get("/HyperNews/CMS/search?q=tracker")
+    assert "120 hits" in response.text
+    assert "By forum:" in response.text
+    assert "forum0</a> (40)" in response.text
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import contextlib
+import shutil
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+from hypernewsviewer.model.changes import apply_changes, diff_databases
+from hypernewsviewer.model.fts import add_trigram, create_fts, fill_fts, finish_fts
+
+
+def make_rows(n):
+    start = datetime(2005, 1, 1)
+    for i in range(n):
+        yield (
+            f"/forum{i % 3}/{i}",
+            str(start + timedelta(days=i)),
+            f"Message {i} about muon",
+            f"user{i % 5}",
+            f"Some text in CMSSW_{i % 4}_{i % 3}_0",
+        )
+
+
+def make_fts(path, rows):
+    with contextlib.closing(sqlite3.connect(str(path))) as db:
+        create_fts(db)
+        fill_fts(db, rows)
+        finish_fts(db)
+        add_trigram(db, text=True)
+
+
+def dump(path, *queries):
+    with contextlib.closing(sqlite3.connect(str(path))) as db:
+        return [db.execute(query).fetchall() for query in queries]
+
+
+def test_diff_fulltext(tmp_path):
+    old, new, changes = (tmp_path / n for n in ("old.sql3", "new.sql3", "changes.sql3"))
+    make_fts(old, make_rows(200))
+    # A later build, with newer messages and an edited one
+    rows = list(make_rows(250))
+    rows[10] = (*rows[10][:2], "Edited about tracker", *rows[10][3:])
+    make_fts(new, rows)
+
+    summary = diff_databases(old, new, changes)
+    assert summary["fulltext"] == (51, 0)
+    assert summary["fts_meta"] == (1, 0)
+
+    apply_changes(changes, old)
+    queries = (
+        "SELECT rowid, * FROM fulltext ORDER BY rowid",
+        "SELECT * FROM fts_meta ORDER BY key",
+        "SELECT * FROM fts_suggest",
+        "SELECT rowid FROM fulltext WHERE fulltext MATCH 'tracker'",
+        "SELECT rowid FROM fulltext_trigram WHERE fulltext_trigram MATCH '\"CMSSW_3_1\"' ORDER BY rowid",
+        "SELECT rowid FROM fulltext_trigram WHERE fulltext_trigram MATCH 'Edited'",
+    )
+    assert dump(old, *queries) == dump(new, *queries)
+    with contextlib.closing(sqlite3.connect(str(old))) as db:
+        db.execute("INSERT INTO fulltext(fulltext) VALUES('integrity-check')")
+        db.execute(
+            "INSERT INTO fulltext_trigram(fulltext_trigram, rank) VALUES('integrity-check', 1)"
+        )
+
+
+def test_diff_cli(synthetic_db, tmp_path):
+    old, new = tmp_path / "old.sql3", tmp_path / "new.sql3"
+    shutil.copyfile(synthetic_db, old)
+    shutil.copyfile(synthetic_db, new)
+    with contextlib.closing(sqlite3.connect(str(new))) as db:
+        db.execute("UPDATE msgs SET title = 'Changed' WHERE responses = '/forum0/1'")
+        db.execute("DELETE FROM msgs WHERE responses = '/forum1/1'")
+        db.execute("DELETE FROM people WHERE user_id = 'user3'")
+        db.commit()
+
+    def run(*args):
+        return subprocess.run(
+            [sys.executable, "-m", "hypernewsviewer.model", *map(str, args)],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+
+    changes = tmp_path / "changes.sql3"
+    assert run("diff", old, new, "-o", changes).returncode == 0
+    patched = tmp_path / "patched.sql3"
+    assert run("patch", changes, old, "-o", patched).returncode == 0
+
+    queries = [f"SELECT * FROM {t} ORDER BY 1" for t in ("msgs", "forums", "people")]
+    assert dump(patched, *queries) == dump(new, *queries)
+
+    # Only the build it was made from can be patched
+    result = run("patch", changes, new)
+    assert result.returncode != 0
+    assert "is not the build" in result.stderr
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "changes.sql3",
+        "new.sql3",
+        "old.sql3",
+        "patched.sql3",
+    ]
+
+
+def test_diff_schemas(tmp_path):
+    old, new = tmp_path / "old.sql3", tmp_path / "new.sql3"
+    make_fts(old, make_rows(10))
+    with contextlib.closing(sqlite3.connect(str(new))) as db:
+        create_fts(db)
+        fill_fts(db, make_rows(10))
+        finish_fts(db)
+    with pytest.raises(ValueError, match="schemas"):
+        diff_databases(old, new, tmp_path / "changes.sql3")
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import pstats
+import subprocess
+import sys
+
+import pytest
+import sqlalchemy
+
+from hypernewsviewer.model.messages import mapper_registry
+from hypernewsviewer.model.profiling import categorize
+
+
+@pytest.mark.parametrize(
+    ("key", "category"),
+    [
+        (("/site-packages/dateutil/parser/_parser.py", 1, "parse"), "date conversion"),
+        (("~", 0, "<method 'execute' of 'sqlite3.Cursor' objects>"), "SQL"),
+        (("/site-packages/bs4/__init__.py", 1, "get_text"), "HTML extraction"),
+        (("~", 0, "<built-in method posix.stat>"), "filesystem"),
+        (("/src/hypernewsviewer/model/converter.py", 1, "<dictcomp>"), "parse"),
+        (("/src/hypernewsviewer/core.py", 1, "get"), "other"),
+    ],
+)
+def test_categorize(key, category):
+    assert categorize(key) == category
+
+
+def test_profile(synthetic_root, tmp_path):
+    profile = tmp_path / "tree.prof"
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "hypernewsviewer.model",
+            f"--root={synthetic_root}",
+            f"--profile={profile}",
+            "tree",
+            "forum0/1",
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    assert "Profile by category" in result.stdout
+    assert pstats.Stats(str(profile)).total_calls > 0
+
+
+def test_populate_search_empty(tmp_path):
+    db = tmp_path / "empty.sql3"
+    engine = sqlalchemy.create_engine(f"sqlite:///{db}")
+    mapper_registry.metadata.create_all(engine)
+    engine.dispose()
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "hypernewsviewer.model",
+            f"--root={tmp_path}",
+            f"--db={db}",
+            "populate-search",
+            f"--fts={tmp_path / 'shards'}",
+            "--shard-by-year",
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    assert "No messages to index" in result.stdout
@@ -136,6 +136,32 @@ def test_get_msg_paths(db):
     assert classic_results == results
 
 
+def test_get_msgs_page(db):
+    forums = AllForums(root=HNFILES)
+    dbf = DBForums(root=HNFILES, engine=db)
+
+    results = dbf.get_msgs_page("hnTest", "", limit=100)
+    classic_results = forums.get_msgs_page("hnTest", "", limit=100)
+    assert len(results) == 100
+    assert classic_results == results
+    assert [r.num for r in results] == list(range(688, 588, -1))
+
+    results = dbf.get_msgs_page("hnTest", "", before=589, limit=100)
+    classic_results = forums.get_msgs_page("hnTest", "", before=589, limit=100)
+    assert classic_results == results
+    assert results[0].num == 588
+
+    results = dbf.get_msgs_page("hnTest", "", before=3, limit=100)
+    classic_results = forums.get_msgs_page("hnTest", "", before=3, limit=100)
+    assert [r.num for r in results] == [2, 1]
+    assert classic_results == results
+
+    results = dbf.get_msgs_page("hnTest", "6", limit=100)
+    classic_results = forums.get_msgs_page("hnTest", "6", limit=100)
+    assert len(results) == 3
+    assert classic_results == results
+
+
 def test_get_num_msgs(db):
     forums = AllForums(root=HNFILES)
     dbf = DBForums(root=HNFILES, engine=db)
@@ -163,6 +189,35 @@ def test_get_num_msgs(db):
     assert forums.get_num_msgs("hnTest", "6/1", recursive=True) == 1
 
 
+def test_get_subtree(db):
+    forums = AllForums(root=HNFILES)
+    dbf = DBForums(root=HNFILES, engine=db)
+
+    results = list(dbf.get_subtree("hnTest", ""))
+    classic_results = list(forums.get_subtree("hnTest", ""))
+    assert len(results) == 876
+    assert [r.responses for r in results] == [r.responses for r in classic_results]
+
+    results = list(dbf.get_subtree("hnTest", "6"))
+    classic_results = list(forums.get_subtree("hnTest", "6"))
+    assert len(results) == 4
+    assert classic_results == results
+
+
+def walk_tree_stem(path: Path, parent: str) -> str:
+    return f"{parent}/{path.stem}"
+
+
+def test_walk_tree(db):
+    forums = AllForums(root=HNFILES)
+    dbf = DBForums(root=HNFILES, engine=db)
+
+    results = list(dbf.walk_tree("hnTest", "", walk_tree_stem, ""))
+    classic_results = list(forums.walk_tree("hnTest", "", walk_tree_stem, ""))
+    assert len(results) == 876
+    assert classic_results == results
+
+
 def test_get_member(db):
     forums = AllForums(root=HNFILES)
     dbf = DBForums(root=HNFILES, engine=db)
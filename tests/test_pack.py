@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+
+import pytest
+
+from hypernewsviewer.model.cache import FileCache
+from hypernewsviewer.model.pack import Pack, pack_names, write_pack
+from hypernewsviewer.model.structure import AllForums, PackedForums
+from hypernewsviewer.model.synthetic import ArchiveShape, generate
+
+
+def test_pack_file(tmp_path):
+    root = tmp_path / "files"
+    root.joinpath("a/1").mkdir(parents=True)
+    root.joinpath("a/1/1.txt").write_text("nested")
+    root.joinpath("a/1.txt").write_text("x" * 1000)
+    root.joinpath("a/2.txt").write_bytes(b"\x00\xff")
+    root.joinpath("a/db.sql3").write_text("skipped")
+    root.joinpath("a/link.txt").symlink_to(root / "a/2.txt")
+    root.joinpath("a/outside.txt").symlink_to(tmp_path)
+    root.joinpath("a/missing.txt").symlink_to(root / "a/3.txt")
+    root.joinpath("b.txt").write_text("top")
+
+    names = pack_names(root)
+    assert names == ["a/1.txt", "a/1/1.txt", "a/2.txt", "a/link.txt", "b.txt"]
+    assert write_pack(root, names, tmp_path / "test.hnpack") == 1011
+
+    with Pack(tmp_path / "test.hnpack") as pack:
+        assert len(pack) == 5
+        assert "a/1.txt" in pack
+        assert "a/3.txt" not in pack
+        assert pack.read("a/1.txt") == b"x" * 1000
+        assert pack.read("a/2.txt") == b"\x00\xff"
+        assert pack.read("a/link.txt") == b"\x00\xff"
+        assert pack.is_alias("a/link.txt")
+        assert not pack.is_alias("a/2.txt")
+        assert pack.listdir("") == ["b.txt"]
+        assert pack.listdir("a") == ["1.txt", "2.txt", "link.txt"]
+        assert pack.listdir("a/1/") == ["1.txt"]
+        assert pack.listdir("c") == []
+        assert list(pack.walk("a")) == ["1.txt", "1/1.txt", "2.txt", "link.txt"]
+        with pytest.raises(FileNotFoundError):
+            pack.read("a/3.txt")
+
+    with pytest.raises(ValueError, match="not a hyper-model pack"):
+        Pack(root / "b.txt")
+
+
+def test_packed_forums(synthetic_root, tmp_path):
+    output = tmp_path / "synthetic.hnpack"
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "hypernewsviewer.model",
+            f"--root={synthetic_root}",
+            "pack",
+            str(output),
+        ],
+        capture_output=True,
+        check=True,
+    )
+
+    all_forums = AllForums(root=synthetic_root)
+    with Pack(output) as pack:
+        for cache in (None, FileCache(max_entries=1000)):
+            # The files are never read, they only need to be in the pack
+            packed = PackedForums(root=tmp_path / "missing", pack=pack, cache=cache)
+            assert packed.get_categories() == all_forums.get_categories()
+            assert packed.get_num_forums() == all_forums.get_num_forums()
+            assert list(packed.get_forums_iter()) == list(all_forums.get_forums_iter())
+            assert list(packed.get_member_iter()) == list(all_forums.get_member_iter())
+            assert packed.get_member("user1") == all_forums.get_member("user1")
+            for forum in ("forum0", "forum3"):
+                assert packed.get_num_msgs(
+                    forum, "", recursive=True
+                ) == all_forums.get_num_msgs(forum, "", recursive=True)
+                assert list(packed.get_subtree(forum, "")) == list(
+                    all_forums.get_subtree(forum, "")
+                )
+                assert packed.get_msgs_page(
+                    forum, "", limit=10
+                ) == all_forums.get_msgs_page(forum, "", limit=10)
+                assert packed.get_html(forum, "") == all_forums.get_html(forum, "")
+            assert packed.get_msg("forum0", "1") == all_forums.get_msg("forum0", "1")
+            assert packed.get_html("forum0", "1") == all_forums.get_html("forum0", "1")
+            with pytest.raises(FileNotFoundError):
+                packed.get_msg("forum0", "100000")
+
+
+def test_packed_member_alias(tmp_path):
+    root = tmp_path / "files"
+    generate(root, ArchiveShape(messages=10, forums=1, members=3))
+    root.joinpath("hnpeople/alias").symlink_to(root / "hnpeople/user1")
+    names = pack_names(root)
+    assert "hnpeople/alias" in names
+    write_pack(root, names, tmp_path / "test.hnpack")
+
+    all_forums = AllForums(root=root)
+    with Pack(tmp_path / "test.hnpack") as pack:
+        packed = PackedForums(root=root, pack=pack)
+        # Aliases are members too, but only listed once, like on disk
+        assert packed.get_member("alias") == all_forums.get_member("alias")
+        assert list(packed.get_member_iter()) == list(all_forums.get_member_iter())
+        with pytest.raises(FileNotFoundError):
+            packed.get_member("nobody")
@@ -0,0 +1,392 @@
+from __future__ import annotations
+
+import contextlib
+import itertools
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+import sqlalchemy
+
+from hypernewsviewer.model.fts import add_trigram, create_fts, fill_fts, finish_fts
+from hypernewsviewer.search import (
+    DATE_MAX,
+    SearchCache,
+    run_search,
+    snapshot_id,
+    substring_query,
+    suggest_terms,
+)
+from hypernewsviewer.sqlstats import track_queries
+
+WORDS = ["tracker", "muon", "trigger", "pixel", "alignment", "jet"]
+
+
+def make_rows():
+    start = datetime(2005, 1, 1)
+    for i in range(300):
+        words = " ".join(WORDS[j % len(WORDS)] for j in range(i % 7 + 1))
+        yield (
+            f"/forum{i % 3}/{i}",
+            str(start + timedelta(days=i * 20)),
+            f"Message {i}",
+            f"user{i % 5}",
+            f"Some text about {words} in CMSSW_{i % 4}_{i % 3}_0",
+        )
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    path = tmp_path_factory.mktemp("fts") / "fts.sql3"
+    with contextlib.closing(sqlite3.connect(str(path))) as db:
+        create_fts(db)
+        fill_fts(db, make_rows())
+        finish_fts(db)
+    return sqlalchemy.create_engine(f"sqlite:///{path}")
+
+
+@pytest.fixture(scope="module")
+def shard_engines(tmp_path_factory):
+    """
+    The same messages, split into one database per year.
+    """
+    path = tmp_path_factory.mktemp("shards")
+    engines = []
+    for year, rows in itertools.groupby(make_rows(), lambda row: row[1][:4]):
+        shard = path / f"fulltext-{year}.sql3"
+        with contextlib.closing(sqlite3.connect(str(shard))) as db:
+            create_fts(db)
+            fill_fts(db, rows)
+            finish_fts(db)
+        engines.append(sqlalchemy.create_engine(f"sqlite:///{shard}"))
+    return engines
+
+
+@pytest.fixture(scope="module")
+def trigram_engine(tmp_path_factory):
+    path = tmp_path_factory.mktemp("fts") / "fts.sql3"
+    with contextlib.closing(sqlite3.connect(str(path))) as db:
+        create_fts(db)
+        fill_fts(db, make_rows())
+        finish_fts(db)
+        add_trigram(db, text=True)
+    return sqlalchemy.create_engine(f"sqlite:///{path}")
+
+
+@pytest.fixture(scope="module")
+def title_trigram_engine(tmp_path_factory):
+    path = tmp_path_factory.mktemp("fts") / "fts.sql3"
+    with contextlib.closing(sqlite3.connect(str(path))) as db:
+        create_fts(db)
+        fill_fts(db, make_rows())
+        finish_fts(db)
+        add_trigram(db, text=False)
+    return sqlalchemy.create_engine(f"sqlite:///{path}")
+
+
+@pytest.fixture(scope="module")
+def unordered_engine(tmp_path_factory):
+    """
+    A database made before rowids followed the dates.
+    """
+    path = tmp_path_factory.mktemp("fts") / "fts.sql3"
+    with contextlib.closing(sqlite3.connect(str(path))) as db:
+        db.execute(
+            "CREATE VIRTUAL TABLE fulltext USING FTS5(responses UNINDEXED, date UNINDEXED, title, from_, text);"
+        )
+        db.executemany(
+            "INSERT INTO fulltext VALUES (?, ?, ?, ?, ?)", reversed(list(make_rows()))
+        )
+        db.commit()
+    return sqlalchemy.create_engine(f"sqlite:///{path}")
+
+
+def test_search(engine):
+    results = run_search(engine, "pixel", seconds=10)
+    assert not results.timed_out
+    assert len(results.rows) == 50
+    assert all("<mark>pixel</mark>" in row[4] for row in results.rows)
+
+    last = run_search(engine, "pixel", page=4, seconds=10)
+    # pixel is in 171 messages
+    assert len(last.rows) == 171 - 150
+
+
+def test_search_date_range(engine):
+    results = run_search(
+        engine, "tracker", start="2006-01-01", stop="2006-12-31", seconds=10
+    )
+    assert results.rows
+    assert all(row[2].startswith("2006") for row in results.rows)
+
+
+@pytest.mark.parametrize(
+    ("start", "stop"),
+    [
+        ("2006-01-01", "2006-12-31"),
+        ("2005-01-01", "2005-01-01"),
+        ("2030-01-01", DATE_MAX),
+    ],
+)
+def test_search_date_rowids(engine, unordered_engine, start, stop):
+    results = run_search(
+        engine, "tracker", start=start, stop=stop, count=True, seconds=10
+    )
+    expected = run_search(
+        unordered_engine, "tracker", start=start, stop=stop, count=True, seconds=10
+    )
+    assert sorted(results.rows) == sorted(expected.rows)
+    assert results.hits == expected.hits
+
+
+def test_search_budget(engine):
+    results = run_search(engine, "tracker OR muon", seconds=10, steps=1000)
+    assert results.timed_out
+    assert not results.rows
+
+    results = run_search(engine, "tracker OR muon", seconds=0)
+    assert results.timed_out
+
+    # The connection is usable again after an interrupted query
+    results = run_search(engine, "tracker", seconds=10)
+    assert not results.timed_out
+
+
+def test_search_keyset(engine):
+    first = run_search(engine, "pixel", seconds=10, count=True)
+    assert first.hits == 171
+
+    rows = list(first.rows)
+    found = first
+    while found.next_cursor is not None:
+        found = run_search(engine, "pixel", after=found.next_cursor, seconds=10)
+        rows += found.rows
+    assert len(rows) == 171
+    assert len(set(rows)) == 171
+
+    offset_rows = []
+    for page in range(1, 5):
+        offset_rows += run_search(engine, "pixel", page=page, seconds=10).rows
+    assert offset_rows == rows
+
+
+def test_search_facets(engine, shard_engines):
+    results = run_search(engine, "pixel", count=True, seconds=10)
+    assert sum(results.forums.values()) == 171
+    assert sum(results.authors.values()) == 171
+    assert set(results.forums) == {"forum0", "forum1", "forum2"}
+
+    sharded = run_search(shard_engines, "pixel", count=True, seconds=10)
+    assert sharded.forums == results.forums
+    assert sharded.authors == results.authors
+
+    # The forum column is only used for filtering
+    assert not run_search(engine, "forum1", seconds=10).rows
+
+
+def test_search_facets_all(engine, shard_engines):
+    # Counted over all the matches, not just the first (oldest) ones
+    results = run_search(engine, "pixel", count=True, seconds=10)
+    newest = run_search(engine, "pixel", start="2006-01-01", count=True, seconds=10)
+    assert 0 < newest.hits < results.hits
+    assert sum(newest.forums.values()) == newest.hits
+    sharded = run_search(
+        shard_engines, "pixel", start="2006-01-01", count=True, seconds=10
+    )
+    assert sharded.hits == newest.hits
+    assert sharded.forums == newest.forums
+    assert sharded.authors == newest.authors
+
+
+@pytest.mark.parametrize("name", ["engine", "unordered_engine"])
+def test_search_filters(request, name):
+    engine = request.getfixturevalue(name)
+    everything = run_search(engine, "pixel", count=True, seconds=10)
+
+    results = run_search(engine, "pixel", forum="forum1", count=True, seconds=10)
+    assert results.hits == everything.forums["forum1"]
+    assert results.forums == {"forum1": results.hits}
+    assert all(row[0].startswith("/forum1/") for row in results.rows)
+
+    results = run_search(engine, "pixel", author="user2", count=True, seconds=10)
+    assert results.hits == everything.authors["user2"]
+    assert all(row[3] == "user2" for row in results.rows)
+
+    assert not run_search(engine, "pixel", forum="forum", seconds=10).rows
+
+
+@pytest.mark.parametrize(
+    ("query", "substring"),
+    [
+        ("CMSSW_12_4_0", "CMSSW_12_4_0"),
+        ('"SW_1_2"', "SW_1_2"),
+        ("src/Tracker/data.txt", "src/Tracker/data.txt"),
+        ("muon", None),
+        ("muon trigger", None),
+        ('"ab"', None),
+        ("title:muon_x", None),
+    ],
+)
+def test_substring_query(query, substring):
+    assert substring_query(query) == substring
+
+
+def test_search_trigram(engine, trigram_engine):
+    # i % 4 == 1 and i % 3 == 2
+    results = run_search(trigram_engine, '"SW_1_2"', count=True, seconds=10)
+    assert results.substring
+    assert results.hits == 25
+    # Snippets are at most 64 characters long with trigrams
+    assert all("<mark>SW_" in row[4] for row in results.rows)
+
+    # The words around the identifier do not match as substrings
+    assert not run_search(engine, '"SW_1_2"', seconds=10).rows
+
+    dated = run_search(
+        trigram_engine,
+        "CMSSW_1_2",
+        start="2009-01-01",
+        stop="2009-12-31",
+        author="user2",
+        seconds=10,
+    )
+    assert dated.rows
+    assert all(row[2].startswith("2009") for row in dated.rows)
+    assert all(row[3] == "user2" for row in dated.rows)
+
+    # Other queries still use the main index
+    assert not run_search(trigram_engine, "pixel", seconds=10).substring
+
+
+def test_search_trigram_titles(engine, trigram_engine, title_trigram_engine):
+    # The bodies are not in this index, so only title queries use it
+    results = run_search(title_trigram_engine, "CMSSW_1_2", count=True, seconds=10)
+    assert not results.substring
+    assert results.hits == 25
+
+    # Message 12, and 120 to 129
+    for trigram in (trigram_engine, title_trigram_engine):
+        results = run_search(trigram, 'title:"sage 12"', count=True, seconds=10)
+        assert results.substring
+        assert results.hits == 11
+    assert not run_search(engine, 'title:"sage 12"', seconds=10).rows
+
+
+def test_search_shards(engine, shard_engines):
+    assert len(shard_engines) == 17
+
+    first = run_search(shard_engines, "pixel", seconds=10, count=True)
+    assert first.hits == 171
+    rows = list(first.rows)
+    found = first
+    while found.next_cursor is not None:
+        found = run_search(shard_engines, "pixel", after=found.next_cursor, seconds=10)
+        rows += found.rows
+    assert len(rows) == 171
+
+    # Ranks are per shard, so only the set of results is the same
+    expected = run_search(engine, "pixel", page=4, seconds=10).rows
+    for page in range(1, 4):
+        expected += run_search(engine, "pixel", page=page, seconds=10).rows
+    assert sorted(rows) == sorted(expected)
+
+    offset_rows = []
+    for page in range(1, 5):
+        offset_rows += run_search(shard_engines, "pixel", page=page, seconds=10).rows
+    assert offset_rows == rows
+
+    dated = run_search(
+        shard_engines, "tracker", start="2006-01-01", stop="2006-12-31", seconds=10
+    )
+    assert dated.rows
+    assert all(row[2].startswith("2006") for row in dated.rows)
+
+
+def test_search_shards_tracked(shard_engines):
+    # The shards are searched on a thread pool, which still counts as the request
+    with track_queries() as stats:
+        run_search(shard_engines, "pixel", seconds=10)
+    assert stats.count >= len(shard_engines)
+
+
+@pytest.mark.parametrize("name", ["engine", "shard_engines", "unordered_engine"])
+def test_suggest_terms(request, name):
+    engines = request.getfixturevalue(name)
+    assert suggest_terms(engines, "Mes", column="title") == ["message"]
+    assert sorted(suggest_terms(engines, "us", column="from_")) == [
+        f"user{i}" for i in range(5)
+    ]
+    assert suggest_terms(engines, "us", column="from_", limit=2) == ["user0", "user1"]
+    assert suggest_terms(engines, "pix", column="title") == []
+
+
+def test_search_cache(engine, tmp_path):
+    path = tmp_path / "fts.sql3"
+    path.write_bytes(b"")
+    cache = SearchCache(max_entries=2, max_bytes=1_000_000)
+    key = cache.make_key(snapshot_id(path), "pixel  muon", page=1)
+    assert key == cache.make_key(snapshot_id(path), " pixel muon", page=1)
+    assert cache.get(key) is None
+
+    results = run_search(engine, "pixel", seconds=10)
+    cache.put(key, results)
+    cached = cache.get(key)
+    assert cached.cached
+    assert not results.cached
+    assert cached.rows == results.rows
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A new file (like a rebuilt database) has a new snapshot
+    path.unlink()
+    path.write_bytes(b"new")
+    assert cache.make_key(snapshot_id(path), "pixel muon", page=1) != key
+
+    for page in range(2, 5):
+        cache.put(cache.make_key("other", "pixel", page=page), results)
+    assert cache.get(key) is None
+    assert len(cache._entries) == 2
+
+
+def test_search_cache_shared(engine, tmp_path):
+    shared = tmp_path / "searchcache.sql3"
+    first = SearchCache(max_entries=10, max_bytes=1_000_000, shared=shared)
+    second = SearchCache(max_entries=10, max_bytes=1_000_000, shared=shared)
+
+    results = run_search(engine, "pixel", seconds=10, count=True)
+    key = first.make_key("snap", "pixel")
+    first.put(key, results)
+    cached = second.get(key)
+    assert cached.cached
+    assert cached.rows == results.rows
+    assert second.hits == 1
+
+
+def test_search_cache_shared_bounded(engine, tmp_path):
+    shared = tmp_path / "searchcache.sql3"
+    results = run_search(engine, "pixel", seconds=10, count=True)
+    size = len(results.to_json())
+    cache = SearchCache(max_entries=10, max_bytes=3 * size, shared=shared)
+    keys = [cache.make_key("snap", "pixel", page=page) for page in range(5)]
+    for key in keys:
+        cache.put(key, results)
+
+    # Only the newest entries that fit are kept in the shared file
+    with contextlib.closing(sqlite3.connect(str(shared))) as db:
+        kept = {key for (key,) in db.execute("SELECT key FROM cache")}
+    assert kept == set(keys[2:])
+
+
+def test_search_cache_unavailable(tmp_path, caplog):
+    # The directory is created if needed, but a file is in the way here
+    tmp_path.joinpath("file").write_text("")
+    cache = SearchCache(
+        max_entries=10, max_bytes=1_000_000, shared=tmp_path / "file/cache.sql3"
+    )
+    assert cache.shared is None
+    assert "caching in memory only" in caplog.text
+
+    cache = SearchCache(
+        max_entries=10, max_bytes=1_000_000, shared=tmp_path / "new/cache.sql3"
+    )
+    assert cache.shared is not None
+    assert cache.shared.exists()
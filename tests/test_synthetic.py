@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import os
+
+import sqlalchemy
+
+from hypernewsviewer.model.cache import FileCache
+from hypernewsviewer.model.structure import AllForums, DBForums
+from hypernewsviewer.model.synthetic import ArchiveShape, generate
+
+
+def test_generate(synthetic_root):
+    forums = AllForums(root=synthetic_root)
+    assert forums.get_num_forums() == 4
+    assert forums.get_num_members() == 50
+    assert len(forums.get_categories()) == 5
+
+    sizes = [forums.get_num_msgs(f"forum{i}", "", recursive=True) for i in range(4)]
+    assert sum(sizes) == 400
+    assert sizes[0] > sizes[-1]
+
+    msgs = list(forums.get_msgs("forum0", "", recursive=True))
+    assert max(m.responses.count("/") for m in msgs) > 3
+    assert all(forums.get_html("forum0", m.responses.split("/", 2)[2]) for m in msgs)
+    assert forums.get_member(msgs[0].from_).status == "Member"
+
+
+def test_generate_db(synthetic_root, synthetic_db):
+    all_forums = AllForums(root=synthetic_root)
+    engine = sqlalchemy.create_engine(f"sqlite:///{synthetic_db}")
+    db_forums = DBForums(root=synthetic_root, engine=engine)
+    try:
+        for forums in (all_forums, db_forums):
+            assert forums.get_num_msgs("forum1", "", recursive=True) > 0
+        assert [
+            m.responses for m in db_forums.get_msgs_page("forum0", "", limit=20)
+        ] == [m.responses for m in all_forums.get_msgs_page("forum0", "", limit=20)]
+        # Numeric order, with siblings past 9, from the top or from a message
+        for path in ("", "1"):
+            assert [m.responses for m in db_forums.get_subtree("forum0", path)] == [
+                m.responses for m in all_forums.get_subtree("forum0", path)
+            ]
+    finally:
+        engine.dispose()
+
+
+def test_readahead(synthetic_root):
+    serial = AllForums(root=synthetic_root)
+    parallel = AllForums(root=synthetic_root, readahead=4)
+
+    def responses(forums: AllForums) -> list[str]:
+        return [m.responses for m in forums.get_msgs("forum0", "", recursive=True)]
+
+    assert responses(parallel) == responses(serial)
+    assert [m.responses for m in parallel.get_msgs_page("forum0", "", limit=20)] == [
+        m.responses for m in serial.get_msgs_page("forum0", "", limit=20)
+    ]
+    assert list(parallel.get_member_iter()) == list(serial.get_member_iter())
+    assert list(parallel.get_forums_iter()) == list(serial.get_forums_iter())
+    paths = [m.responses.split("/", 2)[2] for m in serial.get_msgs("forum0", "1")]
+    assert list(parallel.get_htmls("forum0", paths)) == [
+        serial.get_html("forum0", path) for path in paths
+    ]
+
+    # Stopping early cancels the reads still queued
+    msgs = parallel.get_msgs("forum0", "")
+    assert next(msgs).responses == "/forum0/1"
+    msgs.close()
+
+
+def test_file_cache(tmp_path):
+    generate(tmp_path, ArchiveShape(messages=20, forums=1, members=5))
+    cache = FileCache(max_entries=100)
+    forums = AllForums(root=tmp_path, cache=cache)
+
+    msgs = list(forums.get_msgs("forum0", "", recursive=True))
+    misses = cache.misses
+    assert list(forums.get_msgs("forum0", "", recursive=True)) == msgs
+    assert forums.get_msg("forum0", "1") is msgs[0]
+    assert cache.misses == misses
+    assert len(cache) <= 100
+
+    # A changed file is read again
+    urc = tmp_path / "forum0" / "1.html,urc"
+    urc.write_text(urc.read_text().replace("Title: ", "Title: Changed "))
+    os.utime(urc, ns=(0, urc.stat().st_mtime_ns + 10**9))
+    assert forums.get_msg("forum0", "1").title.startswith("Changed")
+
+    # A new file changes the directory, so it is listed again
+    num = forums.get_num_msgs("forum0", "")
+    (tmp_path / "forum0" / f"{num + 1}.html,urc").write_text(urc.read_text())
+    os.utime(urc.parent, ns=(0, urc.parent.stat().st_mtime_ns + 10**9))
+    assert forums.get_num_msgs("forum0", "") == num + 1
+
+    # With a TTL, files are not checked again until it runs out
+    forums.cache = FileCache(max_entries=2, ttl=60)
+    title = forums.get_msg("forum0", "1").title
+    urc.write_text(urc.read_text().replace("Title: ", "Title: Again "))
+    assert forums.get_msg("forum0", "1").title == title
+    forums.get_member("user0")
+    forums.get_member("user1")
+    assert len(forums.cache) == 2
+    assert forums.get_msg("forum0", "1").title.startswith("Again")
+
+
+def test_file_cache_bytes(tmp_path):
+    generate(tmp_path, ArchiveShape(messages=20, forums=1, members=5))
+    body = tmp_path / "forum0" / "1-body.html"
+    size = len(body.read_text())
+    cache = FileCache(max_entries=100, max_bytes=3 * size)
+    forums = AllForums(root=tmp_path, cache=cache)
+
+    # Bodies are dropped to stay under the size, other entries are not counted
+    for i in range(1, 11):
+        forums.get_html("forum0", str(i))
+    list(forums.get_msgs("forum0", ""))
+    assert 0 < cache.size <= cache.max_bytes
+    assert len(cache) > 3
+
+    # A body larger than the whole cache is not kept
+    large = "x" * 4 * size
+    body.write_text(large)
+    os.utime(body, ns=(0, body.stat().st_mtime_ns + 10**9))
+    cached = cache.size
+    assert forums.get_html("forum0", "1") == large
+    assert cache.size <= cached
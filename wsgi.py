@@ -8,10 +8,12 @@ from hypernewsviewer.app import app as application
 class HealthCheckFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
         msg = record.getMessage()
+        if '"GET /metrics ' in msg:
+            return False
         return "kube-probe" not in msg or '"GET / HTTP/1.1" 200' not in msg
 
 
-# Remove health check from application server logs
+# Remove health checks and metrics scrapes from application server logs
 logging.getLogger("gunicorn.access").addFilter(HealthCheckFilter())
 
 logger = logging.getLogger(__name__)